@@ -1,13 +1,28 @@
 """agentml package"""
 
-from dotenv import load_dotenv
+import importlib
+from typing import TYPE_CHECKING, Any
 
-from config import PROJECT_PATH
+if TYPE_CHECKING:
+    from .manager import AsyncManager, Manager
 
-from .manager import Manager
+__all__ = ["AsyncManager", "Manager"]
 
-__all__ = ["Manager"]
+# Attributes imported on first access, so that importing the package stays fast
+_LAZY_ATTRIBUTES = {
+    "AsyncManager": ".manager",
+    "Manager": ".manager",
+}
 
-env_loaded = load_dotenv(PROJECT_PATH.joinpath(".env"))
-if not env_loaded:
-    raise RuntimeError("Failed to load environment variables")
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *__all__})
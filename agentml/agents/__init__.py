@@ -1,8 +1,33 @@
 """agentml.agent package"""
 
-from .base import Agent
-from .coder import Coder
-from .planner import Planner
-from .vision import Vision
+import importlib
+from typing import TYPE_CHECKING, Any
+
+if TYPE_CHECKING:
+    from .base import Agent
+    from .coder import Coder
+    from .planner import Planner
+    from .vision import Vision
 
 __all__ = ["Agent", "Coder", "Planner", "Vision"]
+
+# Attributes imported on first access, so that importing the package stays fast
+_LAZY_ATTRIBUTES = {
+    "Agent": ".base",
+    "Coder": ".coder",
+    "Planner": ".planner",
+    "Vision": ".vision",
+}
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *__all__})
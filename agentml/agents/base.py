@@ -4,9 +4,15 @@ agentml/agents/base.py
 Agent abstract base class file
 """
 
+import asyncio
+import queue
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Callable, Iterator
 from uuid import UUID
 
+from agentml.context import ContextWindow
+from agentml.conversation import Conversation
 from agentml.models import LlmMessage
 
 
@@ -32,7 +38,7 @@ Reply "TERMINATE" in the end when everything is done.
         self,
         session_id: UUID,
         objective: str,
-        messages: list[LlmMessage] = None,
+        messages: Conversation | list[LlmMessage] | None = None,
         prompt: str = DEFAULT_SYSTEM_MESSAGE,
     ) -> None:
         """
@@ -41,26 +47,145 @@ Reply "TERMINATE" in the end when everything is done.
         Args:
             session_id (UUID): Session ID
             objective (str): Objective of the agent
-            messages (list[LlmMessage], optional): List of messages to be used for the agent. Defaults to [].
+            messages (Conversation | list[LlmMessage] | None, optional): History the agent continues, without modifying it. Defaults to None.
             prompt (str, optional): Prompt to be used for the agent. Defaults to DEFAULT_SYSTEM_MESSAGE.
         """
 
         self.session_id: UUID = session_id
         self.objective: str = objective
-        self.messages: list[LlmMessage] = messages or []
+        self.messages: Conversation = Conversation.of(messages)
         self.prompt: str = prompt
 
+        # Callback receiving the tokens of the model responses as they are generated
+        self.on_token: Callable[[str], None] | None = None
+
     @abstractmethod
     def run(self) -> list[LlmMessage]:
         """Run the agent"""
         raise NotImplementedError
 
+    async def arun(self) -> list[LlmMessage]:
+        """
+        Run the agent without blocking the event loop
+
+        Agents without a native asyncio implementation run in a worker thread.
+        """
+        return await asyncio.to_thread(self.run)
+
+    def stream(self) -> Iterator[str | list[LlmMessage]]:
+        """
+        Run the agent, streaming the tokens of the model responses
+
+        Yields:
+            str | list[LlmMessage]: Tokens as they are generated, then the messages of the run
+        """
+
+        tokens: queue.Queue[str | None] = queue.Queue()
+        on_token = self.on_token
+
+        def forward(token: str) -> None:
+            tokens.put(token)
+            if on_token is not None:
+                on_token(token)
+
+        self.on_token = forward
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(self.run)
+                future.add_done_callback(lambda _: tokens.put(None))
+
+                while (token := tokens.get()) is not None:
+                    yield token
+        finally:
+            self.on_token = on_token
+
+        yield future.result()
+
+    async def astream(self) -> AsyncIterator[str | list[LlmMessage]]:
+        """
+        Run the agent on the event loop, streaming the tokens of the model responses
+
+        Yields:
+            str | list[LlmMessage]: Tokens as they are generated, then the messages of the run
+        """
+
+        loop = asyncio.get_running_loop()
+        tokens: asyncio.Queue[str | None] = asyncio.Queue()
+        on_token = self.on_token
+
+        def forward(token: str) -> None:
+            # Agents without a native asyncio implementation stream from a worker thread
+            loop.call_soon_threadsafe(tokens.put_nowait, token)
+            if on_token is not None:
+                on_token(token)
+
+        self.on_token = forward
+        try:
+            task = asyncio.create_task(self.arun())
+            task.add_done_callback(lambda _: tokens.put_nowait(None))
+
+            while (token := await tokens.get()) is not None:
+                yield token
+        finally:
+            self.on_token = on_token
+
+        yield await task
+
+    def get_completion(self, client: Any, **kwargs) -> str:
+        """
+        Get the content of a chat completion, streaming its tokens to on_token if set
+
+        Args:
+            client (Any): OpenAI client
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            str: Content of the response
+        """
+
+        if self.on_token is None:
+            response = client.chat.completions.create(**kwargs)
+            return response.choices[0].message.content
+
+        content = []
+        for chunk in client.chat.completions.create(stream=True, **kwargs):
+            if chunk.choices and (token := chunk.choices[0].delta.content):
+                content.append(token)
+                self.on_token(token)
+
+        return "".join(content)
+
+    async def aget_completion(self, client: Any, **kwargs) -> str:
+        """
+        Get the content of a chat completion on the event loop, streaming its tokens to on_token if set
+
+        Args:
+            client (Any): AsyncOpenAI client
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            str: Content of the response
+        """
+
+        if self.on_token is None:
+            response = await client.chat.completions.create(**kwargs)
+            return response.choices[0].message.content
+
+        content = []
+        async for chunk in await client.chat.completions.create(stream=True, **kwargs):
+            if chunk.choices and (token := chunk.choices[0].delta.content):
+                content.append(token)
+                self.on_token(token)
+
+        return "".join(content)
+
     def get_messages(self) -> list[dict[str, str]]:
         """
-        Get the list of messages
+        Get the list of messages, compacted to the context budget of the model
 
         Returns:
             list[dict[str, str]]: List of messages in JSON format
         """
 
-        return [msg.model_dump(mode="json") for msg in self.messages]
+        messages = ContextWindow(self.DEFAULT_MODEL).fit(list(self.messages))
+        return [msg.to_dict() for msg in messages]
@@ -1,20 +1,84 @@
 """agentml/agents/coder.py"""
 
 import re
+import time
+from typing import Callable
 from uuid import UUID
 
+from agentml.conversation import Conversation
+from agentml.formatter import format_output
 from agentml.models import LlmMessage, LlmRole
+from agentml.oai import async_client as async_openai
 from agentml.oai import client as openai
-from agentml.sandbox import Sandbox
+from agentml.sandbox import ExecutionResult, OutputChunk, Sandbox
+from agentml.scheduler import Priority
+from config import CODER_CELL_MODE, CODER_EARLY_EXECUTION, CODER_LOCAL_FORMATTER
 
 from .base import Agent
 
 
+class CodeFence:
+    """
+    Incremental detection of the python code block of a streamed response
+
+    Only the text received since the last token is searched, so detecting the closing
+    fence stays linear in the length of the response.
+    """
+
+    OPEN = "```python"
+    CLOSE = "```"
+
+    def __init__(self) -> None:
+        """CodeFence constructor"""
+        self.content: str = ""
+        self.start: int | None = None
+        self.scanned: int = 0
+
+    def feed(self, token: str) -> str | None:
+        """
+        Add a token of the response
+
+        Args:
+            token (str): Token
+
+        Returns:
+            str | None: Code once the code block is closed, otherwise None
+        """
+
+        self.content += token
+
+        if self.start is None:
+            index = self.content.find(
+                self.OPEN, max(self.scanned - len(self.OPEN) + 1, 0)
+            )
+            self.scanned = len(self.content)
+            if index == -1:
+                return None
+            self.start = self.scanned = index + len(self.OPEN)
+
+        end = self.content.find(
+            self.CLOSE, max(self.scanned - len(self.CLOSE) + 1, self.start)
+        )
+        self.scanned = len(self.content)
+        if end == -1:
+            return None
+
+        return self.content[self.start : end].strip()
+
+
 class Coder(Agent):
     """Coder Agent"""
 
     DEFAULT_MODEL = "gpt-4-1106-preview"
 
+    # Prompt of the model formatting the sandbox output
+    FORMATTER_PROMPT = """You are a raw text to pretty markdown converter.
+Format the output from the code execution to pretty markdown.
+It must be in a markdown as format: ```markdown\n{pretty output}\n```
+        """
+
+    FORMATTER_MODEL = "gpt-3.5-turbo-1106"
+
     DEFAULT_SYSTEM_MESSAGE = """You are a helpful AI assistant that writes python code.
 You are given a task to solve along with the context of the previous steps.
 
@@ -28,6 +92,8 @@ Do not suggest incomplete code which requires users to modify.
 All the packages and libraries are already installed.
 Only provide the code for main.py.
 The dataset is in file "data.csv"
+Load CSV files with `from agentml_data import read_csv` instead of pandas.read_csv.
+It takes the same arguments and loads the dataset much faster from a memory-mapped cache.
 
 If the code will output a file or image, save the file in the output directory.
 This applies to any plots, charts, graphs, or images. Use appropriate name and extensions.
@@ -40,12 +106,40 @@ Rewrite the entire file starting from the imports and ending,
 with the last line outputting the result of the intended task.
     """
 
+    CELL_SYSTEM_MESSAGE = """You are a helpful AI assistant that writes python code.
+You are given a task to solve along with the context of the previous steps.
+
+You are only allowed to use python code to solve the task.
+The code block must be a valid starting with ```python and ending with ```.
+
+There must only be 1 code block in the response.
+The code runs as the next cell of a persistent python session, like a notebook.
+All the variables and imports from the previous cells are still defined.
+The dataset from file "data.csv" is already loaded in the pandas DataFrame `df`.
+Load other CSV files with `from agentml_data import read_csv` instead of pandas.read_csv.
+Only provide the new code for this step, do not repeat the previous cells.
+Do not suggest incomplete code which requires users to modify.
+
+All the packages and libraries are already installed.
+
+If the code will output a file or image, save the file in the output directory.
+This applies to any plots, charts, graphs, or images. Use appropriate name and extensions.
+All images must be saved as .jpg files.
+
+Use appropriate variable names and comments to make the code readable.
+Use appropriate colors and labels for plots, charts, and graphs.
+
+The last line of the cell must output the result of the intended task.
+    """
+
     def __init__(
         self,
         session_id: UUID,
         objective: str,
-        messages: list[LlmMessage] = None,
+        messages: Conversation | list[LlmMessage] | None = None,
         prompt: str = DEFAULT_SYSTEM_MESSAGE,
+        cell_mode: bool = CODER_CELL_MODE,
+        early_execution: bool = CODER_EARLY_EXECUTION,
     ) -> None:
         """
         Coder Agent constructor
@@ -53,21 +147,35 @@ with the last line outputting the result of the intended task.
         Args:
             session_id (UUID): Session ID
             objective (str): Objective of the agent
-            messages (list[LlmMessage], optional): List of messages to be used for the agent. Defaults to [].
+            messages (Conversation | list[LlmMessage] | None, optional): History the agent continues, without modifying it. Defaults to None.
             prompt (str, optional): Prompt to be used for the agent. Defaults to DEFAULT_SYSTEM_MESSAGE.
+            cell_mode (bool, optional): Run the code as incremental cells in the session kernel. Defaults to CODER_CELL_MODE.
+            early_execution (bool, optional): Stream the response and run the code as soon as its code block is closed. Defaults to CODER_EARLY_EXECUTION.
         """
 
+        if cell_mode and prompt == self.DEFAULT_SYSTEM_MESSAGE:
+            prompt = self.CELL_SYSTEM_MESSAGE
+
         super().__init__(
             session_id=session_id, objective=objective, messages=messages, prompt=prompt
         )
 
         self.sandbox = Sandbox(session_id=session_id)
+        self.cell_mode: bool = cell_mode
+        self.early_execution: bool = early_execution
 
         self.messages.extend(
             [
-                LlmMessage(role=LlmRole.SYSTEM, content=self.prompt),
+                LlmMessage.system(self.prompt),
                 LlmMessage(role=LlmRole.USER, content=self.objective),
-                LlmMessage(role=LlmRole.USER, content=self.sandbox.get_file_content()),
+                LlmMessage(
+                    role=LlmRole.USER,
+                    content=(
+                        self.sandbox.get_namespace_content()
+                        if self.cell_mode
+                        else self.sandbox.get_file_content()
+                    ),
+                ),
             ]
         )
 
@@ -75,44 +183,238 @@ with the last line outputting the result of the intended task.
 
         self.code: str | None = None
 
+        # Callback receiving the sandbox output while the code is running
+        self.on_output: Callable[[OutputChunk], None] | None = None
+
     def run(self) -> list[LlmMessage]:
         """Run the agent"""
         print(f"Coder.run: Sending request to OpenAI API: {self.objective}")
-        response = openai.chat.completions.create(
-            model=self.DEFAULT_MODEL,
-            messages=self.get_messages(),
-        )
+        start = time.perf_counter()
+        if self.early_execution:
+            code = self.get_streamed_code(
+                model=self.DEFAULT_MODEL, messages=self.get_messages()
+            )
+        else:
+            content = self.get_completion(
+                openai,
+                model=self.DEFAULT_MODEL,
+                messages=self.get_messages(),
+            )
+            print(f"Coder.run: Received response from OpenAI API: {content}")
+            code = self.get_code(content)
+        llm_time = time.perf_counter() - start
+
+        if self.cell_mode:
+            result = self.sandbox.execute_cell(
+                code=code, on_output=self.on_output, label=self.objective
+            )
+        else:
+            self.sandbox.update(code=code)
+            result = self.sandbox.execute(
+                on_output=self.on_output, label=self.objective
+            )
+        output = self.get_output(result)
+
+        messages = self.get_code_messages(code, llm_time)
+
+        start = time.perf_counter()
+        output = self.get_pretty_output(messages, output)
+        format_time = time.perf_counter() - start
+
+        return self.add_output_message(messages, output, result, format_time)
+
+    async def arun(self) -> list[LlmMessage]:
+        """Run the agent on the event loop"""
+        print(f"Coder.arun: Sending request to OpenAI API: {self.objective}")
+        start = time.perf_counter()
+        if self.early_execution:
+            code = await self.aget_streamed_code(
+                model=self.DEFAULT_MODEL, messages=self.get_messages()
+            )
+        else:
+            content = await self.aget_completion(
+                async_openai,
+                model=self.DEFAULT_MODEL,
+                messages=self.get_messages(),
+            )
+            print(f"Coder.arun: Received response from OpenAI API: {content}")
+            code = self.get_code(content)
+        llm_time = time.perf_counter() - start
+
+        if self.cell_mode:
+            result = await self.sandbox.execute_cell_async(
+                code=code, on_output=self.on_output, label=self.objective
+            )
+        else:
+            self.sandbox.update(code=code)
+            result = await self.sandbox.execute_async(
+                on_output=self.on_output, label=self.objective
+            )
+        output = self.get_output(result)
+
+        messages = self.get_code_messages(code, llm_time)
+
+        start = time.perf_counter()
+        output = await self.aget_pretty_output(messages, output)
+        format_time = time.perf_counter() - start
+
+        return self.add_output_message(messages, output, result, format_time)
+
+    def get_streamed_code(self, **kwargs) -> str | None:
+        """
+        Stream the response until its code block is closed, discarding the text after it
+
+        Args:
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            str | None: Code, or None if the response has no python code block
+        """
+
+        fence = CodeFence()
+        stream = openai.chat.completions.create(stream=True, **kwargs)
+        try:
+            for chunk in stream:
+                if not chunk.choices or not (token := chunk.choices[0].delta.content):
+                    continue
+                if self.on_token is not None:
+                    self.on_token(token)
+                if (code := fence.feed(token)) is not None:
+                    print(f"Coder.run: Received code from OpenAI API: {fence.content}")
+                    return code
+        finally:
+            # Stop the generation of the rest of the response
+            stream.close()
+
+        print(f"Coder.run: Received response from OpenAI API: {fence.content}")
+        return self.get_code(fence.content)
+
+    async def aget_streamed_code(self, **kwargs) -> str | None:
+        """
+        Stream the response on the event loop until its code block is closed, discarding the text after it
+
+        Args:
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            str | None: Code, or None if the response has no python code block
+        """
+
+        fence = CodeFence()
+        stream = await async_openai.chat.completions.create(stream=True, **kwargs)
+        try:
+            async for chunk in stream:
+                if not chunk.choices or not (token := chunk.choices[0].delta.content):
+                    continue
+                if self.on_token is not None:
+                    self.on_token(token)
+                if (code := fence.feed(token)) is not None:
+                    print(f"Coder.arun: Received code from OpenAI API: {fence.content}")
+                    return code
+        finally:
+            # Stop the generation of the rest of the response
+            await stream.close()
+
+        print(f"Coder.arun: Received response from OpenAI API: {fence.content}")
+        return self.get_code(fence.content)
+
+    @staticmethod
+    def get_code(response_content: str) -> str | None:
+        """
+        Get the python code block of a response
+
+        Args:
+            response_content (str): Response of the model
+
+        Returns:
+            str | None: Code, or None if the response has no python code block
+        """
 
-        print(f"Coder.run: Received response from OpenAI API: {response}")
-        response_content = response.choices[0].message.content
         matched = re.search(r"```python(.*?)```", response_content, re.DOTALL)
         if matched:
-            code = matched.group(1).strip()
-        else:
-            code = None
+            return matched.group(1).strip()
+
+        return None
+
+    @staticmethod
+    def get_output(result: ExecutionResult) -> str:
+        """
+        Get the output of an execution for the model
+
+        Args:
+            result (ExecutionResult): Execution result
+
+        Returns:
+            str: Output, with the reason the sandbox stopped the code if it did
+        """
 
-        self.sandbox.update(code=code)
-        output, output_files = self.sandbox.execute()
+        output = result.output
+
+        # Tell the model why the sandbox stopped the code instead of hanging
+        if termination := result.describe_termination():
+            output += f"\n{termination}"
         # TODO: validate output
 
         print(f"Coder.run: Sandbox output: {output}")
-        for file in output_files:
+        for file in result.files:
             print(f"Coder.run: Sandbox output file: {file}")
+        for file in result.changes.deleted:
+            print(f"Coder.run: Sandbox deleted file: {file}")
 
-        messages = [
+        return output
+
+    def get_code_messages(self, code: str | None, llm_time: float) -> list[LlmMessage]:
+        """
+        Get the messages of the objective and the generated code
+
+        Args:
+            code (str | None): Generated code
+            llm_time (float): Seconds taken by the model to generate the code
+
+        Returns:
+            list[LlmMessage]: Messages
+        """
+
+        return [
             LlmMessage(role=LlmRole.USER, content=self.objective),
             LlmMessage(
                 role=LlmRole.ASSISTANT,
                 content=f"Here is the code:\n```python\n{code}\n```",
+                metadata={"llm_time": llm_time},
             ),
         ]
 
-        output = self.get_pretty_output(messages, output)
+    def add_output_message(
+        self,
+        messages: list[LlmMessage],
+        output: str,
+        result: ExecutionResult,
+        format_time: float,
+    ) -> list[LlmMessage]:
+        """
+        Add the execution output to the messages of the run
+
+        Args:
+            messages (list[LlmMessage]): Messages of the objective and the code
+            output (str): Formatted output
+            result (ExecutionResult): Execution result
+            format_time (float): Seconds taken to format the output
+
+        Returns:
+            list[LlmMessage]: Messages of the run
+        """
 
         if output:
             messages.append(
                 LlmMessage(
-                    role=LlmRole.ASSISTANT, content=f"Here is the output:\n{output}"
+                    role=LlmRole.ASSISTANT,
+                    content=f"Here is the output:\n{output}",
+                    metadata={
+                        "execution": result.profile(),
+                        "format_time": format_time,
+                        "stderr": result.stderr,
+                        "files": [file.name for file in result.files],
+                    },
                 ),
             )
 
@@ -128,8 +430,16 @@ with the last line outputting the result of the intended task.
         )
         return self.run()
 
-    @staticmethod
-    def get_pretty_output(messages: list[LlmMessage], output: str) -> str:
+    async def aretry(self) -> list[LlmMessage]:
+        """Retry the agent on the event loop"""
+        self.messages.extend(self._last_messages)
+        self.messages.append(
+            LlmMessage(role=LlmRole.SYSTEM, content="Please try again.")
+        )
+        return await self.arun()
+
+    @classmethod
+    def get_pretty_output(cls, messages: list[LlmMessage], output: str) -> str:
         """
         Get pretty output from messages
 
@@ -138,23 +448,56 @@ with the last line outputting the result of the intended task.
             output (str): Output from sandbox
         """
 
-        formatter_prompt = """You are a raw text to pretty markdown converter.
-Format the output from the code execution to pretty markdown.
-It must be in a markdown as format: ```markdown\n{pretty output}\n```
+        if CODER_LOCAL_FORMATTER and (pretty := format_output(output)) is not None:
+            print("Coder.get_pretty_output: Formatted output locally")
+            return pretty
+
+        print("Coder.get_pretty_output: Getting pretty output")
+        response = openai.chat.completions.create(
+            model=cls.FORMATTER_MODEL,
+            messages=cls.get_formatter_messages(output),
+            priority=Priority.LOW,
+        )
+        return response.choices[0].message.content
+
+    @classmethod
+    async def aget_pretty_output(cls, messages: list[LlmMessage], output: str) -> str:
+        """
+        Get pretty output from messages on the event loop
+
+        Args:
+            messages (list[LlmMessage]): LLM Messages
+            output (str): Output from sandbox
+        """
+
+        if CODER_LOCAL_FORMATTER and (pretty := format_output(output)) is not None:
+            print("Coder.aget_pretty_output: Formatted output locally")
+            return pretty
+
+        print("Coder.aget_pretty_output: Getting pretty output")
+        response = await async_openai.chat.completions.create(
+            model=cls.FORMATTER_MODEL,
+            messages=cls.get_formatter_messages(output),
+            priority=Priority.LOW,
+        )
+        return response.choices[0].message.content
+
+    @classmethod
+    def get_formatter_messages(cls, output: str) -> list[dict[str, str]]:
+        """
+        Get the messages asking the formatter model to format an output
+
+        Args:
+            output (str): Output from sandbox
+
+        Returns:
+            list[dict[str, str]]: Messages in JSON format
         """
 
-        # Build messages to send to OpenAI API
         messages = [
-            LlmMessage(role=LlmRole.SYSTEM, content=formatter_prompt),
+            LlmMessage.system(cls.FORMATTER_PROMPT),
             LlmMessage(role=LlmRole.USER, content=output),
         ]
 
         # Convert messages to JSON
-        messages = [msg.model_dump(mode="json") for msg in messages]
-
-        print("Coder.get_pretty_output: Getting pretty output")
-        response = openai.chat.completions.create(
-            model="gpt-3.5-turbo-1106",
-            messages=messages,
-        )
-        return response.choices[0].message.content
+        return [msg.to_dict() for msg in messages]
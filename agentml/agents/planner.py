@@ -3,7 +3,9 @@
 import json
 from uuid import UUID
 
+from agentml.conversation import Conversation
 from agentml.models import LlmMessage, LlmRole
+from agentml.oai import async_client as async_openai
 from agentml.oai import client as openai
 
 from .base import Agent
@@ -36,24 +38,40 @@ Return a json object of the tool_calls array with a list of tools and objectives
     {
         "tool_calls": [
             {
+                "id": 1,
                 "tool": "Planner",
                 "objective": "Outline the steps to load the dataset and understand the data",
+                "depends_on": [],
             },
             {
+                "id": 2,
                 "tool": "Coder",
                 "objective": "Load the dataset and print the first 5 rows",
+                "depends_on": [1],
             },
             {
+                "id": 3,
                 "tool": "Coder",
                 "objective": "Print the shape of the dataset",
+                "depends_on": [1],
             },
             {
+                "id": 4,
+                "tool": "Coder",
+                "objective": "Plot the distributions of the columns and save the charts",
+                "depends_on": [1],
+            },
+            {
+                "id": 5,
                 "tool": "Vision",
                 "objective": "Understand the charts and graphs to get the next steps",
+                "depends_on": [4],
             },
             {
+                "id": 6,
                 "tool": "Planner",
                 "objective": "Outline the next steps to prepare and preprocess the data",
+                "depends_on": [2, 3, 5],
             },
         ]
     }
@@ -61,9 +79,12 @@ Return a json object of the tool_calls array with a list of tools and objectives
 Note:
 - The json object must contain only 1 key: tool_calls
 - The tool_calls array must contain at least 1 item and at most 6 items
-- Each item in the tool_calls array must contain 2 keys: tool and objective
+- Each item in the tool_calls array must contain 4 keys: id, tool, objective and depends_on
+- The id key must be a unique integer identifying the step
 - The tool key must be one of the following: Planner, Coder, Vision
 - The objective key must be a string explaining the next step to solve the problem
+- The depends_on key must list the ids of the earlier steps whose results or files the step needs
+- Steps that do not depend on each other are run at the same time in separate copies of the environment, so a step must depend on every step it needs
 - In most cases, the first tool will be Coder and the last tool will be Planner
 
 Now, outline the steps to solve the problem.
@@ -73,7 +94,7 @@ Now, outline the steps to solve the problem.
         self,
         session_id: UUID,
         objective: str,
-        messages: list[LlmMessage] = None,
+        messages: Conversation | list[LlmMessage] | None = None,
         prompt: str = DEFAULT_SYSTEM_MESSAGE,
     ) -> None:
         """
@@ -82,7 +103,7 @@ Now, outline the steps to solve the problem.
         Args:
             session_id (UUID): Session ID
             objective (str): Objective of the agent
-            messages (list[LlmMessage], optional): List of messages to be used for the agent. Defaults to [].
+            messages (Conversation | list[LlmMessage] | None, optional): History the agent continues, without modifying it. Defaults to None.
             prompt (str, optional): Prompt to be used for the agent. Defaults to DEFAULT_SYSTEM_MESSAGE.
         """
 
@@ -92,7 +113,7 @@ Now, outline the steps to solve the problem.
 
         self.messages.extend(
             [
-                LlmMessage(role=LlmRole.SYSTEM, content=self.prompt),
+                LlmMessage.system(self.prompt),
                 LlmMessage(role=LlmRole.USER, content=self.objective),
             ]
         )
@@ -103,18 +124,52 @@ Now, outline the steps to solve the problem.
     def run(self) -> list[LlmMessage]:
         """Run the agent"""
         print(f"Planner.run: Sending request to OpenAI API: {self.objective}")
-        response = openai.chat.completions.create(
+        content = self.get_completion(
+            openai,
+            model=self.DEFAULT_MODEL,
+            messages=self.get_messages(),
+            response_format={"type": "json_object"},
+        )
+
+        print(f"Planner.run: Received response from OpenAI API: {content}")
+        return self.get_plan_messages(content)
+
+    async def arun(self) -> list[LlmMessage]:
+        """Run the agent on the event loop"""
+        print(f"Planner.arun: Sending request to OpenAI API: {self.objective}")
+        content = await self.aget_completion(
+            async_openai,
             model=self.DEFAULT_MODEL,
             messages=self.get_messages(),
             response_format={"type": "json_object"},
         )
 
-        print(f"Planner.run: Received response from OpenAI API: {response}")
-        plan = json.loads(response.choices[0].message.content).get("tool_calls", [])
+        print(f"Planner.arun: Received response from OpenAI API: {content}")
+        return self.get_plan_messages(content)
+
+    def get_plan_messages(self, response_content: str) -> list[LlmMessage]:
+        """
+        Parse the plan of a response
+
+        Args:
+            response_content (str): JSON response of the model
+
+        Returns:
+            list[LlmMessage]: Messages of the objective and the plan
+        """
+
+        plan = json.loads(response_content).get("tool_calls", [])
 
         # Remove the first plan if it is Planner
         if plan and plan[0]["tool"] == "Planner":
-            plan.pop(0)
+            removed = plan.pop(0)
+
+            # The steps depending on it can start right away
+            for task in plan:
+                if isinstance(task.get("depends_on"), list):
+                    task["depends_on"] = [
+                        step for step in task["depends_on"] if step != removed.get("id")
+                    ]
 
         self.plan = plan
 
@@ -1,8 +1,11 @@
 """agentml/agents/vision.py"""
 
+import asyncio
 from uuid import UUID
 
+from agentml.conversation import Conversation
 from agentml.models import LlmMessage, LlmRole
+from agentml.oai import async_client as async_openai
 from agentml.oai import client as openai
 from agentml.sandbox import Sandbox
 
@@ -28,7 +31,7 @@ This analysis will be used to plan the next steps to solve the problem.
         self,
         session_id: UUID,
         objective: str,
-        messages: list[LlmMessage] = None,
+        messages: Conversation | list[LlmMessage] | None = None,
         prompt: str = DEFAULT_SYSTEM_MESSAGE,
     ) -> None:
         """
@@ -37,7 +40,7 @@ This analysis will be used to plan the next steps to solve the problem.
         Args:
             session_id (UUID): Session ID
             objective (str): Objective of the agent
-            messages (list[LlmMessage], optional): List of messages to be used for the agent. Defaults to [].
+            messages (Conversation | list[LlmMessage] | None, optional): History the agent continues, without modifying it. Defaults to None.
             prompt (str, optional): Prompt to be used for the agent. Defaults to DEFAULT_SYSTEM_MESSAGE.
         """
 
@@ -49,7 +52,7 @@ This analysis will be used to plan the next steps to solve the problem.
 
         self.messages.extend(
             [
-                LlmMessage(role=LlmRole.SYSTEM, content=self.prompt),
+                LlmMessage.system(self.prompt),
                 LlmMessage(role=LlmRole.USER, content=self.objective),
             ]
         )
@@ -60,23 +63,67 @@ This analysis will be used to plan the next steps to solve the problem.
 
     def run(self) -> list[LlmMessage]:
         """Run the agent"""
-        encoded_images = self.sandbox.get_images_encoded()
+        image_messages = self.get_image_messages(self.sandbox.get_images_encoded())
+
+        print("Vision.run: Sending request to OpenAI API with images")
+        content = self.get_completion(
+            openai,
+            model=self.DEFAULT_MODEL,
+            messages=image_messages,
+        )
+
+        print(f"Vision.run: Received response from OpenAI API: {content}")
+        return self.get_analysis_messages(content)
+
+    async def arun(self) -> list[LlmMessage]:
+        """Run the agent on the event loop"""
+        image_messages = self.get_image_messages(
+            await asyncio.to_thread(self.sandbox.get_images_encoded)
+        )
+
+        print("Vision.arun: Sending request to OpenAI API with images")
+        content = await self.aget_completion(
+            async_openai,
+            model=self.DEFAULT_MODEL,
+            messages=image_messages,
+        )
+
+        print(f"Vision.arun: Received response from OpenAI API: {content}")
+        return self.get_analysis_messages(content)
+
+    def get_image_messages(self, encoded_images: list[str]) -> list[dict]:
+        """
+        Get the messages asking the model to analyze images
+
+        Args:
+            encoded_images (list[str]): Images as data URLs
+
+        Returns:
+            list[dict]: Messages in JSON format
+        """
+
         image_messages = [
             {"type": "image_url", "image_url": {"url": image}}
             for image in encoded_images
         ]
 
-        print("Vision.run: Sending request to OpenAI API with images")
-        response = openai.chat.completions.create(
-            model=self.DEFAULT_MODEL,
-            messages=[
-                {"role": "system", "content": self.prompt},
-                {"role": "user", "content": image_messages},
-            ],
-        )
+        return [
+            {"role": "system", "content": self.prompt},
+            {"role": "user", "content": image_messages},
+        ]
+
+    def get_analysis_messages(self, analysis: str) -> list[LlmMessage]:
+        """
+        Get the messages of the objective and the image analysis
+
+        Args:
+            analysis (str): Analysis of the images by the model
+
+        Returns:
+            list[LlmMessage]: Messages
+        """
 
-        print(f"Vision.run: Received response from OpenAI API: {response}")
-        self.analysis = response.choices[0].message.content
+        self.analysis = analysis
 
         messages = [
             LlmMessage(role=LlmRole.USER, content=self.objective),
@@ -97,3 +144,11 @@ This analysis will be used to plan the next steps to solve the problem.
             LlmMessage(role=LlmRole.SYSTEM, content="Please try again.")
         )
         return self.run()
+
+    async def aretry(self) -> list[LlmMessage]:
+        """Retry the agent on the event loop"""
+        self.messages.extend(self._last_messages)
+        self.messages.append(
+            LlmMessage(role=LlmRole.SYSTEM, content="Please try again.")
+        )
+        return await self.arun()
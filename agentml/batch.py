@@ -0,0 +1,505 @@
+"""
+agentml/batch.py
+
+Batch runner of Manager sessions for a manifest of (goal, dataset) jobs
+
+Each job runs in its own process and sandbox session, with a timeout. Finished jobs are
+appended to a checkpoint, so that running the same manifest again resumes where it
+stopped, and the results of all the jobs are consolidated in a results file.
+"""
+
+import contextlib
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import time
+import traceback
+from enum import Enum
+from pathlib import Path
+from uuid import UUID, uuid4
+
+from pydantic import BaseModel, ValidationError
+
+from config import (
+    BATCH_DIR,
+    BATCH_JOB_TIMEOUT,
+    BATCH_STOP_GRACE,
+    BATCH_WORKERS,
+    LLM_RATE_LIMITS,
+)
+
+from .sandbox import Sandbox
+
+# Files of the sandbox kept as the artifacts of a job
+ARTIFACTS = ["main.py", "output"]
+
+
+class BatchJob(BaseModel):
+    """Goal and dataset of a batch job"""
+
+    id: str
+    goal: str
+    csv: Path
+
+    # Other dataset files and directories
+    files: list[Path] = []
+
+    # Seconds before the job is stopped (None for no limit)
+    timeout: float | None = BATCH_JOB_TIMEOUT
+
+
+class JobStatus(Enum):
+    """Batch Job Status"""
+
+    COMPLETED = "completed"
+    FAILED = "failed"
+    TIMEOUT = "timeout"
+    CRASHED = "crashed"
+
+
+class JobResult(BaseModel):
+    """Result of a batch job"""
+
+    id: str
+    status: JobStatus
+    session_id: UUID
+
+    # Unix time of the start, and wall-clock seconds of the job
+    started: float
+    duration: float
+
+    # Traceback of a failed job, or reason of a stopped job
+    error: str | None = None
+
+    # LLM requests and tokens of the job, and their statistics by model
+    requests: int = 0
+    tokens: int = 0
+    llm: dict[str, dict] = {}
+
+    # Sandbox executions of the job
+    executions: int = 0
+
+    # Files kept from the sandbox and log of the job, relative to the batch directory
+    artifacts: list[Path] = []
+    log: Path | None = None
+
+
+def load_manifest(path: Path) -> list[BatchJob]:
+    """
+    Load the jobs of a manifest
+
+    Each line is a JSON object with the goal, csv, and optionally the id, files and
+    timeout of a job. Relative paths are relative to the manifest. Jobs without an id are
+    identified by their goal and datasets, to be recognized when the manifest is edited.
+
+    Args:
+        path (Path): JSONL manifest file
+
+    Returns:
+        list[BatchJob]: Jobs, in the order of the manifest
+
+    Raises:
+        ValueError: If a line is not a valid job, or two jobs have the same id
+    """
+
+    jobs = []
+    with open(path) as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+
+            try:
+                data = json.loads(line)
+                data.setdefault(
+                    "id",
+                    hashlib.sha1(
+                        json.dumps(
+                            [data.get("goal"), data.get("csv"), data.get("files", [])]
+                        ).encode()
+                    ).hexdigest()[:12],
+                )
+                job = BatchJob(**data)
+            except (json.JSONDecodeError, TypeError, ValidationError) as e:
+                raise ValueError(f"Batch: Invalid job on line {number}: {e}") from e
+
+            job.csv = path.parent.joinpath(job.csv)
+            job.files = [path.parent.joinpath(file) for file in job.files]
+            jobs.append(job)
+
+    ids = [job.id for job in jobs]
+    duplicates = sorted({id_ for id_ in ids if ids.count(id_) > 1})
+    if duplicates:
+        raise ValueError(f"Batch: Duplicate job ids: {', '.join(duplicates)}")
+
+    return jobs
+
+
+def load_checkpoint(path: Path) -> dict[str, JobResult]:
+    """
+    Load the results of the jobs finished by the previous runs
+
+    Args:
+        path (Path): JSONL checkpoint file
+
+    Returns:
+        dict[str, JobResult]: Last result of each job
+    """
+
+    results = {}
+    if not path.exists():
+        return results
+
+    with open(path) as f:
+        for line in f:
+            try:
+                result = JobResult(**json.loads(line))
+            except (json.JSONDecodeError, TypeError, ValidationError):
+                # Line cut short by an interrupted run
+                continue
+            results[result.id] = result
+
+    return results
+
+
+def get_rate_limits(workers: int) -> dict[str, dict]:
+    """
+    Share the rate limits of each model between the job processes
+
+    Args:
+        workers (int): Jobs running at once
+
+    Returns:
+        dict[str, dict]: Rate limits of each model in a job process
+    """
+
+    from .scheduler import DEFAULT_LIMITS, RateLimits
+
+    # The models without their own limits get a share of the default limits
+    rate_limits = {}
+    for model, limits in {DEFAULT_LIMITS: {}, **LLM_RATE_LIMITS}.items():
+        shared = RateLimits(**limits).model_dump()
+        for name, value in shared.items():
+            if value is not None:
+                shared[name] = max(type(value)(value / workers), 1)
+        rate_limits[model] = shared
+
+    return rate_limits
+
+
+def run_job(
+    job: BatchJob, session_id: UUID, job_dir: Path, rate_limits: dict[str, dict]
+) -> None:
+    """
+    Run the Manager session of a job, in the process of the job
+
+    The output of the job, sandbox executions included, goes to its log. The statistics
+    and error of the session are saved in the result.json file of the job directory.
+
+    Args:
+        job (BatchJob): Job
+        session_id (UUID): Session ID
+        job_dir (Path): Directory of the log and result of the job
+        rate_limits (dict[str, dict]): Rate limits of each model in the job process
+    """
+
+    # Stopped jobs unwind, shutting down their sandbox workers and kernels
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(1))
+
+    log = open(job_dir.joinpath("run.log"), "w")
+    os.dup2(log.fileno(), sys.stdout.fileno())
+    os.dup2(log.fileno(), sys.stderr.fileno())
+    sys.stdout.reconfigure(line_buffering=True)
+
+    from .manager import Manager
+    from .oai import get_llm_scheduler
+
+    scheduler = get_llm_scheduler()
+    scheduler.rate_limits = rate_limits
+
+    manager = None
+    error = None
+    try:
+        manager = Manager(
+            goal=job.goal, csv=job.csv, session_id=session_id, files=job.files
+        )
+        manager.run()
+    except Exception:
+        error = traceback.format_exc()
+        print(error)
+
+    result = {
+        "error": error,
+        "llm": scheduler.stats(),
+        "executions": (
+            manager.sandbox.get_execution_stats()["executions"] if manager else 0
+        ),
+    }
+    with open(job_dir.joinpath("result.json.tmp"), "w") as f:
+        json.dump(result, f)
+    os.replace(job_dir.joinpath("result.json.tmp"), job_dir.joinpath("result.json"))
+
+
+class BatchRunner:
+    """
+    Runner of the jobs of a manifest on a pool of processes
+
+    Jobs are started in fresh interpreters, so that a crashed or stuck job only takes
+    down its own process: jobs over their timeout are stopped, then killed after a grace
+    period. The sandbox of each job is deleted once its artifacts are kept.
+    """
+
+    def __init__(
+        self,
+        manifest: Path,
+        output_dir: Path | None = None,
+        workers: int = BATCH_WORKERS,
+        retry_failed: bool = False,
+    ) -> None:
+        """
+        BatchRunner constructor
+
+        Args:
+            manifest (Path): JSONL manifest of the jobs
+            output_dir (Path | None, optional): Directory of the checkpoint, results and artifacts. Defaults to BATCH_DIR/<manifest name>.
+            workers (int, optional): Jobs running at once. Defaults to BATCH_WORKERS.
+            retry_failed (bool, optional): Run the jobs that did not complete in a previous run again. Defaults to False.
+        """
+
+        self.jobs: list[BatchJob] = load_manifest(manifest)
+        self.output_dir: Path = output_dir or BATCH_DIR.joinpath(manifest.stem)
+        self.workers: int = max(workers, 1)
+        self.retry_failed: bool = retry_failed
+
+        self.checkpoint_path: Path = self.output_dir.joinpath("checkpoint.jsonl")
+        self.results_path: Path = self.output_dir.joinpath("results.json")
+
+        self.results: dict[str, JobResult] = {}
+        self._context = multiprocessing.get_context("spawn")
+
+    def get_pending(self) -> list[BatchJob]:
+        """
+        Get the jobs left to run, skipping the jobs finished by the previous runs
+
+        Returns:
+            list[BatchJob]: Jobs to run, in the order of the manifest
+        """
+
+        return [
+            job
+            for job in self.jobs
+            if job.id not in self.results
+            or (
+                self.retry_failed and self.results[job.id].status != JobStatus.COMPLETED
+            )
+        ]
+
+    def run(self) -> list[JobResult]:
+        """
+        Run the jobs of the manifest
+
+        Returns:
+            list[JobResult]: Results of the jobs of the manifest, in its order
+        """
+
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.results = load_checkpoint(self.checkpoint_path)
+
+        pending = self.get_pending()
+        print(
+            f"Batch: {len(pending)} of {len(self.jobs)} jobs to run "
+            f"on {self.workers} workers"
+        )
+
+        rate_limits = get_rate_limits(min(self.workers, len(pending)) or 1)
+        running: dict[str, tuple] = {}
+        try:
+            while pending or running:
+                while pending and len(running) < self.workers:
+                    job = pending.pop(0)
+                    running[job.id] = self.start(job, rate_limits)
+
+                for job_id, (job, *state) in list(running.items()):
+                    result = self.poll(job, *state)
+                    if result is not None:
+                        del running[job_id]
+                        self.finish(result)
+
+                time.sleep(0.1)
+        finally:
+            # Interrupted runs stop their jobs, which run again on the next run
+            for job, process, *_ in running.values():
+                self.stop(process)
+
+            self.save_results()
+
+        return [self.results[job.id] for job in self.jobs if job.id in self.results]
+
+    def start(self, job: BatchJob, rate_limits: dict[str, dict]) -> tuple:
+        """
+        Start the process of a job
+
+        Args:
+            job (BatchJob): Job
+            rate_limits (dict[str, dict]): Rate limits of each model in the job process
+
+        Returns:
+            tuple: Job, process, session ID, job directory, and start times
+        """
+
+        session_id = uuid4()
+        job_dir = self.output_dir.joinpath(job.id)
+        shutil.rmtree(job_dir, ignore_errors=True)
+        job_dir.mkdir(parents=True)
+
+        print(f"Batch: Starting job {job.id} (session {session_id})")
+        process = self._context.Process(
+            target=run_job,
+            args=(job, session_id, job_dir, rate_limits),
+            name=f"batch-{job.id}",
+        )
+        process.start()
+
+        return job, process, session_id, job_dir, time.time(), time.monotonic()
+
+    def poll(
+        self,
+        job: BatchJob,
+        process: multiprocessing.Process,
+        session_id: UUID,
+        job_dir: Path,
+        started: float,
+        start: float,
+    ) -> JobResult | None:
+        """
+        Check on the process of a job, stopping it past its timeout
+
+        Returns:
+            JobResult | None: Result of the job, or None if it is still running
+        """
+
+        duration = time.monotonic() - start
+        timed_out = job.timeout is not None and duration > job.timeout
+        if process.is_alive() and not timed_out:
+            return None
+
+        if timed_out:
+            print(f"Batch: Job {job.id} timed out after {duration:.0f}s, stopping it")
+            self.stop(process)
+        process.join()
+
+        result = JobResult(
+            id=job.id,
+            status=JobStatus.COMPLETED,
+            session_id=session_id,
+            started=started,
+            duration=time.monotonic() - start,
+        )
+        if job_dir.joinpath("run.log").exists():
+            result.log = job_dir.joinpath("run.log").relative_to(self.output_dir)
+
+        with contextlib.suppress(FileNotFoundError, json.JSONDecodeError):
+            with open(job_dir.joinpath("result.json")) as f:
+                session = json.load(f)
+            result.error = session["error"]
+            result.llm = session["llm"]
+            result.requests = sum(stats["requests"] for stats in result.llm.values())
+            result.tokens = sum(stats["tokens"] for stats in result.llm.values())
+            result.executions = session["executions"]
+            if result.error is not None:
+                result.status = JobStatus.FAILED
+
+        if timed_out:
+            result.status = JobStatus.TIMEOUT
+            result.error = f"Timed out after {job.timeout:g}s"
+        elif not job_dir.joinpath("result.json").exists():
+            result.status = JobStatus.CRASHED
+            result.error = f"Process exited with code {process.exitcode}"
+
+        result.artifacts = self.keep_artifacts(session_id, job_dir)
+
+        return result
+
+    @staticmethod
+    def stop(process: multiprocessing.Process) -> None:
+        """Stop the process of a job, killing it if it does not exit in time"""
+        process.terminate()
+        process.join(BATCH_STOP_GRACE)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def keep_artifacts(self, session_id: UUID, job_dir: Path) -> list[Path]:
+        """
+        Move the artifacts out of the sandbox of a job, and delete the sandbox
+
+        Args:
+            session_id (UUID): Session ID of the job
+            job_dir (Path): Directory of the job
+
+        Returns:
+            list[Path]: Files kept, relative to the batch directory
+        """
+
+        sandbox_dir = Sandbox.sandbox_base.joinpath(str(session_id))
+        if not sandbox_dir.exists():
+            return []
+
+        for name in ARTIFACTS:
+            path = sandbox_dir.joinpath(name)
+            if path.exists():
+                shutil.move(path, job_dir.joinpath(name))
+
+        Sandbox(session_id=session_id).delete()
+
+        return sorted(
+            path.relative_to(self.output_dir)
+            for name in ARTIFACTS
+            for path in [job_dir.joinpath(name), *job_dir.joinpath(name).rglob("*")]
+            if path.is_file()
+        )
+
+    def finish(self, result: JobResult) -> None:
+        """Checkpoint the result of a finished job"""
+        print(
+            f"Batch: Job {result.id} {result.status.value} in {result.duration:.1f}s, "
+            f"{result.requests} LLM requests, {result.tokens} tokens"
+        )
+
+        self.results[result.id] = result
+        with open(self.checkpoint_path, "a") as f:
+            f.write(result.model_dump_json() + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save_results(self) -> None:
+        """Write the results of the jobs of the manifest, with their totals"""
+        results = [self.results[job.id] for job in self.jobs if job.id in self.results]
+
+        statuses = {status.value: 0 for status in JobStatus}
+        for result in results:
+            statuses[result.status.value] += 1
+
+        summary = {
+            "jobs": len(self.jobs),
+            "pending": len(self.jobs) - len(results),
+            **statuses,
+            "duration": sum(result.duration for result in results),
+            "requests": sum(result.requests for result in results),
+            "tokens": sum(result.tokens for result in results),
+        }
+
+        with open(self.results_path, "w") as f:
+            json.dump(
+                {
+                    "summary": summary,
+                    "jobs": [result.model_dump(mode="json") for result in results],
+                },
+                f,
+                indent=2,
+            )
+
+        print(f"Batch: {summary}, results saved to {self.results_path}")
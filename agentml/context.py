@@ -0,0 +1,353 @@
+"""
+agentml/context.py
+
+Token-budgeted context window of the messages sent to the models
+"""
+
+import functools
+import json
+import re
+from pathlib import Path
+from uuid import UUID
+
+from agentml.models import LlmMessage, LlmRole
+from config import (
+    CONTEXT_BUDGET,
+    CONTEXT_BUDGETS,
+    CONTEXT_SUMMARY_LINE_SIZE,
+    LOGS_DIR,
+)
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Tokens added by the API for each message (role and separators)
+MESSAGE_OVERHEAD = 4
+
+CODE_BLOCK = re.compile(r"```python.*?```", re.DOTALL)
+
+CODE_PREFIX = "Here is the code:"
+OUTPUT_PREFIX = "Here is the output:"
+
+# Replaces the middle of the messages too large for the budget on their own
+TRUNCATED = "\n...(truncated)...\n"
+
+
+@functools.lru_cache(maxsize=16)
+def get_encoding(model: str):
+    """Get the tiktoken encoding of a model, or None if tiktoken is not installed"""
+    if tiktoken is None:
+        return None
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str, model: str) -> int:
+    """
+    Count the tokens of a text
+
+    Args:
+        text (str): Text
+        model (str): Model the text is sent to
+
+    Returns:
+        int: Number of tokens (estimated from the length without tiktoken)
+    """
+
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def append_history(session_id: UUID, messages: list[LlmMessage]) -> None:
+    """
+    Append messages to the full history of a session on disk
+
+    Args:
+        session_id (UUID): Session ID
+        messages (list[LlmMessage]): Messages
+    """
+
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(get_history_path(session_id), "a") as f:
+        for message in messages:
+            f.write(
+                json.dumps({**message.to_dict(), "metadata": message.metadata}) + "\n"
+            )
+
+
+def get_history_path(session_id: UUID) -> Path:
+    """Path of the full history of a session"""
+    return LOGS_DIR.joinpath(f"{session_id}.jsonl")
+
+
+class ContextWindow:
+    """
+    Messages fitted to the token budget of a model
+
+    The history is only compacted when it exceeds the budget, in steps: the outputs
+    of failed attempts are dropped first, then the repeated prompts and superseded code,
+    then the oldest turns are summarized, keeping the most recent turns intact.
+    If the system messages and the most recent turn alone exceed the budget,
+    the middle of the longest messages is cut.
+    """
+
+    def __init__(self, model: str, budget: int | None = None) -> None:
+        """
+        ContextWindow constructor
+
+        Args:
+            model (str): Model the messages are sent to
+            budget (int | None, optional): Maximum tokens of the messages. Defaults to the budget of the model.
+        """
+
+        self.model: str = model
+        self.budget: int = budget or CONTEXT_BUDGETS.get(model, CONTEXT_BUDGET)
+
+    def count(self, messages: list[LlmMessage]) -> int:
+        """
+        Count the tokens of messages
+
+        Args:
+            messages (list[LlmMessage]): Messages
+
+        Returns:
+            int: Number of tokens
+        """
+
+        return sum(
+            count_tokens(message.content, self.model) + MESSAGE_OVERHEAD
+            for message in messages
+        )
+
+    def fit(self, messages: list[LlmMessage]) -> list[LlmMessage]:
+        """
+        Compact messages until they fit the budget
+
+        Args:
+            messages (list[LlmMessage]): Full history
+
+        Returns:
+            list[LlmMessage]: Messages to send
+        """
+
+        tokens = self.count(messages)
+        if tokens <= self.budget:
+            return messages
+
+        for compact in (
+            self.drop_failed,
+            self.drop_superseded,
+            self.summarize,
+            self.truncate,
+        ):
+            messages = compact(messages)
+            if self.count(messages) <= self.budget:
+                break
+
+        print(
+            f"ContextWindow: Compacted {tokens} tokens to {self.count(messages)} "
+            f"for {self.model} (budget {self.budget})"
+        )
+
+        return messages
+
+    @staticmethod
+    def drop_superseded(messages: list[LlmMessage]) -> list[LlmMessage]:
+        """
+        Drop the repeated prompts and the code superseded by a later attempt at the same objective
+
+        Args:
+            messages (list[LlmMessage]): Messages
+
+        Returns:
+            list[LlmMessage]: Compacted messages
+        """
+
+        objectives = get_objectives(messages)
+
+        # Latest position of each prompt, and of the code of each objective
+        latest = {}
+        for index, message in enumerate(messages):
+            if message.role != LlmRole.ASSISTANT:
+                latest[(message.role, message.content)] = index
+            elif message.content.startswith(CODE_PREFIX):
+                latest[(CODE_PREFIX, objectives[index])] = index
+
+        compacted = []
+        for index, message in enumerate(messages):
+            if message.role != LlmRole.ASSISTANT:
+                if latest[(message.role, message.content)] != index:
+                    continue
+            elif message.content.startswith(CODE_PREFIX):
+                if latest[(CODE_PREFIX, objectives[index])] != index:
+                    message = LlmMessage(
+                        role=message.role,
+                        content=CODE_BLOCK.sub(
+                            "(code replaced by a later attempt)", message.content
+                        ),
+                    )
+            compacted.append(message)
+
+        return compacted
+
+    @staticmethod
+    def drop_failed(messages: list[LlmMessage]) -> list[LlmMessage]:
+        """
+        Drop the outputs of failed executions followed by another attempt at the same objective
+
+        Args:
+            messages (list[LlmMessage]): Messages
+
+        Returns:
+            list[LlmMessage]: Compacted messages
+        """
+
+        objectives = get_objectives(messages)
+
+        latest = {}
+        for index, message in enumerate(messages):
+            if is_output(message):
+                latest[objectives[index]] = index
+
+        return [
+            message
+            for index, message in enumerate(messages)
+            if not (
+                is_output(message)
+                and is_failed(message)
+                and latest[objectives[index]] != index
+            )
+        ]
+
+    def summarize(self, messages: list[LlmMessage]) -> list[LlmMessage]:
+        """
+        Replace the oldest turns with a summary, keeping the leading system messages
+        and as many of the most recent messages as the budget allows
+
+        Args:
+            messages (list[LlmMessage]): Messages
+
+        Returns:
+            list[LlmMessage]: Compacted messages
+        """
+
+        head = []
+        for message in messages:
+            if message.role != LlmRole.SYSTEM:
+                break
+            head.append(message)
+
+        rest = messages[len(head) :]
+        available = self.budget - self.count(head)
+
+        # Keep the most recent messages, reserving a quarter of the budget for the summary
+        recent, recent_tokens = [], 0
+        for message in reversed(rest):
+            tokens = self.count([message])
+            if recent and recent_tokens + tokens > available * 3 // 4:
+                break
+            recent.insert(0, message)
+            recent_tokens += tokens
+
+        old = rest[: len(rest) - len(recent)]
+        if not old:
+            return messages
+
+        lines = []
+        for message in old:
+            if message.role == LlmRole.SYSTEM or message.content.startswith(
+                CODE_PREFIX
+            ):
+                continue
+            line = " ".join(CODE_BLOCK.sub("(code)", message.content).split())
+            if len(line) > CONTEXT_SUMMARY_LINE_SIZE:
+                line = line[:CONTEXT_SUMMARY_LINE_SIZE] + "..."
+            prefix = "Task" if message.role == LlmRole.USER else "Result"
+            lines.append(f"- {prefix}: {line}")
+
+        # Drop the oldest lines if the summary itself is over its share of the budget
+        summary_budget = available - recent_tokens
+        while lines:
+            summary = LlmMessage(
+                role=LlmRole.SYSTEM,
+                content="Summary of the earlier steps:\n" + "\n".join(lines),
+            )
+            if self.count([summary]) <= summary_budget:
+                return [*head, summary, *recent]
+            lines.pop(0)
+
+        return [*head, *recent]
+
+    def truncate(self, messages: list[LlmMessage]) -> list[LlmMessage]:
+        """
+        Cut the middle of the longest messages until the messages fit the budget
+
+        Args:
+            messages (list[LlmMessage]): Messages
+
+        Returns:
+            list[LlmMessage]: Compacted messages
+        """
+
+        messages = list(messages)
+        while messages and (excess := self.count(messages) - self.budget) > 0:
+            index = max(range(len(messages)), key=lambda i: len(messages[i].content))
+            message = messages[index]
+            content = message.content
+
+            if len(content) <= len(TRUNCATED):
+                # Nothing left to cut, the budget is smaller than the message overheads
+                messages.pop(0)
+                continue
+
+            # Keep the start and the end of the content, in proportion to the tokens left
+            tokens = count_tokens(content, self.model)
+            keep = max(len(content) * (tokens - excess) // tokens - len(TRUNCATED), 0)
+            messages[index] = LlmMessage(
+                role=message.role,
+                content=content[: keep // 2]
+                + TRUNCATED
+                + content[len(content) - (keep - keep // 2) :],
+                metadata=message.metadata,
+            )
+
+        return messages
+
+
+def get_objectives(messages: list[LlmMessage]) -> list[str | None]:
+    """Get the objective (latest user request) each message belongs to"""
+    objectives = []
+    objective = None
+    for message in messages:
+        if message.role == LlmRole.USER and not message.content.startswith(
+            ("```", "Variables defined")
+        ):
+            objective = message.content
+        objectives.append(objective)
+
+    return objectives
+
+
+def is_output(message: LlmMessage) -> bool:
+    """Check if a message is the output of an execution"""
+    return message.role == LlmRole.ASSISTANT and message.content.startswith(
+        OUTPUT_PREFIX
+    )
+
+
+def is_failed(message: LlmMessage) -> bool:
+    """Check if an output message comes from an execution that failed"""
+    execution = (message.metadata or {}).get("execution")
+    if execution is None:
+        return False
+
+    return execution["termination"] != "completed" or execution["returncode"] != 0
@@ -0,0 +1,103 @@
+"""
+agentml/conversation.py
+
+Conversation history shared by the manager and its agents without copies
+"""
+
+from typing import Iterable, Iterator
+
+from agentml.models import LlmMessage
+
+
+class Conversation:
+    """
+    Append-only list of messages with structural sharing
+
+    A branch shares the messages of its parent up to the branch point (an immutable
+    prefix, since conversations are only appended to) and appends its own messages,
+    so agents build on the manager history without copying or modifying it.
+    """
+
+    __slots__ = ("_prefix", "_prefix_length", "_messages")
+
+    def __init__(
+        self,
+        messages: Iterable[LlmMessage] | None = None,
+        prefix: "Conversation | None" = None,
+    ) -> None:
+        """
+        Conversation constructor
+
+        Args:
+            messages (Iterable[LlmMessage] | None, optional): Messages of the conversation. Defaults to None.
+            prefix (Conversation | None, optional): Conversation whose current messages come first. Defaults to None.
+        """
+
+        self._prefix: Conversation | None = prefix
+        self._prefix_length: int = len(prefix) if prefix is not None else 0
+        self._messages: list[LlmMessage] = list(messages or [])
+
+    @classmethod
+    def of(
+        cls, messages: "Conversation | Iterable[LlmMessage] | None"
+    ) -> "Conversation":
+        """
+        Get a conversation continuing some messages
+
+        Args:
+            messages (Conversation | Iterable[LlmMessage] | None): Conversation to branch, or messages to copy
+
+        Returns:
+            Conversation: New conversation
+        """
+
+        if isinstance(messages, Conversation):
+            return messages.branch()
+
+        return cls(messages)
+
+    def branch(self) -> "Conversation":
+        """
+        Start a conversation continuing the current messages, without copying them
+
+        Returns:
+            Conversation: Branch
+        """
+
+        return Conversation(prefix=self)
+
+    def append(self, message: LlmMessage) -> None:
+        """Append a message"""
+        self._messages.append(message)
+
+    def extend(self, messages: Iterable[LlmMessage]) -> None:
+        """Append messages"""
+        self._messages.extend(messages)
+
+    def to_dicts(self) -> list[dict[str, str]]:
+        """
+        Get the messages in the JSON format of the API
+
+        Returns:
+            list[dict[str, str]]: Messages (memoized per message)
+        """
+
+        return [message.to_dict() for message in self]
+
+    def __iter__(self) -> Iterator[LlmMessage]:
+        if self._prefix is not None:
+            yield from self._prefix.head(self._prefix_length)
+        yield from self._messages
+
+    def head(self, length: int) -> Iterator[LlmMessage]:
+        """Iterate over the first messages of the conversation"""
+        if self._prefix is not None:
+            yield from self._prefix.head(min(length, self._prefix_length))
+            length -= self._prefix_length
+        yield from self._messages[: max(length, 0)]
+
+    def __len__(self) -> int:
+        return self._prefix_length + len(self._messages)
+
+    def __getitem__(self, index: int | slice) -> LlmMessage | list[LlmMessage]:
+        return list(self)[index]
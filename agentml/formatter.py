@@ -0,0 +1,421 @@
+"""
+agentml/formatter.py
+
+Local markdown formatting of the sandbox output
+
+Recognizes the usual outputs of data science code (pandas DataFrame and Series reprs,
+describe() and info() tables, sklearn classification reports, numpy arrays and confusion
+matrices, tracebacks) and renders them as markdown without calling a model.
+"""
+
+import re
+
+# Separator between the stdout and the stderr of an execution output
+ERRORS_SEPARATOR = "\nErrors:\n"
+
+ALIGNED = re.compile(r"\s{2,}")
+SERIES_FOOTER = re.compile(r"^(Name: .*, )?(Length: \d+, )?dtype: \S+$")
+DATAFRAME_FOOTER = re.compile(r"^\[\d+ rows x \d+ columns\]$")
+NUMBER = re.compile(r"^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$|^nan$|^-?inf$")
+EXCEPTION_LINE = re.compile(
+    r"^[A-Za-z_][\w.]*(Error|Exception|Warning|Exit|Interrupt)\b"
+)
+ELLIPSES = ("", "..", "...")
+CLASSIFICATION_HEADER = ["precision", "recall", "f1-score", "support"]
+
+# Lines starting with these characters are escaped so they are not read as markdown
+MARKDOWN_PREFIXES = ("#", ">", "=", "|")
+
+
+class UnknownOutput(ValueError):
+    """Output that cannot be formatted locally"""
+
+
+def format_output(output: str) -> str | None:
+    """
+    Format an execution output as markdown
+
+    Args:
+        output (str): Output of an execution (stdout, then stderr after "Errors:")
+
+    Returns:
+        str | None: Markdown, or None if the output has parts that cannot be recognized
+    """
+
+    stdout, _, stderr = output.partition(ERRORS_SEPARATOR)
+
+    try:
+        blocks = format_lines(stdout.splitlines())
+    except UnknownOutput:
+        return None
+
+    if stderr.strip():
+        blocks.append("**Errors:**\n" + code_block(stderr.strip("\n")))
+
+    if not blocks:
+        return "The code did not print any output."
+
+    return "\n\n".join(blocks)
+
+
+def format_lines(lines: list[str]) -> list[str]:
+    """
+    Format the lines of an output as markdown blocks
+
+    Args:
+        lines (list[str]): Lines
+
+    Returns:
+        list[str]: Markdown blocks
+
+    Raises:
+        UnknownOutput: If some lines cannot be recognized
+    """
+
+    blocks = []
+    text = []
+
+    def flush() -> None:
+        """Close the current paragraph of plain text"""
+        if text:
+            blocks.append("  \n".join(text))
+            text.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        if not line.strip():
+            flush()
+            i += 1
+            continue
+
+        for recognize in (
+            traceback,
+            dataframe_info,
+            classification_report,
+            array,
+            table,
+        ):
+            result = recognize(lines, i)
+            if result is not None:
+                flush()
+                block, i = result
+                blocks.append(block)
+                break
+        else:
+            if ALIGNED.search(line.rstrip()):
+                raise UnknownOutput(f"Unrecognized aligned line: {line}")
+
+            text.append(escape(line.strip()))
+            i += 1
+
+    flush()
+    return blocks
+
+
+def traceback(lines: list[str], i: int) -> tuple[str, int] | None:
+    """Recognize a Python traceback, ending with its exception line"""
+    if not lines[i].startswith("Traceback (most recent call last):"):
+        return None
+
+    end = i + 1
+    while end < len(lines):
+        line = lines[end]
+        end += 1
+        if not line.startswith(" ") and EXCEPTION_LINE.match(line):
+            break
+
+    return code_block("\n".join(lines[i:end])), end
+
+
+def dataframe_info(lines: list[str], i: int) -> tuple[str, int] | None:
+    """Recognize the output of DataFrame.info()"""
+    if not lines[i].startswith("<class 'pandas."):
+        return None
+
+    end = i + 1
+    while end < len(lines) and lines[end].strip():
+        end += 1
+        if lines[end - 1].startswith("memory usage:"):
+            break
+
+    return code_block("\n".join(line.rstrip() for line in lines[i:end])), end
+
+
+def classification_report(lines: list[str], i: int) -> tuple[str, int] | None:
+    """Recognize a sklearn classification report"""
+    if lines[i].split() != CLASSIFICATION_HEADER:
+        return None
+
+    rows = []
+    end = i + 1
+    while end < len(lines):
+        if not lines[end].strip():
+            end += 1
+            continue
+
+        cells = ALIGNED.split(lines[end].strip())
+        if len(cells) not in (3, 5) or not all(NUMBER.match(c) for c in cells[1:]):
+            break
+
+        # The accuracy row only has the f1-score and support columns
+        if len(cells) == 3:
+            cells = [cells[0], "", "", *cells[1:]]
+        rows.append(cells)
+        end += 1
+
+    if not rows:
+        return None
+
+    # Leave the blank lines after the report to the next block
+    while not lines[end - 1].strip():
+        end -= 1
+
+    return markdown_table(["", *CLASSIFICATION_HEADER], rows), end
+
+
+def array(lines: list[str], i: int) -> tuple[str, int] | None:
+    """Recognize a numpy array or a list, rendering numeric matrices as tables"""
+    if not lines[i].lstrip().startswith("["):
+        return None
+
+    depth = 0
+    end = i
+    while end < len(lines):
+        depth += lines[end].count("[") - lines[end].count("]")
+        end += 1
+        if depth <= 0:
+            break
+    if depth != 0:
+        return None
+
+    text = "\n".join(lines[i:end])
+    body = text.strip()
+    if body.startswith("[[") and body.endswith("]]"):
+        rows = [
+            [cell for cell in re.split(r"[\s,]+", row.strip()) if cell]
+            for row in re.findall(r"\[([^\[\]]*)\]", body)
+        ]
+        width = len(rows[0])
+        if all(
+            len(row) == width and all(NUMBER.match(cell) for cell in row)
+            for row in rows
+        ):
+            return (
+                markdown_table(
+                    ["", *map(str, range(width))],
+                    [[str(index), *row] for index, row in enumerate(rows)],
+                ),
+                end,
+            )
+
+    return code_block(text), end
+
+
+def table(lines: list[str], i: int) -> tuple[str, int] | None:
+    """Recognize a pandas DataFrame or Series repr (including describe() and value_counts())"""
+    # Name of the index printed alone above a Series
+    index_name = None
+    start = i
+    if (
+        len(lines[i].split()) == 1
+        and i + 1 < len(lines)
+        and ALIGNED.search(lines[i + 1].rstrip())
+        and not lines[i + 1].startswith(" ")
+    ):
+        index_name = lines[i].strip()
+        start = i + 1
+
+    end = start
+    while end < len(lines) and lines[end].strip() and ALIGNED.search(lines[end]):
+        end += 1
+    if end - start < 2 and not (end - start == 1 and index_name):
+        return None
+
+    block = lines[start:end]
+
+    # Wide DataFrames wrapped over several blocks of columns, each continued with "\\"
+    if block[0].rstrip().endswith("\\"):
+        while end < len(lines):
+            if not lines[end].strip():
+                end += 1
+                continue
+            continued = lines[end].rstrip().endswith("\\")
+            while end < len(lines) and lines[end].strip():
+                end += 1
+            if not continued:
+                break
+        if has_dataframe_footer(lines, end):
+            end += 2
+        return code_block("\n".join(line.rstrip() for line in lines[i:end])), end
+
+    footer = None
+    if end < len(lines) and SERIES_FOOTER.match(lines[end].strip()):
+        footer = lines[end].strip()
+        end += 1
+    elif has_dataframe_footer(lines, end):
+        footer = lines[end + 1].strip()
+        end += 2
+
+    columns = split_columns(block)
+    if columns is None:
+        raise UnknownOutput(f"Unrecognized table: {block[0]}")
+
+    # Prose with double spaces is left to the model
+    if footer is None and not is_tabular(block, columns):
+        return None
+
+    if footer is not None and footer.startswith(("Name:", "Length:", "dtype:")):
+        # Series: index and values
+        if len(columns[0]) != 2:
+            raise UnknownOutput(f"Unrecognized series: {block[0]}")
+        name = re.match(r"^Name: (.*?), ", footer)
+        header = [index_name or "", name.group(1) if name else ""]
+        markdown = markdown_table(header, columns)
+    else:
+        header, rows = columns[0], columns[1:]
+        if index_name is not None:
+            rows = [[index_name, *[""] * (len(header) - 1)], *columns]
+            header = [""] * len(header)
+
+        # Names of the index levels printed on their own row under the header
+        if rows and rows[0][0] and not rows[0][-1]:
+            levels = max(c for c, cell in enumerate(rows[0]) if cell) + 1
+            if not any(header[:levels]):
+                header = [*rows[0][:levels], *header[levels:]]
+                rows = rows[1:]
+        if not rows:
+            raise UnknownOutput(f"Unrecognized table: {block[0]}")
+        markdown = markdown_table(header, rows)
+
+    if footer is not None:
+        markdown += f"\n\n*{escape(footer)}*"
+
+    return markdown, end
+
+
+def has_dataframe_footer(lines: list[str], i: int) -> bool:
+    """Check if a DataFrame repr is followed by its "[n rows x m columns]" footer"""
+    return (
+        i + 1 < len(lines)
+        and not lines[i].strip()
+        and DATAFRAME_FOOTER.match(lines[i + 1].strip()) is not None
+    )
+
+
+def split_columns(block: list[str]) -> list[list[str]] | None:
+    """
+    Split aligned lines into cells, at the character columns blank in every line
+
+    Args:
+        block (list[str]): Lines
+
+    Returns:
+        list[list[str]] | None: Cells of each line, or None if the lines are not aligned in columns
+    """
+
+    width = max(len(line) for line in block)
+    lines = [line.ljust(width) for line in block]
+    blank = [all(line[c] == " " for line in lines) for c in range(width)]
+
+    spans = []
+    start = None
+    for c in range(width + 1):
+        if c < width and not blank[c]:
+            if start is None:
+                start = c
+        elif start is not None:
+            spans.append((start, c))
+            start = None
+
+    if len(spans) < 2:
+        return None
+
+    rows = [[line[a:b].strip() for a, b in spans] for line in lines]
+
+    # Only the header and the index name row may have no values
+    if not all(any(row[1:]) for row in rows[2:]):
+        return None
+
+    return rows
+
+
+def is_tabular(block: list[str], columns: list[list[str]]) -> bool:
+    """
+    Check if aligned lines are a table rather than prose with double spaces
+
+    Every line must have a cell in each column (except the blank index cells of the header
+    and of repeated index levels, and the row of index names under the header),
+    and the table must have a header row over the index or numeric columns.
+
+    Args:
+        block (list[str]): Lines
+        columns (list[list[str]]): Cells of each line
+
+    Returns:
+        bool: Whether the lines are a table
+    """
+
+    for r, (line, row) in enumerate(zip(block, columns)):
+        filled = [c for c, cell in enumerate(row) if cell]
+        # Gaps within a cell
+        if len(ALIGNED.split(line.strip())) > len(filled):
+            return False
+        # Blank cells between values, or after them outside of the index names row
+        if len(filled) != filled[-1] - filled[0] + 1:
+            return False
+        if filled[-1] != len(row) - 1 and r != 1:
+            return False
+
+    if block[0].startswith(" ") and not columns[0][0]:
+        return True
+
+    return any(
+        all(NUMBER.match(row[c]) or row[c] in ELLIPSES for row in columns[1:])
+        and any(NUMBER.match(row[c]) for row in columns[1:])
+        for c in range(1, len(columns[0]))
+    )
+
+
+def markdown_table(header: list[str], rows: list[list[str]]) -> str:
+    """
+    Render a markdown table
+
+    Args:
+        header (list[str]): Column names
+        rows (list[list[str]]): Cells
+
+    Returns:
+        str: Markdown table
+    """
+
+    def row(cells: list[str]) -> str:
+        """Render a row of cells"""
+        return "| " + " | ".join(cell.replace("|", "\\|") for cell in cells) + " |"
+
+    # Right-align the numeric columns
+    align = [
+        (
+            "---:"
+            if all(NUMBER.match(r[c]) or r[c] in ELLIPSES for r in rows if c < len(r))
+            and any(c < len(r) and r[c] for r in rows)
+            else "---"
+        )
+        for c in range(len(header))
+    ]
+
+    return "\n".join([row(header), "| " + " | ".join(align) + " |", *map(row, rows)])
+
+
+def code_block(text: str) -> str:
+    """Render text verbatim in a code block"""
+    fence = "````" if "```" in text else "```"
+    return f"{fence}text\n{text}\n{fence}"
+
+
+def escape(line: str) -> str:
+    """Escape a line of plain text so that it is not read as markdown syntax"""
+    if line.startswith(MARKDOWN_PREFIXES):
+        return "\\" + line
+    return line
@@ -0,0 +1,380 @@
+"""
+agentml/llm_cache.py
+
+Disk-backed cache of the LLM responses to skip sending identical requests again
+"""
+
+import asyncio
+import contextlib
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+from openai import AsyncOpenAI
+from openai.types.chat import ChatCompletion
+
+from config import LLM_CACHE_PATH, LLM_CACHE_SIZE, LLM_CACHE_TTL
+
+# Request arguments that do not change the response
+IGNORED_ARGS = {"timeout", "extra_headers", "user", "priority"}
+
+
+def normalize_messages(messages: list[dict]) -> list[dict]:
+    """
+    Normalize the messages of a request so that insignificant differences share a cache entry
+
+    Args:
+        messages (list[dict]): Messages in JSON format
+
+    Returns:
+        list[dict]: Messages with normalized line endings and surrounding whitespace
+    """
+
+    normalized = []
+    for message in messages:
+        message = dict(message)
+        if isinstance(message.get("content"), str):
+            message["content"] = message["content"].replace("\r\n", "\n").strip()
+        normalized.append(message)
+
+    return normalized
+
+
+class LlmCache:
+    """
+    SQLite cache of chat completions
+
+    Entries expire after the TTL, and the least recently used entries are evicted
+    past the size limit. Hits and misses are counted to measure the hit rate.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(
+        self,
+        path: Path = LLM_CACHE_PATH,
+        ttl: float | None = LLM_CACHE_TTL,
+        max_size: int = LLM_CACHE_SIZE,
+    ) -> None:
+        """
+        LlmCache constructor
+
+        Args:
+            path (Path, optional): SQLite database file. Defaults to LLM_CACHE_PATH.
+            ttl (float | None, optional): Seconds an entry stays valid (None for no expiry). Defaults to LLM_CACHE_TTL.
+            max_size (int, optional): Maximum size of the cached responses in bytes. Defaults to LLM_CACHE_SIZE.
+        """
+
+        self.path: Path = path
+        self.ttl: float | None = ttl
+        self.max_size: int = max_size
+        self._initialized: bool = False
+
+    @staticmethod
+    def key(model: str, messages: list[dict], **kwargs) -> str:
+        """
+        Compute the cache key of a request
+
+        Args:
+            model (str): Model
+            messages (list[dict]): Messages in JSON format
+            **kwargs: Other request arguments (response_format, temperature...)
+
+        Returns:
+            str: Cache key
+        """
+
+        payload = {
+            "model": model,
+            "messages": normalize_messages(messages),
+            **{
+                name: value
+                for name, value in kwargs.items()
+                if name not in IGNORED_ARGS and value is not None
+            },
+        }
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    @contextlib.contextmanager
+    def connect(self) -> Iterator[sqlite3.Connection]:
+        """Open a transaction on the cache database, creating it on first use"""
+        with self._lock:
+            if not self._initialized:
+                self._initialize()
+
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def _initialize(self) -> None:
+        """Create the cache database"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    latency REAL NOT NULL,
+                    tokens INTEGER NOT NULL,
+                    created REAL NOT NULL,
+                    used REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_used ON entries (used);
+                CREATE TABLE IF NOT EXISTS stats (
+                    name TEXT PRIMARY KEY,
+                    value REAL NOT NULL
+                );
+                """)
+        finally:
+            connection.close()
+
+        self._initialized = True
+
+    def get(self, key: str) -> ChatCompletion | None:
+        """
+        Get a cached response
+
+        Args:
+            key (str): Cache key
+
+        Returns:
+            ChatCompletion | None: Cached response, or None on a cache miss
+        """
+
+        now = time.time()
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT response, latency, tokens, created FROM entries WHERE key = ?",
+                (key,),
+            ).fetchone()
+
+            if row is not None and self.ttl is not None and row[3] + self.ttl < now:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+                row = None
+
+            if row is None:
+                self._count(connection, misses=1)
+                return None
+
+            response, latency, tokens, _ = row
+            connection.execute("UPDATE entries SET used = ? WHERE key = ?", (now, key))
+            self._count(connection, hits=1, saved_time=latency, saved_tokens=tokens)
+
+        return ChatCompletion.model_validate_json(response)
+
+    def put(self, key: str, response: ChatCompletion, latency: float) -> None:
+        """
+        Cache a response, evicting the least recently used entries
+
+        Args:
+            key (str): Cache key
+            response (ChatCompletion): Response
+            latency (float): Seconds taken by the API to respond
+        """
+
+        data = response.model_dump_json()
+        tokens = response.usage.total_tokens if response.usage is not None else 0
+        if len(data) > self.max_size:
+            return
+
+        now = time.time()
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, response.model, data, len(data), latency, tokens, now, now),
+            )
+            self._evict(connection)
+
+    def clear(self) -> None:
+        """Delete all the cached responses and reset the counters"""
+        with self.connect() as connection:
+            connection.execute("DELETE FROM entries")
+            connection.execute("DELETE FROM stats")
+
+    def stats(self) -> dict:
+        """
+        Get the cache statistics
+
+        Returns:
+            dict: Number of entries, total size in bytes, hits, misses, hit rate, and the API time and tokens saved
+        """
+
+        with self.connect() as connection:
+            entries, size = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+            counters = dict(connection.execute("SELECT name, value FROM stats"))
+
+        hits = int(counters.get("hits", 0))
+        misses = int(counters.get("misses", 0))
+        return {
+            "entries": entries,
+            "size": size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "saved_time": counters.get("saved_time", 0.0),
+            "saved_tokens": int(counters.get("saved_tokens", 0)),
+        }
+
+    @staticmethod
+    def _count(connection: sqlite3.Connection, **counters: float) -> None:
+        """Increment statistics counters"""
+        for name, value in counters.items():
+            connection.execute(
+                "INSERT INTO stats VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                (name, value),
+            )
+
+    def _evict(self, connection: sqlite3.Connection) -> None:
+        """Delete the expired entries, then the least recently used ones past the size limit"""
+        if self.ttl is not None:
+            connection.execute(
+                "DELETE FROM entries WHERE created < ?", (time.time() - self.ttl,)
+            )
+
+        (size,) = connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if size <= self.max_size:
+            return
+
+        evicted = []
+        for key, entry_size in connection.execute(
+            "SELECT key, size FROM entries ORDER BY used"
+        ).fetchall():
+            if size <= self.max_size:
+                break
+            evicted.append((key,))
+            size -= entry_size
+
+        print(f"LlmCache: Evicting {len(evicted)} responses")
+        connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
+
+
+class CachedCompletions:
+    """Chat completions API answering identical requests from the cache"""
+
+    def __init__(self, completions: Any, cache: LlmCache | None) -> None:
+        """
+        CachedCompletions constructor
+
+        Args:
+            completions (Any): Chat completions API of the OpenAI client
+            cache (LlmCache | None): Response cache (None to disable caching)
+        """
+
+        self.completions = completions
+        self.cache: LlmCache | None = cache
+
+    def create(self, *, cache: bool = True, **kwargs) -> Any:
+        """
+        Create a chat completion, or get it from the cache
+
+        Args:
+            cache (bool, optional): Use the cache (disable for requests expected to vary). Defaults to True.
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            Any: Chat completion (or stream)
+        """
+
+        if self.cache is None or not cache or kwargs.get("stream"):
+            return self.completions.create(**kwargs)
+
+        key = self.cache.key(**kwargs)
+        response = self.cache.get(key)
+        if response is not None:
+            print(f"LlmCache: Cache hit for {kwargs['model']} ({key[:12]})")
+            return response
+
+        start = time.perf_counter()
+        response = self.completions.create(**kwargs)
+        self.cache.put(key, response, time.perf_counter() - start)
+
+        return response
+
+
+class AsyncCachedCompletions(CachedCompletions):
+    """Async chat completions API answering identical requests from the cache"""
+
+    async def create(self, *, cache: bool = True, **kwargs) -> Any:
+        """
+        Create a chat completion, or get it from the cache
+
+        Args:
+            cache (bool, optional): Use the cache (disable for requests expected to vary). Defaults to True.
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            Any: Chat completion (or stream)
+        """
+
+        if self.cache is None or not cache or kwargs.get("stream"):
+            return await self.completions.create(**kwargs)
+
+        key = self.cache.key(**kwargs)
+        response = await asyncio.to_thread(self.cache.get, key)
+        if response is not None:
+            print(f"LlmCache: Cache hit for {kwargs['model']} ({key[:12]})")
+            return response
+
+        start = time.perf_counter()
+        response = await self.completions.create(**kwargs)
+        await asyncio.to_thread(
+            self.cache.put, key, response, time.perf_counter() - start
+        )
+
+        return response
+
+
+class CachedChat:
+    """Chat API of a cached client"""
+
+    def __init__(self, completions: CachedCompletions) -> None:
+        self.completions: CachedCompletions = completions
+
+
+class CachedClient:
+    """
+    OpenAI client whose chat completions go through the response cache
+
+    Other APIs are forwarded to the wrapped client.
+    """
+
+    def __init__(self, client: Any, cache: LlmCache | None) -> None:
+        """
+        CachedClient constructor
+
+        Args:
+            client (Any): OpenAI or AsyncOpenAI client, or a client wrapping one
+            cache (LlmCache | None): Response cache (None to disable caching)
+        """
+
+        # Wrapped clients (scheduled) keep the OpenAI client in their client attribute
+        completions = (
+            AsyncCachedCompletions
+            if isinstance(getattr(client, "client", client), AsyncOpenAI)
+            else CachedCompletions
+        )
+
+        self.client = client
+        self.cache: LlmCache | None = cache
+        self.chat = CachedChat(completions(client.chat.completions, cache))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
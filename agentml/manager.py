@@ -1,9 +1,15 @@
 """agentml/manager.py"""
 
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from uuid import UUID, uuid4
 
+from agentml.context import append_history
+from agentml.conversation import Conversation
 from agentml.models import LlmMessage, LlmRole
+from agentml.oai import get_llm_cache, get_llm_scheduler
+from config import MANAGER_MAX_PARALLEL_STEPS
 
 from .agents import Agent, Coder, Planner, Vision
 from .sandbox import Sandbox
@@ -14,14 +20,21 @@ class Manager:
 
     STARTING_TASKS: dict[Agent, str] = []
 
-    def __init__(self, goal: str, csv: Path, session_id: UUID = uuid4()) -> None:
+    def __init__(
+        self,
+        goal: str,
+        csv: Path,
+        session_id: UUID | None = None,
+        files: list[Path] | None = None,
+    ) -> None:
         """
         Agent constructor
 
         Args:
             goal (str): goal of the agent
             csv (Path): CSV file path of the dataset
-            session_id (UUID): Session ID
+            session_id (UUID | None, optional): Session ID. Defaults to a new session.
+            files (list[Path] | None, optional): Other dataset files and directories. Defaults to None.
         """
 
         # Ensure the CSV file exists
@@ -30,19 +43,28 @@ class Manager:
 
         self.goal = goal
         self.csv = csv
-        self.session_id = session_id
+        # A default evaluated at import would share one session (and sandbox) between managers
+        self.session_id = session_id or uuid4()
 
-        self.messages: list[LlmMessage] = [
-            LlmMessage(
-                role=LlmRole.SYSTEM,
-                content="Overarching Goal: " + self.goal,
-            ),
-        ]
+        # Agents continue the history on their own branch without copying it
+        self.messages: Conversation = Conversation(
+            [
+                LlmMessage(
+                    role=LlmRole.SYSTEM,
+                    content="Overarching Goal: " + self.goal,
+                ),
+            ]
+        )
 
-        self.sandbox = Sandbox.create(session_id=session_id, files=[csv])
+        # Full history for the log, the agents only send what fits their context budget
+        append_history(self.session_id, self.messages)
+
+        self.sandbox = Sandbox.create(
+            session_id=self.session_id, files=[csv, *(files or [])]
+        )
 
-        # Queue of tasks to run
-        self.tasks: list[dict[callable, str]] = [
+        # Queue of tasks to run (lists of independent tasks run concurrently)
+        self.tasks: list[dict[callable, str] | list[dict[callable, str]]] = [
             *self.STARTING_TASKS,
             {
                 Planner: "Outline the steps to learn about the dataset to achieve the goal"
@@ -56,6 +78,10 @@ class Manager:
             # Get the next task in the queue
             task = self.tasks.pop(0)
 
+            if isinstance(task, list):
+                self.run_stage(task)
+                continue
+
             for agent, objective in task.items():
                 print(f"Manager.run: Running agent {agent} with objective: {objective}")
                 agent = agent(
@@ -65,16 +91,179 @@ class Manager:
                 )
 
                 output = agent.run()
-                self.messages.extend(output)
-
-                # Handle output based on the agent type
-                if isinstance(agent, Planner):
-                    self.tasks.extend(
-                        [
-                            {self.get_agent(task["tool"]): task["objective"]}
-                            for task in agent.plan
-                        ]
+                self.handle_output(agent, output)
+
+        self.log_execution_stats()
+
+    def run_stage(self, tasks: list[dict]) -> None:
+        """
+        Run independent tasks concurrently, each in its own copy of the sandbox
+
+        Args:
+            tasks (list[dict]): Tasks of the stage
+        """
+
+        agents, forks = self.start_stage(tasks)
+        try:
+            with ThreadPoolExecutor(max_workers=len(agents)) as executor:
+                outputs = list(executor.map(lambda agent: agent.run(), agents))
+            self.merge_stage(agents, forks, outputs)
+        finally:
+            for fork in forks:
+                fork.delete()
+
+    def start_stage(self, tasks: list[dict]) -> tuple[list[Agent], list[Sandbox]]:
+        """
+        Fork the sandbox for each task of a stage and create their agents
+
+        Args:
+            tasks (list[dict]): Tasks of the stage
+
+        Returns:
+            tuple[list[Agent], list[Sandbox]]: Agent and sandbox of each task
+        """
+
+        agents, forks = [], []
+        try:
+            for task in tasks:
+                agent, objective = list(task.items())[0]
+                print(f"Manager.run: Running agent {agent} in parallel: {objective}")
+
+                fork = self.sandbox.fork()
+                forks.append(fork)
+
+                agents.append(
+                    agent(
+                        session_id=fork.session_id,
+                        objective=objective,
+                        messages=self.messages,
                     )
+                )
+        except Exception:
+            for fork in forks:
+                fork.delete()
+            raise
+
+        return agents, forks
+
+    def merge_stage(
+        self,
+        agents: list[Agent],
+        forks: list[Sandbox],
+        outputs: list[list[LlmMessage]],
+    ) -> None:
+        """
+        Merge the files and messages of the tasks of a stage, in the order of the plan
+
+        Args:
+            agents (list[Agent]): Agent of each task
+            forks (list[Sandbox]): Sandbox of each task
+            outputs (list[list[LlmMessage]]): Messages of each task
+        """
+
+        for agent, fork, output in zip(agents, forks, outputs):
+            self.sandbox.merge(fork)
+            self.handle_output(agent, output)
+
+    def handle_output(self, agent: Agent, output: list[LlmMessage]) -> None:
+        """
+        Add the output of an agent to the history and queue the tasks it planned
+
+        Args:
+            agent (Agent): Agent that ran
+            output (list[LlmMessage]): Messages of the agent
+        """
+
+        self.messages.extend(output)
+        append_history(self.session_id, output)
+
+        # Handle output based on the agent type
+        if isinstance(agent, Planner):
+            for stage in self.get_stages(agent.plan):
+                tasks = [
+                    {self.get_agent(task["tool"]): task["objective"]} for task in stage
+                ]
+                self.tasks.append(tasks[0] if len(tasks) == 1 else tasks)
+
+    @staticmethod
+    def get_stages(
+        plan: list[dict], max_size: int = MANAGER_MAX_PARALLEL_STEPS
+    ) -> list[list[dict]]:
+        """
+        Group the steps of a plan into stages of independent steps, in the order of the plan
+
+        Steps only depend on steps of earlier stages. Planner steps run alone, with the results
+        of all the earlier steps. Plans without valid dependencies run one step at a time.
+
+        Args:
+            plan (list[dict]): Steps with their id and the ids of the steps they depend on
+            max_size (int, optional): Maximum number of steps of a stage. Defaults to MANAGER_MAX_PARALLEL_STEPS.
+
+        Returns:
+            list[list[dict]]: Stages
+        """
+
+        sequential = [[task] for task in plan]
+
+        ids = [task.get("id") for task in plan]
+        if (
+            max_size <= 1
+            or len(set(ids)) != len(ids)
+            or not all(isinstance(id_, int) for id_ in ids)
+            or not all(isinstance(task.get("depends_on"), list) for task in plan)
+        ):
+            return sequential
+
+        # Dependencies on steps outside of the plan are already done
+        dependencies = {
+            task["id"]: set(task["depends_on"]).intersection(ids) for task in plan
+        }
+
+        stages = []
+        done = set()
+        pending = list(plan)
+        while pending:
+            ready = [task for task in pending if dependencies[task["id"]] <= done]
+            if not ready:
+                print("Manager.get_stages: Cyclic plan, running it sequentially")
+                return sequential
+
+            stage = [task for task in ready if task["tool"] != "Planner"][:max_size]
+            stage = stage or ready[:1]
+
+            stages.append(stage)
+            done.update(task["id"] for task in stage)
+            pending = [task for task in pending if task["id"] not in done]
+
+        return stages
+
+    def log_execution_stats(self) -> None:
+        """Log the sandbox executions of the session and the LLM requests to find the slow tasks"""
+        stats = self.sandbox.get_execution_stats()
+        print(
+            f"Manager.run: {stats['executions']} executions ({stats['cached']} cached), "
+            f"wall {stats['wall_time']:.3f}s, cpu {stats['user_time'] + stats['system_time']:.3f}s"
+        )
+        for execution in stats["slowest"]:
+            print(
+                f"Manager.run: {execution['wall_time']:.3f}s ({execution['mode']}): {execution['label']}"
+            )
+
+        llm_cache = get_llm_cache()
+        if llm_cache is not None:
+            stats = llm_cache.stats()
+            print(
+                f"Manager.run: LLM cache hit rate {stats['hit_rate']:.0%} "
+                f"({stats['hits']} hits, {stats['misses']} misses), "
+                f"saved {stats['saved_time']:.1f}s and {stats['saved_tokens']} tokens"
+            )
+
+        for model, stats in get_llm_scheduler().stats().items():
+            print(
+                f"Manager.run: {model}: {stats['requests']} requests, "
+                f"{stats['retries']} retries ({stats['rate_limited']} rate limited), "
+                f"queue wait {stats['queue_time']:.2f}s (max {stats['max_queue_time']:.2f}s)"
+            )
 
     def run_single_task(self, task: dict) -> list[LlmMessage]:
         """Run a single task and return its output"""
@@ -103,3 +292,96 @@ class Manager:
                 return Vision
             case _:
                 raise ValueError(f"Manager.get_agent: Invalid agent: {agent}")
+
+
+class AsyncManager(Manager):
+    """
+    Agent Manager running on an asyncio event loop
+
+    Agents call the model and the sandbox without blocking the loop,
+    so many sessions can be run concurrently by a single process.
+    """
+
+    @classmethod
+    async def create(
+        cls,
+        goal: str,
+        csv: Path,
+        session_id: UUID | None = None,
+        files: list[Path] | None = None,
+    ) -> "AsyncManager":
+        """
+        Create a manager without blocking the event loop while the sandbox is set up
+
+        Args:
+            goal (str): goal of the agent
+            csv (Path): CSV file path of the dataset
+            session_id (UUID | None, optional): Session ID. Defaults to a new session.
+            files (list[Path] | None, optional): Other dataset files and directories. Defaults to None.
+
+        Returns:
+            AsyncManager: Manager
+        """
+
+        return await asyncio.to_thread(
+            cls, goal=goal, csv=csv, session_id=session_id, files=files
+        )
+
+    async def run(self) -> None:
+        """Run the agent"""
+
+        while self.tasks:
+            # Get the next task in the queue
+            task = self.tasks.pop(0)
+
+            if isinstance(task, list):
+                await self.run_stage(task)
+                continue
+
+            for agent, objective in task.items():
+                print(
+                    f"AsyncManager.run: Running agent {agent} with objective: {objective}"
+                )
+                # Agents set up their sandbox when created
+                agent = await asyncio.to_thread(
+                    agent,
+                    session_id=self.session_id,
+                    objective=objective,
+                    messages=self.messages,
+                )
+
+                output = await agent.arun()
+                await asyncio.to_thread(self.handle_output, agent, output)
+
+        await asyncio.to_thread(self.log_execution_stats)
+
+    async def run_stage(self, tasks: list[dict]) -> None:
+        """
+        Run independent tasks concurrently, each in its own copy of the sandbox
+
+        Args:
+            tasks (list[dict]): Tasks of the stage
+        """
+
+        agents, forks = await asyncio.to_thread(self.start_stage, tasks)
+        try:
+            outputs = await asyncio.gather(*[agent.arun() for agent in agents])
+            await asyncio.to_thread(self.merge_stage, agents, forks, outputs)
+        finally:
+            await asyncio.gather(*[asyncio.to_thread(fork.delete) for fork in forks])
+
+    async def run_single_task(self, task: dict) -> list[LlmMessage]:
+        """Run a single task and return its output"""
+        agent, objective = list(task.items())[0]
+        print(
+            f"AsyncManager.run_single_task: Running agent {agent} with objective: {objective}"
+        )
+        agent = await asyncio.to_thread(
+            agent,
+            session_id=self.session_id,
+            objective=objective,
+            messages=self.messages,
+        )
+
+        output = await agent.arun()
+        return output
@@ -1,13 +1,17 @@
 """agentml/manual.py"""
 
 from pathlib import Path
-from typing import Type
+from typing import Callable, Type
 from uuid import UUID
 
 from agentml.agents import Agent, Coder, Planner, Vision
+from agentml.context import append_history
+from agentml.conversation import Conversation
 from agentml.models import LlmMessage, LlmRole
 from agentml.oai import client as openai
-from agentml.sandbox import Sandbox
+from agentml.sandbox import OutputChunk, Sandbox
+from agentml.validator import Validator
+from config import MANAGER_LOCAL_VALIDATOR
 
 
 class Manager:
@@ -18,6 +22,7 @@ class Manager:
         goal: str,
         csv: Path,
         session_id: UUID,
+        files: list[Path] | None = None,
     ) -> None:
         """
         Agent constructor
@@ -26,6 +31,7 @@ class Manager:
             goal (str): goal of the agent
             csv (Path): CSV file path of the dataset
             session_id (UUID): Session ID
+            files (list[Path] | None, optional): Other dataset files and directories. Defaults to None.
         """
 
         # Ensure the CSV file exists
@@ -36,15 +42,23 @@ class Manager:
         self.csv = csv
         self.session_id = session_id
 
-        self.sandbox = Sandbox.create(session_id=session_id, files=[csv])
+        self.sandbox = Sandbox.create(
+            session_id=session_id, files=[csv, *(files or [])]
+        )
 
         # Chat history
-        self.messages: list[LlmMessage] = [
-            LlmMessage(
-                role=LlmRole.SYSTEM,
-                content="Overarching Goal: " + self.goal,
-            ),
-        ]
+        # Agents continue the history on their own branch without copying it
+        self.messages: Conversation = Conversation(
+            [
+                LlmMessage(
+                    role=LlmRole.SYSTEM,
+                    content="Overarching Goal: " + self.goal,
+                ),
+            ]
+        )
+
+        # Full history for the log, the agents only send what fits their context budget
+        append_history(self.session_id, self.messages)
 
         # Queue of tasks to run
         self.tasks: list[dict[callable, str]] = [
@@ -57,8 +71,21 @@ class Manager:
         self.agents = {}
         self.last_run_agent = None
 
-    def run(self) -> list[LlmMessage]:
-        """Run the agent"""
+        # Decides next() and done() without the LLM in the unambiguous cases
+        self.validator = Validator()
+
+    def run(
+        self,
+        on_output: Callable[[OutputChunk], None] | None = None,
+        on_token: Callable[[str], None] | None = None,
+    ) -> list[LlmMessage]:
+        """
+        Run the agent
+
+        Args:
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the sandbox output of coders as it is produced. Defaults to None.
+            on_token (Callable[[str], None] | None, optional): Callback receiving the tokens of the model response as they are generated. Defaults to None.
+        """
 
         if not self.tasks:
             print("Manager.run: No tasks to run.")
@@ -75,9 +102,14 @@ class Manager:
             agent_instance = agent_class(
                 session_id=self.session_id,
                 objective=objective,
-                messages=[*self.messages],
+                messages=self.messages,
             )
 
+            # Stream the model response and the sandbox output
+            agent_instance.on_token = on_token
+            if isinstance(agent_instance, Coder):
+                agent_instance.on_output = on_output
+
             # Store the agent instance
             self.agents[agent_class.__name__] = agent_instance
 
@@ -86,9 +118,17 @@ class Manager:
 
             return agent_instance.run()
 
-    def retry_last_agent(self) -> list[LlmMessage]:
+    def retry_last_agent(
+        self,
+        on_output: Callable[[OutputChunk], None] | None = None,
+        on_token: Callable[[str], None] | None = None,
+    ) -> list[LlmMessage]:
         """
         Retry the last run agent.
+
+        Args:
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the sandbox output of coders as it is produced. Defaults to None.
+            on_token (Callable[[str], None] | None, optional): Callback receiving the tokens of the model response as they are generated. Defaults to None.
         """
 
         agent = self.last_run_agent
@@ -98,6 +138,9 @@ class Manager:
             and (isinstance(agent, Coder) or isinstance(agent, Vision))
         ):
             print(f"Retrying agent: {type(agent).__name__}")
+            agent.on_token = on_token
+            if isinstance(agent, Coder):
+                agent.on_output = on_output
             return agent.retry()
         else:
             print("No suitable agent found for retry.")
@@ -116,6 +159,7 @@ class Manager:
 
         # Add the messages to the chat history
         self.messages.extend(messages)
+        append_history(self.session_id, messages)
 
         # Handle different agents
         for agent_class, objective in task.items():
@@ -143,9 +187,26 @@ class Manager:
             else:
                 print(f"Manager.validate_run: No instance found for {agent_name}")
 
-    @staticmethod
-    def next(output) -> str:
-        """Get the next task"""
+    def next(self, output: LlmMessage | str) -> str:
+        """
+        Decide whether to retry or validate the last run
+
+        Args:
+            output (LlmMessage | str): Last message of the run (or its content)
+
+        Returns:
+            str: "retry" or "validate"
+        """
+
+        if isinstance(output, str):
+            output = LlmMessage(role=LlmRole.ASSISTANT, content=output)
+
+        if MANAGER_LOCAL_VALIDATOR:
+            decision = self.validator.next(output, self.last_run_agent)
+            if decision is not None:
+                print(f"Manager.next: Decided locally: {decision}")
+                return decision
+
         next_prompt = """Based on the provided output, decide if the output is valid or invalid.
 If it is invalid, return "retry",
 If it is valid, return "validate",
@@ -159,12 +220,12 @@ Only if there is an error in the output, you should return "retry" to retry the
             LlmMessage(role=LlmRole.SYSTEM, content=next_prompt),
             LlmMessage(
                 role=LlmRole.USER,
-                content=output,
+                content=output.content,
             ),
         ]
 
         # Convert messages to JSON
-        messages = [msg.model_dump(mode="json") for msg in messages]
+        messages = [msg.to_dict() for msg in messages]
 
         print(f"Manager.next: Sending request to OpenAI API: {messages}")
         response = openai.chat.completions.create(
@@ -177,8 +238,26 @@ Only if there is an error in the output, you should return "retry" to retry the
 
         return content.lower()
 
-    def done(self, output: str) -> bool:
-        """Check if the manager is done"""
+    def done(self, output: LlmMessage | str) -> bool:
+        """
+        Check if the manager is done
+
+        Args:
+            output (LlmMessage | str): Last message of the last run (or its content)
+
+        Returns:
+            bool: Whether the goal is complete
+        """
+
+        if isinstance(output, str):
+            output = LlmMessage(role=LlmRole.ASSISTANT, content=output)
+
+        if MANAGER_LOCAL_VALIDATOR:
+            decision = self.validator.done(output)
+            if decision is not None:
+                print(f"Manager.done: Decided locally: {decision}")
+                return decision
+
         done_prompt = """Based on the provided output, decide if the agent has completed the task.
 Return `true` if the agent has completed the task. Otherwise, return `false`.
         """
@@ -190,12 +269,12 @@ Return `true` if the agent has completed the task. Otherwise, return `false`.
             ),
             LlmMessage(
                 role=LlmRole.USER,
-                content=output,
+                content=output.content,
             ),
         ]
 
         # Convert messages to JSON
-        messages = [msg.model_dump(mode="json") for msg in messages]
+        messages = [msg.to_dict() for msg in messages]
 
         print(f"Manager.done: Sending request to OpenAI API: {messages}")
         response = openai.chat.completions.create(
@@ -4,10 +4,9 @@ agentml/models.py
 Models
 """
 
+import functools
 from enum import Enum
 
-from pydantic import BaseModel
-
 
 class LlmRole(Enum):
     """LLM Message Role"""
@@ -17,8 +16,73 @@ class LlmRole(Enum):
     USER = "user"
 
 
-class LlmMessage(BaseModel):
-    """LLM Message"""
+class LlmMessage:
+    """
+    LLM Message
+
+    Messages are immutable and shared by every conversation that contains them,
+    so their JSON form is only built once.
+    """
+
+    __slots__ = ("role", "content", "metadata", "_dict")
+
+    def __init__(
+        self, role: LlmRole, content: str, metadata: dict | None = None
+    ) -> None:
+        """
+        LlmMessage constructor
+
+        Args:
+            role (LlmRole): Role of the author
+            content (str): Content
+            metadata (dict | None, optional): Profile of the work behind the message (LLM latency, sandbox execution), never sent to the API. Defaults to None.
+        """
+
+        object.__setattr__(self, "role", LlmRole(role))
+        object.__setattr__(self, "content", content)
+        object.__setattr__(self, "metadata", metadata)
+        object.__setattr__(self, "_dict", None)
+
+    @classmethod
+    @functools.lru_cache(maxsize=64)
+    def system(cls, content: str) -> "LlmMessage":
+        """
+        Get the system message of a prompt, created once and shared by all the agents using it
+
+        Args:
+            content (str): System prompt
+
+        Returns:
+            LlmMessage: System message
+        """
+
+        return cls(role=LlmRole.SYSTEM, content=content)
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError("LlmMessage is immutable")
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, LlmMessage):
+            return NotImplemented
+        return (self.role, self.content) == (other.role, other.content)
+
+    def __hash__(self) -> int:
+        return hash((self.role, self.content))
+
+    def __repr__(self) -> str:
+        return f"LlmMessage(role={self.role}, content={self.content!r})"
+
+    def to_dict(self) -> dict[str, str]:
+        """
+        Get the message in the JSON format of the API
+
+        Returns:
+            dict[str, str]: Role and content (do not modify, it is shared)
+        """
+
+        if self._dict is None:
+            object.__setattr__(
+                self, "_dict", {"role": self.role.value, "content": self.content}
+            )
 
-    role: LlmRole
-    content: str
+        return self._dict
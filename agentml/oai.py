@@ -1,17 +1,140 @@
-"""agentml/oai.py"""
+"""
+agentml/oai.py
 
+OpenAI clients, created on first use so that importing the package stays fast and
+does not require the API key
+"""
+
+import asyncio
+import functools
 import os
+import threading
+import weakref
+from typing import Any, Callable
+
+from config import LLM_CACHE, PROJECT_PATH
+
+
+@functools.cache
+def get_api_key() -> str:
+    """
+    Load the environment (.env file, if any) and get the OpenAI API key
+
+    Returns:
+        str: API key
+
+    Raises:
+        RuntimeError: If the OPENAI_API_KEY environment variable is not set
+    """
+
+    from dotenv import load_dotenv
+
+    load_dotenv(PROJECT_PATH.joinpath(".env"))
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if api_key is None:
+        raise RuntimeError("OPENAI_API_KEY environment variable not set")
+
+    return api_key
+
+
+@functools.cache
+def get_llm_scheduler():
+    """
+    Get the scheduler of the LLM requests
+
+    Requests of all the sessions share the rate limits of each model
+    (the scheduler retries the failed requests instead of the client).
+    """
+
+    from .scheduler import LlmScheduler
+
+    return LlmScheduler()
+
+
+@functools.cache
+def get_llm_cache():
+    """
+    Get the LLM response cache, or None if disabled
+
+    Identical requests are answered from the response cache when enabled
+    (pass cache=False to chat.completions.create for requests expected to vary,
+    and priority=Priority.LOW for requests that can wait behind the agents).
+    """
+
+    from .llm_cache import LlmCache
+
+    return LlmCache() if LLM_CACHE else None
+
+
+@functools.cache
+def get_client():
+    """Get the OpenAI client"""
+    from openai import OpenAI
+
+    from .llm_cache import CachedClient
+    from .scheduler import ScheduledClient
+
+    return CachedClient(
+        ScheduledClient(
+            OpenAI(api_key=get_api_key(), max_retries=0), get_llm_scheduler()
+        ),
+        get_llm_cache(),
+    )
+
+
+# OpenAI clients of the asyncio runtime, by event loop (their connections are bound to it)
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Any]" = (
+    weakref.WeakKeyDictionary()
+)
+_async_clients_lock = threading.Lock()
+
+
+def get_async_client():
+    """
+    Get the OpenAI client of the running event loop, shared by its concurrent sessions
+
+    Raises:
+        RuntimeError: If called outside of a running event loop
+    """
+
+    from openai import AsyncOpenAI
+
+    from .llm_cache import CachedClient
+    from .scheduler import ScheduledClient
+
+    loop = asyncio.get_running_loop()
+    with _async_clients_lock:
+        if loop not in _async_clients:
+            _async_clients[loop] = CachedClient(
+                ScheduledClient(
+                    AsyncOpenAI(api_key=get_api_key(), max_retries=0),
+                    get_llm_scheduler(),
+                ),
+                get_llm_cache(),
+            )
+        return _async_clients[loop]
+
+
+class LazyClient:
+    """Client created by its factory on first use"""
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        self._factory: Callable[[], Any] = factory
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._factory(), name)
 
-from dotenv import load_dotenv
-from openai import OpenAI
 
-from config import PROJECT_PATH
+client = LazyClient(get_client)
+async_client = LazyClient(get_async_client)
 
-env_loaded = load_dotenv(PROJECT_PATH.joinpath(".env"))
-if not env_loaded:
-    raise RuntimeError("Failed to load environment variables")
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-assert OPENAI_API_KEY is not None, "OPENAI_API_KEY environment variable not set"
+def __getattr__(name: str) -> Any:
+    """Create the scheduler and the response cache on first access"""
+    if name == "llm_scheduler":
+        return get_llm_scheduler()
+    if name == "llm_cache":
+        return get_llm_cache()
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
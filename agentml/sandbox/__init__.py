@@ -1,5 +1,19 @@
 """agentml.sandbox package"""
 
+from .models import (
+    ExecutionResult,
+    FileChanges,
+    OutputChunk,
+    ResourceLimits,
+    TerminationReason,
+)
 from .sandbox import Sandbox
 
-__all__ = ["Sandbox"]
+__all__ = [
+    "ExecutionResult",
+    "FileChanges",
+    "OutputChunk",
+    "ResourceLimits",
+    "Sandbox",
+    "TerminationReason",
+]
@@ -0,0 +1,155 @@
+"""
+agentml_data.py
+
+Fast dataset loading for the sandbox
+
+This file is copied into every sandbox and must not import agentml.
+The sandbox converts each CSV dataset once into a columnar cache (one .npy file per column,
+with string columns stored as category codes), and read_csv memory-maps it instead of
+parsing the CSV again. Sandboxes using the same dataset share the cache pages.
+
+Usage:
+    from agentml_data import read_csv
+    df = read_csv("data.csv")
+
+Conversion:
+    python agentml_data.py convert <csv> <cache dir>
+"""
+
+import json
+import os
+import sys
+from pathlib import Path
+
+# Columnar caches of the session datasets, by path relative to the sandbox
+COLUMNS_DIR = Path(".agentml", "columns")
+
+META_FILE = "meta.json"
+STAT_FILE = "stat.json"
+VERSION = 1
+
+
+def find_cache(path) -> Path | None:
+    """
+    Find the up-to-date columnar cache of a CSV file in the sandbox
+
+    Args:
+        path: CSV file path
+
+    Returns:
+        Path | None: Cache directory, or None if the file has no cache or it is stale
+    """
+
+    if not isinstance(path, (str, os.PathLike)):
+        return None
+
+    relative = os.path.relpath(os.path.abspath(path))
+    if relative.startswith(".."):
+        return None
+
+    cache = COLUMNS_DIR.joinpath(relative)
+    try:
+        with open(cache.joinpath(STAT_FILE), "r") as f:
+            expected = json.load(f)
+        stat = os.stat(path)
+    except (OSError, ValueError):
+        return None
+
+    # The dataset was replaced after the cache was built
+    if [stat.st_size, stat.st_mtime_ns] != expected:
+        return None
+
+    return cache
+
+
+def read_csv(filepath_or_buffer="data.csv", usecols=None, categories=False, **kwargs):
+    """
+    Load a CSV file as a DataFrame, memory-mapping its columnar cache when it has one
+
+    Numeric columns are memory-mapped copy-on-write: they load instantly, are only read from
+    disk when used, and can be modified without affecting the cache.
+    Any other pandas.read_csv argument falls back to pandas.read_csv.
+
+    Args:
+        filepath_or_buffer: CSV file path. Defaults to "data.csv".
+        usecols: Names or positions of the columns to load. Defaults to all columns.
+        categories (bool, optional): Load string columns as pandas categoricals to save memory. Defaults to False.
+        **kwargs: Other pandas.read_csv arguments
+
+    Returns:
+        pandas.DataFrame: Dataset
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    cache = None if kwargs else find_cache(filepath_or_buffer)
+    if cache is None:
+        return pd.read_csv(filepath_or_buffer, usecols=usecols, **kwargs)
+
+    with open(cache.joinpath(META_FILE), "r") as f:
+        meta = json.load(f)
+
+    data = {}
+    for position, column in enumerate(meta["columns"]):
+        if (
+            usecols is not None
+            and column["name"] not in usecols
+            and position not in usecols
+        ):
+            continue
+
+        values = np.load(cache.joinpath(column["file"]), mmap_mode="c")
+        if "categories" in column:
+            values = pd.Categorical.from_codes(values, categories=column["categories"])
+            if not categories:
+                values = values.astype(object)
+
+        data[column["name"]] = values
+
+    return pd.DataFrame(data, index=pd.RangeIndex(meta["rows"]), copy=False)
+
+
+def convert(source: Path, target: Path) -> None:
+    """
+    Convert a CSV file to a columnar cache
+
+    Args:
+        source (Path): CSV file
+        target (Path): Cache directory
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    df = pd.read_csv(source)
+    target.mkdir(parents=True, exist_ok=True)
+
+    meta = {"version": VERSION, "rows": len(df), "columns": []}
+    for position, (name, column) in enumerate(df.items()):
+        file = f"{position}.npy"
+
+        if column.dtype == object:
+            codes, uniques = pd.factorize(column)
+            for dtype in (np.int8, np.int16, np.int32, np.int64):
+                if len(uniques) <= np.iinfo(dtype).max:
+                    break
+            np.save(target.joinpath(file), codes.astype(dtype))
+            meta["columns"].append(
+                {"name": name, "file": file, "categories": uniques.tolist()}
+            )
+        elif isinstance(column.dtype, np.dtype):
+            np.save(target.joinpath(file), column.to_numpy())
+            meta["columns"].append({"name": name, "file": file})
+        else:
+            raise TypeError(f"Unsupported column type {column.dtype} of {name}")
+
+    with open(target.joinpath(META_FILE), "w") as f:
+        json.dump(meta, f)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "convert":
+        sys.exit(f"Usage: {sys.argv[0]} convert <csv> <cache dir>")
+
+    convert(Path(sys.argv[2]), Path(sys.argv[3]))
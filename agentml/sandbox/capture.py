@@ -0,0 +1,179 @@
+"""
+agentml/sandbox/capture.py
+
+Bounded capture of the sandbox output streams
+"""
+
+import asyncio
+import codecs
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+from config import SANDBOX_OUTPUT_HEAD_SIZE, SANDBOX_OUTPUT_TAIL_SIZE
+
+from .models import OutputChunk
+
+CHUNK_SIZE = 64 * 1024
+
+
+class OutputCapture:
+    """
+    Output stream capture with a bounded memory footprint
+
+    Keeps the head and the tail of the stream in memory.
+    Once the stream outgrows them, the whole stream is spilled to a file.
+    """
+
+    def __init__(
+        self,
+        spill_path: Path | None = None,
+        label: str | None = None,
+        head_size: int = SANDBOX_OUTPUT_HEAD_SIZE,
+        tail_size: int = SANDBOX_OUTPUT_TAIL_SIZE,
+    ) -> None:
+        """
+        OutputCapture constructor
+
+        Args:
+            spill_path (Path | None, optional): File to spill the full stream to. Defaults to None.
+            label (str | None, optional): Name of the spill file shown in the output. Defaults to the file path.
+            head_size (int, optional): Bytes kept from the start of the stream. Defaults to SANDBOX_OUTPUT_HEAD_SIZE.
+            tail_size (int, optional): Bytes kept from the end of the stream. Defaults to SANDBOX_OUTPUT_TAIL_SIZE.
+        """
+
+        self.spill_path: Path | None = spill_path
+        self.label: str = label or str(spill_path)
+        self.head_size: int = head_size
+        self.tail_size: int = tail_size
+
+        self.size: int = 0
+        self._head = bytearray()
+        self._tail = bytearray()
+        self._spill: BinaryIO | None = None
+
+    @property
+    def spilled(self) -> bool:
+        """Whether the stream was spilled to the spill file"""
+        return self._spill is not None
+
+    @property
+    def truncated(self) -> bool:
+        """Whether part of the stream is not kept in memory"""
+        return self.size > self.head_size + self.tail_size
+
+    def write(self, data: bytes) -> None:
+        """
+        Capture a chunk of the stream
+
+        Args:
+            data (bytes): Chunk
+        """
+
+        if (
+            not self.truncated
+            and self.size + len(data) > self.head_size + self.tail_size
+        ):
+            # Everything captured so far is still in memory
+            if self.spill_path is not None:
+                self.spill_path.parent.mkdir(parents=True, exist_ok=True)
+                self._spill = open(self.spill_path, "wb")
+                self._spill.write(self._head + self._tail)
+
+        if self._spill is not None:
+            self._spill.write(data)
+
+        self.size += len(data)
+
+        head_free = self.head_size - len(self._head)
+        if head_free > 0:
+            self._head += data[:head_free]
+            data = data[head_free:]
+
+        self._tail += data
+        if len(self._tail) > self.tail_size:
+            del self._tail[: len(self._tail) - self.tail_size]
+
+    def close(self) -> None:
+        """Close the spill file"""
+        if self._spill is not None:
+            self._spill.close()
+
+    def getvalue(self) -> str:
+        """
+        Get the captured stream, eliding the middle if it was not kept in memory
+
+        Returns:
+            str: Captured stream
+        """
+
+        head = self._head.decode(errors="replace")
+        tail = self._tail.decode(errors="replace")
+        if not self.truncated:
+            return head + tail
+
+        omitted = self.size - len(self._head) - len(self._tail)
+        note = f"{omitted} bytes omitted"
+        if self.spilled:
+            note += f", full output saved to {self.label}"
+
+        return f"{head}\n... [{note}] ...\n{tail}"
+
+
+class ExecutionOutput:
+    """Captured stdout and stderr of an execution, forwarded live to an optional callback"""
+
+    def __init__(
+        self,
+        spill_dir: Path | None = None,
+        label_dir: str | None = None,
+        on_output: Callable[[OutputChunk], None] | None = None,
+    ) -> None:
+        """
+        ExecutionOutput constructor
+
+        Args:
+            spill_dir (Path | None, optional): Directory of the stdout.log and stderr.log spill files. Defaults to None.
+            label_dir (str | None, optional): Name of the spill directory shown in the output. Defaults to the directory path.
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the output as it is produced. Defaults to None.
+        """
+
+        self.on_output = on_output
+        self.captures: dict[str, OutputCapture] = {
+            stream: OutputCapture(
+                spill_path=spill_dir.joinpath(f"{stream}.log") if spill_dir else None,
+                label=f"{label_dir or spill_dir}/{stream}.log",
+            )
+            for stream in ("stdout", "stderr")
+        }
+
+    @property
+    def stdout(self) -> OutputCapture:
+        """Captured stdout"""
+        return self.captures["stdout"]
+
+    @property
+    def stderr(self) -> OutputCapture:
+        """Captured stderr"""
+        return self.captures["stderr"]
+
+    async def read(self, stream: str, reader: asyncio.StreamReader) -> None:
+        """
+        Capture a stream until its end
+
+        Args:
+            stream (str): Stream name (stdout or stderr)
+            reader (asyncio.StreamReader): Stream reader
+        """
+
+        capture = self.captures[stream]
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+        try:
+            while data := await reader.read(CHUNK_SIZE):
+                capture.write(data)
+                if self.on_output is not None:
+                    text = decoder.decode(data)
+                    if text:
+                        self.on_output(OutputChunk(stream=stream, text=text))
+        finally:
+            capture.close()
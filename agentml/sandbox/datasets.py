@@ -0,0 +1,472 @@
+"""
+agentml/sandbox/datasets.py
+
+Content-addressed store of the datasets mounted in the sandboxes
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Iterator
+
+CHUNK_SIZE = 1024**2
+
+# ioctl cloning a file into another one on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+# Standalone loader converting the CSV datasets to columnar caches
+LOADER_PATH = Path(__file__).with_name("agentml_data.py")
+
+
+class DatasetStore:
+    """
+    Dataset files stored once by content digest and linked into the sessions
+
+    Sessions get a reflink of each file when the filesystem supports it, a hardlink
+    to the read-only stored file otherwise, and a read-only symlink as a last resort.
+    The store counts the sessions using each file and deletes the unused files.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, root: Path) -> None:
+        """
+        DatasetStore constructor
+
+        Args:
+            root (Path): Store directory
+        """
+
+        self.root: Path = root
+        self.objects_dir: Path = root.joinpath("objects")
+        self.columns_dir: Path = root.joinpath("columns")
+
+        # Digest of each session dataset file, and digests of the source files
+        self.refs_path: Path = root.joinpath("refs.json")
+        self.index_path: Path = root.joinpath("index.json")
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[None]:
+        """Lock the store against other threads and processes"""
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.root.joinpath(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    @contextlib.contextmanager
+    def locked_digest(self, digest: str) -> Iterator[None]:
+        """Lock a stored file against other threads and processes"""
+        self.columns_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.columns_dir.joinpath(f"{digest}.lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def object_path(self, digest: str) -> Path:
+        """Path of a stored file"""
+        return self.objects_dir.joinpath(digest[:2], digest)
+
+    def mount(self, session_id: str, sources: dict[Path, Path]) -> dict[Path, str]:
+        """
+        Store dataset files and directories and link them into a session
+
+        Replaces the datasets previously mounted in the session.
+
+        Args:
+            session_id (str): Session using the datasets
+            sources (dict[Path, Path]): Path in the session of each dataset file or directory
+
+        Returns:
+            dict[Path, str]: Digest of each file linked into the session
+        """
+
+        files = []
+        for source, target in sources.items():
+            if source.is_dir():
+                files.extend(
+                    (file, target.joinpath(file.relative_to(source)))
+                    for file in sorted(source.rglob("*"))
+                    if file.is_file()
+                )
+            else:
+                files.append((source, target))
+
+        # Hash and copy the new files outside the store lock, so that storing a large
+        # dataset does not block the other sessions
+        index = self._read(self.index_path)
+        stored = []
+        for file, link in files:
+            key, entry = self._hash(file, index)
+            self._store(file, entry["digest"])
+            stored.append((file, link, key, entry))
+
+        with self.locked():
+            refs = self._read(self.refs_path)
+            index = self._read(self.index_path)
+            session_refs = refs[session_id] = {}
+
+            for file, link, key, entry in stored:
+                digest = entry["digest"]
+                index[key] = entry
+
+                # Deleted by another session while it was not referenced yet
+                if not self.object_path(digest).exists():
+                    self._replace(self._copy(file, digest), digest, file)
+
+                link.parent.mkdir(parents=True, exist_ok=True)
+                if link.exists() or link.is_symlink():
+                    link.unlink()
+                method = link_file(self.object_path(digest), link)
+                print(f"DatasetStore: Mounted {file} as {link} ({method})")
+
+                session_refs[str(link)] = digest
+
+            self._write(self.index_path, index)
+            self._collect(refs)
+
+        return {Path(link): digest for link, digest in session_refs.items()}
+
+    def link(self, session_id: str, links: dict[Path, str]) -> None:
+        """
+        Link stored files into a session by digest, without hashing them again
+
+        Replaces the datasets previously mounted in the session.
+
+        Args:
+            session_id (str): Session using the datasets
+            links (dict[Path, str]): Digest of each file to link, by path in the session
+        """
+
+        with self.locked():
+            refs = self._read(self.refs_path)
+            session_refs = refs[session_id] = {}
+
+            for link, digest in links.items():
+                link.parent.mkdir(parents=True, exist_ok=True)
+                if link.exists() or link.is_symlink():
+                    link.unlink()
+                link_file(self.object_path(digest), link)
+                session_refs[str(link)] = digest
+
+            self._collect(refs)
+
+    def columns(self, digest: str, timeout: float | None = None) -> Path | None:
+        """
+        Get the columnar cache of a stored CSV file, converting it the first time
+
+        Args:
+            digest (str): Digest of the CSV file
+            timeout (float | None, optional): Seconds allowed for the conversion. Defaults to None.
+
+        Returns:
+            Path | None: Cache directory, or None if the file could not be converted
+        """
+
+        path = self.columns_dir.joinpath(digest)
+        failed_path = path.with_suffix(".failed")
+
+        # Convert under a lock of the digest only, so that converting a large file
+        # does not block the other sessions and datasets on the store lock
+        with self.locked_digest(digest):
+            if path.exists():
+                return path
+            if failed_path.exists():
+                return None
+
+            tmp_path = path.with_suffix(".tmp")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            try:
+                subprocess.run(
+                    [
+                        sys.executable,
+                        str(LOADER_PATH),
+                        "convert",
+                        str(self.object_path(digest)),
+                        str(tmp_path),
+                    ],
+                    stdin=subprocess.DEVNULL,
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout,
+                    check=True,
+                )
+            except subprocess.CalledProcessError as e:
+                print(f"DatasetStore: Failed to convert {digest}: {e.stderr}")
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                failed_path.touch()
+                return None
+            except subprocess.TimeoutExpired:
+                print(f"DatasetStore: Timed out converting {digest}")
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                return None
+
+            for file in tmp_path.iterdir():
+                os.chmod(file, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+
+            # Unused files are deleted under the store lock
+            with self.locked():
+                if not self.object_path(digest).exists():
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    return None
+                os.replace(tmp_path, path)
+            print(f"DatasetStore: Converted {digest} to a columnar cache")
+
+            return path
+
+    def release(self, session_id: str) -> None:
+        """
+        Release the datasets of a session, deleting the files no other session uses
+
+        Args:
+            session_id (str): Session ID
+        """
+
+        with self.locked():
+            refs = self._read(self.refs_path)
+            refs.pop(session_id, None)
+            self._collect(refs)
+
+    def mounted(self, session_id: str) -> dict[Path, str]:
+        """
+        Get the datasets mounted in a session
+
+        Args:
+            session_id (str): Session ID
+
+        Returns:
+            dict[Path, str]: Digest of each file linked into the session
+        """
+
+        refs = self._read(self.refs_path).get(session_id, {})
+        return {Path(link): digest for link, digest in refs.items()}
+
+    def usage(self) -> dict[str, int]:
+        """
+        Count the sessions using each stored file
+
+        Returns:
+            dict[str, int]: Number of sessions by digest
+        """
+
+        counts: dict[str, set[str]] = {}
+        for session_id, session_refs in self._read(self.refs_path).items():
+            for digest in session_refs.values():
+                counts.setdefault(digest, set()).add(session_id)
+
+        return {digest: len(sessions) for digest, sessions in counts.items()}
+
+    @staticmethod
+    def _hash(file: Path, index: dict) -> tuple[str, dict]:
+        """Get the index key and entry (signature and digest) of a source file"""
+        stat_result = file.stat()
+        key = str(file.resolve())
+        signature = [stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino]
+
+        # Only hash the source again if it changed since it was last stored
+        cached = index.get(key)
+        if cached is not None and cached["signature"] == signature:
+            return key, cached
+
+        return key, {"signature": signature, "digest": hash_file(file)}
+
+    def _store(self, file: Path, digest: str) -> None:
+        """Add a file to the store, unless it is already stored"""
+        path = self.object_path(digest)
+
+        # Sessions storing the same file wait for the first one instead of copying it too
+        with self.locked_digest(digest):
+            if path.exists() and path.stat().st_size == file.stat().st_size:
+                return
+
+            tmp_path = self._copy(file, digest)
+            with self.locked():
+                self._replace(tmp_path, digest, file)
+
+    def _copy(self, file: Path, digest: str) -> Path:
+        """Copy a file to a temporary file of the store, read-only"""
+        tmp_dir = self.root.joinpath("tmp")
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = tmp_dir.joinpath(f"{digest}.{os.getpid()}.{threading.get_ident()}")
+
+        tmp_path.unlink(missing_ok=True)
+        if not reflink(file, tmp_path):
+            shutil.copyfile(file, tmp_path)
+
+        # Hardlinked sessions share the stored file, so it must not be modified
+        os.chmod(tmp_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        return tmp_path
+
+    def _replace(self, tmp_path: Path, digest: str, file: Path) -> None:
+        """Move a copied file into the store, under the store lock"""
+        path = self.object_path(digest)
+        if path.exists() and path.stat().st_size != tmp_path.stat().st_size:
+            # Overwritten through a hardlink by a process ignoring the permissions (root)
+            print(f"DatasetStore: Replacing corrupted dataset file {digest}")
+            path.unlink()
+            shutil.rmtree(self.columns_dir.joinpath(digest), ignore_errors=True)
+
+        if path.exists():
+            tmp_path.unlink()
+            return
+
+        path.parent.mkdir(exist_ok=True)
+        os.replace(tmp_path, path)
+        print(f"DatasetStore: Stored {file} as {digest}")
+
+    def _collect(self, refs: dict) -> None:
+        """Delete the stored files no session uses, and the sessions that no longer exist"""
+        sessions_dir = self.root.parent
+        for session_id in list(refs):
+            if not sessions_dir.joinpath(session_id).exists():
+                del refs[session_id]
+        self._write(self.refs_path, refs)
+
+        used = {
+            digest for session_refs in refs.values() for digest in session_refs.values()
+        }
+        for path in self.objects_dir.glob("*/*"):
+            if path.name not in used:
+                print(f"DatasetStore: Deleting unused dataset file {path.name}")
+                path.unlink(missing_ok=True)
+        if self.columns_dir.exists():
+            for path in self.columns_dir.iterdir():
+                if path.stem not in used:
+                    if path.is_dir():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink(missing_ok=True)
+
+        # Forget the sources of deleted files
+        index = self._read(self.index_path)
+        index = {key: value for key, value in index.items() if value["digest"] in used}
+        self._write(self.index_path, index)
+
+    @staticmethod
+    def _read(path: Path) -> dict:
+        """Read a JSON file of the store"""
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _write(path: Path, data: dict) -> None:
+        """Write a JSON file of the store atomically"""
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+
+def hash_file(file: Path) -> str:
+    """
+    Compute the sha256 digest of a file
+
+    Args:
+        file (Path): File
+
+    Returns:
+        str: Hex digest
+    """
+
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def reflink(source: Path, target: Path) -> bool:
+    """
+    Clone a file on a copy-on-write filesystem
+
+    Args:
+        source (Path): File to clone
+        target (Path): Clone path
+
+    Returns:
+        bool: Whether the filesystem supports cloning the file
+    """
+
+    try:
+        with open(source, "rb") as src, open(target, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return True
+    except OSError:
+        target.unlink(missing_ok=True)
+        return False
+
+
+def copy_file(source: Path | str, target: Path | str) -> Path:
+    """
+    Copy a file with its metadata, cloning it on copy-on-write filesystems
+
+    Can be used as the copy function of shutil.copytree.
+
+    Args:
+        source (Path | str): File to copy
+        target (Path | str): Copy path
+
+    Returns:
+        Path: Copy path
+    """
+
+    source, target = Path(source), Path(target)
+    if reflink(source, target):
+        shutil.copystat(source, target)
+    else:
+        shutil.copy2(source, target)
+
+    return target
+
+
+def link_file(source: Path, link: Path) -> str:
+    """
+    Link a file with a reflink, a hardlink or a read-only symlink, whichever is supported first
+
+    Args:
+        source (Path): File to link
+        link (Path): Link path
+
+    Returns:
+        str: Method used (reflink, hardlink or symlink)
+    """
+
+    if reflink(source, link):
+        return "reflink"
+
+    return hardlink_file(source, link)
+
+
+def hardlink_file(source: Path, link: Path) -> str:
+    """
+    Link a file with a hardlink, or a symlink across filesystems
+
+    Unlike a reflink, which is a separate inode, both keep sharing the page cache of
+    the source, so use this for read-only files that are memory-mapped.
+
+    Args:
+        source (Path): File to link
+        link (Path): Link path
+
+    Returns:
+        str: Method used (hardlink or symlink)
+    """
+
+    try:
+        os.link(source, link)
+        return "hardlink"
+    except OSError:
+        pass
+
+    link.symlink_to(source.resolve())
+    return "symlink"
@@ -0,0 +1,175 @@
+"""
+agentml/sandbox/kernel.py
+
+Stateful Python kernel to execute code cells in a persistent namespace
+"""
+
+import os
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from config import SANDBOX_POOL_WARM_MODULES
+
+from .models import ExecutionResult, ResourceLimits
+from .pool import USAGE_FIELDS, WORKER_PATH
+from .worker import read_message, write_message
+
+
+class KernelError(RuntimeError):
+    """Kernel crashed or is not reachable"""
+
+
+class KernelTimeout(KernelError):
+    """Kernel killed after a cell ran past its timeout"""
+
+
+class Kernel:
+    """Long-lived kernel process owned by a sandbox session"""
+
+    def __init__(
+        self,
+        cwd: Path,
+        warm_modules: list[str] = SANDBOX_POOL_WARM_MODULES,
+        limits: ResourceLimits | None = None,
+    ) -> None:
+        """
+        Kernel constructor
+
+        Args:
+            cwd (Path): Working directory of the kernel
+            warm_modules (list[str], optional): Modules imported at startup. Defaults to SANDBOX_POOL_WARM_MODULES.
+            limits (ResourceLimits | None, optional): Memory and open files limits of the kernel, and timeout of each cell. Defaults to the configured limits.
+        """
+
+        self.cwd: Path = cwd
+        self.limits: ResourceLimits = limits or ResourceLimits()
+        self.cells: int = 0
+        self._lock = threading.Lock()
+
+        cmd_r, cmd_w = os.pipe()
+        reply_r, reply_w = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [
+                    sys.executable,
+                    str(WORKER_PATH),
+                    "kernel",
+                    "--cmd-fd",
+                    str(cmd_r),
+                    "--reply-fd",
+                    str(reply_w),
+                    "--warm",
+                    ",".join(warm_modules),
+                    "--limits",
+                    self.limits.model_dump_json(),
+                ],
+                cwd=cwd,
+                pass_fds=(cmd_r, reply_w),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+        finally:
+            os.close(cmd_r)
+            os.close(reply_w)
+
+        self._commands = os.fdopen(cmd_w, "wb")
+        self._replies = os.fdopen(reply_r, "rb")
+
+    @property
+    def alive(self) -> bool:
+        """Whether the kernel process is running"""
+        return self.process.poll() is None
+
+    def _request(self, message: dict, timeout: float | None = None) -> dict:
+        """Send a request to the kernel and wait for its reply, killing the kernel on timeout"""
+        with self._lock:
+            try:
+                write_message(self._commands, message)
+
+                ready, _, _ = select.select([self._replies], [], [], timeout)
+                if not ready:
+                    self.kill()
+                    raise KernelTimeout(
+                        f"Kernel: Kernel killed after {timeout:g}s timeout"
+                    )
+
+                reply = read_message(self._replies)
+            except (OSError, ValueError) as e:
+                reply = None
+                print(f"Kernel: Failed to communicate with the kernel: {e}")
+
+        if reply is None:
+            self.process.wait()
+            raise KernelError(
+                f"Kernel: Kernel crashed with exit code {self.process.returncode}"
+            )
+
+        return reply
+
+    def execute(self, code: str) -> ExecutionResult:
+        """
+        Execute a cell in the kernel namespace
+
+        Args:
+            code (str): Cell code
+
+        Returns:
+            ExecutionResult: Cell execution result
+        """
+
+        start = time.perf_counter()
+        reply = self._request(
+            {"op": "execute", "code": code}, timeout=self.limits.timeout
+        )
+        self.cells += 1
+
+        return ExecutionResult.terminated(
+            returncode=0 if reply["ok"] else 1,
+            timed_out=False,
+            memory_error=reply["memory_error"],
+            limits=self.limits,
+            stdout=reply["stdout"],
+            stderr=reply["stderr"],
+            startup_time=time.perf_counter() - start - reply["time"],
+            execution_time=reply["time"],
+            cell=True,
+            **{field: reply.get(field) for field in USAGE_FIELDS},
+        )
+
+    def namespace(self) -> dict:
+        """
+        Describe the variables of the kernel namespace
+
+        Returns:
+            dict: Variables (type, shape and size in bytes) and total size in bytes
+        """
+
+        return self._request({"op": "namespace"})
+
+    def kill(self) -> None:
+        """Kill the kernel process group"""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self.process.wait()
+
+    def close(self) -> None:
+        """Stop the kernel"""
+        for stream in (self._commands, self._replies):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.kill()
@@ -0,0 +1,239 @@
+"""
+agentml/sandbox/manifest.py
+
+Manifest of the sandbox files to track the files changed by each execution
+"""
+
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Iterator
+
+from config import SANDBOX_MANIFEST_HASH_LIMIT
+
+from .models import FileChanges, FileEntry
+
+# Directories never tracked, wherever they are
+IGNORED_DIRS = {"__pycache__"}
+
+# Files modified this close to a scan may change again without a visible mtime change
+RACY_WINDOW_NS = 2 * 10**9
+
+CHUNK_SIZE = 1024**2
+
+
+class Manifest:
+    """
+    Files of a directory tree (size, mtime and content hash)
+
+    Each scan only hashes the files whose size or mtime changed since the previous scan,
+    so rescanning a directory with thousands of unchanged files only costs a stat per file.
+    """
+
+    def __init__(
+        self,
+        root: Path,
+        path: Path | None = None,
+        exclude: set[str] | None = None,
+        hash_limit: int = SANDBOX_MANIFEST_HASH_LIMIT,
+    ) -> None:
+        """
+        Manifest constructor
+
+        Args:
+            root (Path): Directory tracked by the manifest
+            path (Path | None, optional): File the manifest is saved to. Defaults to None.
+            exclude (set[str] | None, optional): Top-level directories not tracked. Defaults to None.
+            hash_limit (int, optional): Files up to this size are content-hashed. Defaults to SANDBOX_MANIFEST_HASH_LIMIT.
+        """
+
+        self.root: Path = root
+        self.path: Path | None = path
+        self.exclude: set[str] = exclude or set()
+        self.hash_limit: int = hash_limit
+
+        # Files by path relative to the root (posix separators)
+        self.entries: dict[str, FileEntry] = {}
+        self.scanned_ns: int = 0
+
+    @classmethod
+    def load(cls, root: Path, path: Path, **kwargs) -> "Manifest":
+        """
+        Load a saved manifest, or create an empty one
+
+        Args:
+            root (Path): Directory tracked by the manifest
+            path (Path): File the manifest is saved to
+            **kwargs: Other constructor arguments
+
+        Returns:
+            Manifest: Manifest
+        """
+
+        manifest = cls(root=root, path=path, **kwargs)
+
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+            manifest.entries = {
+                name: FileEntry(**entry) for name, entry in data["entries"].items()
+            }
+            manifest.scanned_ns = data["scanned_ns"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Manifest: Ignoring invalid manifest {path}: {e}")
+
+        return manifest
+
+    def save(self) -> None:
+        """Save the manifest"""
+        if self.path is None:
+            return
+
+        data = {
+            "scanned_ns": self.scanned_ns,
+            "entries": {
+                name: entry.model_dump() for name, entry in self.entries.items()
+            },
+        }
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def scan(self) -> FileChanges:
+        """
+        Rescan the directory and update the manifest
+
+        Returns:
+            FileChanges: Files created, modified and deleted since the previous scan
+        """
+
+        started_ns = time.time_ns()
+        entries: dict[str, FileEntry] = {}
+        changes = FileChanges()
+
+        for name, stat in self._walk():
+            previous = self.entries.get(name)
+            if (
+                previous is not None
+                and previous.size == stat.st_size
+                and previous.mtime_ns == stat.st_mtime_ns
+                and previous.mtime_ns < self.scanned_ns - RACY_WINDOW_NS
+            ):
+                entries[name] = previous
+                continue
+
+            entry = FileEntry(
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                digest=self._digest(name, stat.st_size),
+            )
+            entries[name] = entry
+
+            if previous is None:
+                changes.created.append(Path(name))
+            elif previous.digest is not None and entry.digest is not None:
+                if previous.digest != entry.digest:
+                    changes.modified.append(Path(name))
+            elif (previous.size, previous.mtime_ns) != (entry.size, entry.mtime_ns):
+                changes.modified.append(Path(name))
+
+        changes.deleted = [Path(name) for name in self.entries if name not in entries]
+        for files in (changes.created, changes.modified, changes.deleted):
+            files.sort()
+
+        self.entries = entries
+        self.scanned_ns = started_ns
+
+        return changes
+
+    def diff(self, other: "Manifest") -> FileChanges:
+        """
+        Compare the manifest with a later manifest of a copy of the directory
+
+        Args:
+            other (Manifest): Later manifest
+
+        Returns:
+            FileChanges: Files created, modified and deleted in the later manifest
+        """
+
+        changes = FileChanges()
+        for name, entry in other.entries.items():
+            previous = self.entries.get(name)
+            if previous is None:
+                changes.created.append(Path(name))
+            elif previous.digest is not None and entry.digest is not None:
+                if previous.digest != entry.digest:
+                    changes.modified.append(Path(name))
+            elif (previous.size, previous.mtime_ns) != (entry.size, entry.mtime_ns):
+                changes.modified.append(Path(name))
+
+        changes.deleted = [
+            Path(name) for name in self.entries if name not in other.entries
+        ]
+        for files in (changes.created, changes.modified, changes.deleted):
+            files.sort()
+
+        return changes
+
+    def files(self, prefix: str = "") -> list[Path]:
+        """
+        Get the tracked files
+
+        Args:
+            prefix (str, optional): Only get the files under this directory. Defaults to all files.
+
+        Returns:
+            list[Path]: Files relative to the root
+        """
+
+        if prefix:
+            prefix = prefix.rstrip("/") + "/"
+
+        return sorted(Path(name) for name in self.entries if name.startswith(prefix))
+
+    def _walk(self) -> Iterator[tuple[str, os.stat_result]]:
+        """Walk the directory tree, yielding the relative path and stat of each file"""
+        stack = [""]
+        while stack:
+            prefix = stack.pop()
+            try:
+                with os.scandir(self.root.joinpath(prefix)) as it:
+                    for entry in it:
+                        name = prefix + entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                if (
+                                    name not in self.exclude
+                                    and entry.name not in IGNORED_DIRS
+                                ):
+                                    stack.append(name + "/")
+                            elif entry.is_file():
+                                yield name, entry.stat()
+                        except OSError:
+                            # Removed while scanning
+                            continue
+            except OSError:
+                continue
+
+    def _digest(self, name: str, size: int) -> str | None:
+        """Hash the content of a file, or None if it is too large or unreadable"""
+        if size > self.hash_limit:
+            return None
+
+        digest = hashlib.sha256()
+        try:
+            with open(self.root.joinpath(name), "rb") as f:
+                while chunk := f.read(CHUNK_SIZE):
+                    digest.update(chunk)
+        except OSError:
+            return None
+
+        return digest.hexdigest()
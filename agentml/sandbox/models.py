@@ -0,0 +1,263 @@
+"""
+agentml/sandbox/models.py
+
+Sandbox models
+"""
+
+import signal
+from enum import Enum
+from pathlib import Path
+from uuid import UUID
+
+from pydantic import BaseModel
+
+from config import (
+    SANDBOX_CPU_TIME_LIMIT,
+    SANDBOX_MEMORY_LIMIT,
+    SANDBOX_OPEN_FILES_LIMIT,
+    SANDBOX_SESSION_QUOTA,
+    SANDBOX_TIMEOUT,
+)
+
+
+class ResourceLimits(BaseModel):
+    """Resource limits of a sandbox execution (None for no limit)"""
+
+    # Wall-clock seconds before the process group is killed
+    timeout: float | None = SANDBOX_TIMEOUT
+
+    # CPU seconds, address space bytes and open file descriptors of the script
+    cpu_time: int | None = SANDBOX_CPU_TIME_LIMIT
+    memory: int | None = SANDBOX_MEMORY_LIMIT
+    open_files: int | None = SANDBOX_OPEN_FILES_LIMIT
+
+    # Bytes of disk the session may use, and bytes written to a single file
+    # (set from the remaining disk quota before each execution)
+    disk: int | None = SANDBOX_SESSION_QUOTA
+    file_size: int | None = None
+
+
+class TerminationReason(Enum):
+    """Sandbox Execution Termination Reason"""
+
+    COMPLETED = "completed"
+    ERROR = "error"
+    TIMEOUT = "timeout"
+    MEMORY = "memory"
+    CPU_TIME = "cpu_time"
+    SIGNAL = "signal"
+
+
+class FileEntry(BaseModel):
+    """Sandbox file tracked by the manifest"""
+
+    size: int
+    mtime_ns: int
+
+    # sha256 of the content (None for files over the hash size limit)
+    digest: str | None = None
+
+
+class FileChanges(BaseModel):
+    """Files changed by an execution, relative to the sandbox directory"""
+
+    created: list[Path] = []
+    modified: list[Path] = []
+    deleted: list[Path] = []
+
+
+class SessionUsage(BaseModel):
+    """Disk usage and last access of a sandbox session"""
+
+    session_id: UUID
+
+    # Bytes used by the session files, and by the dataset files it shares with other sessions
+    size: int
+    shared_size: int
+
+    # Unix time of the last access
+    accessed: float
+
+
+class OutputChunk(BaseModel):
+    """Chunk of sandbox output produced while the code is running"""
+
+    stream: str
+    text: str
+
+
+class ExecutionResult(BaseModel):
+    """Sandbox Execution Result"""
+
+    returncode: int | None = None
+    termination: TerminationReason = TerminationReason.COMPLETED
+    limits: ResourceLimits | None = None
+
+    # Captured output (head and tail only for large outputs), and both combined for the agents
+    stdout: str = ""
+    stderr: str = ""
+    output: str = ""
+
+    # Files holding the full output when it was too large to keep in memory
+    stdout_file: Path | None = None
+    stderr_file: Path | None = None
+
+    # Files created or modified by the execution, and all the file changes
+    files: list[Path] = []
+    changes: FileChanges = FileChanges()
+
+    # Seconds until the script started running, seconds spent running it, and overall seconds
+    startup_time: float = 0.0
+    execution_time: float = 0.0
+    wall_time: float = 0.0
+
+    # CPU seconds, peak resident memory in bytes, and bytes read and written (including pipes)
+    user_time: float | None = None
+    system_time: float | None = None
+    peak_rss: int | None = None
+    read_bytes: int | None = None
+    write_bytes: int | None = None
+
+    # Whether the script ran in a pre-warmed worker
+    pooled: bool = False
+
+    # Whether the result was restored from the result cache instead of running the code
+    cached: bool = False
+
+    # Whether the code ran as a kernel cell, or as a full script after a kernel crash
+    cell: bool = False
+    fallback: bool = False
+
+    # Memory used by the kernel namespace variables in bytes
+    namespace_memory: int | None = None
+
+    # Disk used by the session after the execution in bytes, and whether it is over its quota
+    disk_usage: int | None = None
+    disk_quota_exceeded: bool = False
+
+    @property
+    def mode(self) -> str:
+        """How the code ran (cached, pooled, cell, fallback or cold)"""
+        if self.cached:
+            return "cached"
+        if self.fallback:
+            return "fallback"
+        if self.pooled:
+            return "pooled"
+        if self.cell:
+            return "cell"
+        return "cold"
+
+    def profile(self) -> dict:
+        """
+        Get the timings and resource usage of the execution
+
+        Returns:
+            dict: Execution profile
+        """
+
+        return {
+            "mode": self.mode,
+            "returncode": self.returncode,
+            "termination": self.termination.value,
+            **self.model_dump(
+                include={
+                    "startup_time",
+                    "execution_time",
+                    "wall_time",
+                    "user_time",
+                    "system_time",
+                    "peak_rss",
+                    "read_bytes",
+                    "write_bytes",
+                    "disk_usage",
+                }
+            ),
+        }
+
+    @classmethod
+    def terminated(
+        cls, returncode: int | None, timed_out: bool, memory_error: bool, **data
+    ) -> "ExecutionResult":
+        """
+        Create a result, classifying why the process terminated
+
+        Args:
+            returncode (int | None): Exit code (negative for a signal)
+            timed_out (bool): Whether the process group was killed on timeout
+            memory_error (bool): Whether the script raised a MemoryError
+            **data: Other result fields
+
+        Returns:
+            ExecutionResult: Execution result
+        """
+
+        if timed_out:
+            termination = TerminationReason.TIMEOUT
+        elif memory_error:
+            termination = TerminationReason.MEMORY
+        elif returncode is None:
+            termination = TerminationReason.SIGNAL
+        elif returncode == -signal.SIGXCPU:
+            termination = TerminationReason.CPU_TIME
+        elif returncode == -signal.SIGKILL:
+            # Not killed by the sandbox: hard CPU limit if the script used up its
+            # CPU time, out of memory otherwise
+            limits = data.get("limits")
+            cpu_time = (data.get("user_time") or 0) + (data.get("system_time") or 0)
+            if limits is not None and limits.cpu_time and cpu_time >= limits.cpu_time:
+                termination = TerminationReason.CPU_TIME
+            else:
+                termination = TerminationReason.MEMORY
+        elif returncode < 0:
+            termination = TerminationReason.SIGNAL
+        elif returncode > 0:
+            termination = TerminationReason.ERROR
+        else:
+            termination = TerminationReason.COMPLETED
+
+        return cls(returncode=returncode, termination=termination, **data)
+
+    def describe_termination(self) -> str | None:
+        """
+        Describe why the execution was terminated by the sandbox, or that it ran out of disk
+
+        Returns:
+            str | None: Description, or None if the code ran to completion or raised an error within its quota
+        """
+
+        limits = self.limits or ResourceLimits()
+
+        match self.termination:
+            case TerminationReason.TIMEOUT:
+                return (
+                    f"Execution timed out after {limits.timeout:g} seconds and was killed."
+                    " Make the code faster or process less data."
+                )
+            case TerminationReason.MEMORY:
+                limit = f" of {limits.memory / 2**30:g} GiB" if limits.memory else ""
+                return (
+                    f"Execution ran out of memory{limit} and was terminated."
+                    " Use less memory, for example by sampling or processing the data in chunks."
+                )
+            case TerminationReason.CPU_TIME:
+                return (
+                    f"Execution exceeded the CPU time limit of {limits.cpu_time} seconds"
+                    " and was killed. Make the code faster or process less data."
+                )
+            case TerminationReason.SIGNAL:
+                if self.returncode is None:
+                    return "Execution was terminated before it completed."
+                try:
+                    name = signal.Signals(-self.returncode).name
+                except ValueError:
+                    name = str(-self.returncode)
+                return f"Execution was killed by signal {name}."
+
+        if self.disk_quota_exceeded:
+            return (
+                "The sandbox is over its disk quota, so writing files fails."
+                " Delete files that are no longer needed, or write smaller files."
+            )
+
+        return None
@@ -0,0 +1,390 @@
+"""
+agentml/sandbox/pool.py
+
+Pre-warmed worker pool to execute sandbox scripts
+"""
+
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from config import (
+    SANDBOX_POOL_MAX_RUNS,
+    SANDBOX_POOL_SIZE,
+    SANDBOX_POOL_WARM_MODULES,
+)
+
+from .capture import ExecutionOutput
+from .models import ExecutionResult, ResourceLimits
+from .worker import HEADER
+
+WORKER_PATH = Path(__file__).with_name("worker.py")
+
+# Seconds to wait for the output to end after killing a process group
+KILL_GRACE_PERIOD = 5
+
+# Resource usage reported by the launcher when the script exits
+USAGE_FIELDS = ("user_time", "system_time", "peak_rss", "read_bytes", "write_bytes")
+
+
+class PoolError(RuntimeError):
+    """Worker pool failure"""
+
+
+class Zygote:
+    """Pre-warmed worker interpreter that forks a fresh process for each script"""
+
+    def __init__(self, warm_modules: list[str], max_runs: int) -> None:
+        """
+        Zygote constructor
+
+        Args:
+            warm_modules (list[str]): Modules to import before serving scripts
+            max_runs (int): Number of scripts to serve before recycling (0 for no limit)
+        """
+
+        self.max_runs: int = max_runs
+        self.runs: int = 0
+
+        self.sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.process = subprocess.Popen(
+                [
+                    sys.executable,
+                    str(WORKER_PATH),
+                    "serve",
+                    "--fd",
+                    str(child_sock.fileno()),
+                    "--max-runs",
+                    str(max_runs),
+                    "--warm",
+                    ",".join(warm_modules),
+                ],
+                pass_fds=(child_sock.fileno(),),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+            )
+        finally:
+            child_sock.close()
+
+    @property
+    def available(self) -> bool:
+        """Whether the zygote can serve another script"""
+        if self.max_runs > 0 and self.runs >= self.max_runs:
+            return False
+        return self.process.poll() is None
+
+    def submit(self, job: dict, fds: list[int]) -> None:
+        """
+        Send a job and its stdout/stderr/status file descriptors to the zygote
+
+        Args:
+            job (dict): Job description
+            fds (list[int]): File descriptors passed to the forked script
+        """
+
+        payload = json.dumps(job).encode()
+        data = HEADER.pack(len(payload)) + payload
+        sent = socket.send_fds(self.sock, [data], fds)
+        if sent < len(data):
+            self.sock.sendall(data[sent:])
+        self.runs += 1
+
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop the zygote (scripts already running are not affected)
+
+        Args:
+            wait (bool, optional): Wait for the zygote to exit. Defaults to True.
+        """
+
+        self.sock.close()
+        if not wait:
+            return
+
+        try:
+            self.process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+class WorkerPool:
+    """Pool of pre-warmed worker interpreters (forkserver-style)"""
+
+    def __init__(
+        self,
+        size: int = SANDBOX_POOL_SIZE,
+        warm_modules: list[str] = SANDBOX_POOL_WARM_MODULES,
+        max_runs: int = SANDBOX_POOL_MAX_RUNS,
+    ) -> None:
+        """
+        WorkerPool constructor
+
+        Args:
+            size (int, optional): Number of pre-warmed workers. Defaults to SANDBOX_POOL_SIZE.
+            warm_modules (list[str], optional): Modules imported by the workers. Defaults to SANDBOX_POOL_WARM_MODULES.
+            max_runs (int, optional): Scripts served by a worker before it is recycled. Defaults to SANDBOX_POOL_MAX_RUNS.
+        """
+
+        if not self.supported():
+            raise PoolError("WorkerPool: Platform does not support forking workers")
+
+        self.size: int = size
+        self.warm_modules: list[str] = warm_modules
+        self.max_runs: int = max_runs
+
+        self._lock = threading.Lock()
+        self._next: int = 0
+        self._zygotes: list[Zygote] = [
+            Zygote(warm_modules=warm_modules, max_runs=max_runs) for _ in range(size)
+        ]
+
+    @staticmethod
+    def supported() -> bool:
+        """Check if the platform can fork workers and pass file descriptors"""
+        return hasattr(os, "fork") and hasattr(socket, "send_fds")
+
+    async def run(
+        self,
+        cwd: Path,
+        script: str = "main.py",
+        output: ExecutionOutput | None = None,
+        limits: ResourceLimits | None = None,
+    ) -> ExecutionResult:
+        """
+        Run a script in a process forked from a pre-warmed worker
+
+        Args:
+            cwd (Path): Working directory of the script
+            script (str, optional): Script to run. Defaults to "main.py".
+            output (ExecutionOutput | None, optional): Output capture. Defaults to in-memory capture.
+            limits (ResourceLimits | None, optional): Resource limits. Defaults to the configured limits.
+
+        Returns:
+            ExecutionResult: Execution result
+        """
+
+        limits = limits or ResourceLimits()
+
+        stdout_r, stdout_w = os.pipe()
+        stderr_r, stderr_w = os.pipe()
+        status_r, status_w = os.pipe()
+
+        submitted = time.perf_counter()
+        try:
+            self._submit(
+                {"cwd": str(cwd), "script": script, "limits": limits.model_dump()},
+                [stdout_w, stderr_w, status_w],
+            )
+        except OSError as e:
+            for fd in (stdout_r, stderr_r, status_r):
+                os.close(fd)
+            raise PoolError(f"WorkerPool: Failed to submit script: {e}") from e
+        finally:
+            for fd in (stdout_w, stderr_w, status_w):
+                os.close(fd)
+
+        result = await collect(
+            await open_reader(stdout_r),
+            await open_reader(stderr_r),
+            await open_reader(status_r),
+            submitted,
+            output or ExecutionOutput(),
+            limits,
+        )
+
+        result.pooled = True
+        return result
+
+    def _submit(self, job: dict, fds: list[int]) -> None:
+        """Submit a job to the next zygote, recycling exhausted or dead zygotes"""
+        with self._lock:
+            index = self._next
+            self._next = (self._next + 1) % self.size
+
+            zygote = self._zygotes[index]
+            if not zygote.available:
+                zygote.close(wait=False)
+                zygote = Zygote(warm_modules=self.warm_modules, max_runs=self.max_runs)
+                self._zygotes[index] = zygote
+
+            zygote.submit(job, fds)
+
+    def close(self) -> None:
+        """Stop all the workers"""
+        with self._lock:
+            for zygote in self._zygotes:
+                zygote.close()
+            self._zygotes = []
+
+
+async def launch(
+    cwd: Path,
+    script: str = "main.py",
+    output: ExecutionOutput | None = None,
+    limits: ResourceLimits | None = None,
+) -> ExecutionResult:
+    """
+    Run a script in a fresh (cold) interpreter
+
+    Args:
+        cwd (Path): Working directory of the script
+        script (str, optional): Script to run. Defaults to "main.py".
+        output (ExecutionOutput | None, optional): Output capture. Defaults to in-memory capture.
+        limits (ResourceLimits | None, optional): Resource limits. Defaults to the configured limits.
+
+    Returns:
+        ExecutionResult: Execution result
+    """
+
+    limits = limits or ResourceLimits()
+
+    status_r, status_w = os.pipe()
+    submitted = time.perf_counter()
+    try:
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            str(WORKER_PATH),
+            "launch",
+            "--status-fd",
+            str(status_w),
+            "--limits",
+            limits.model_dump_json(),
+            script,
+            cwd=cwd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=(status_w,),
+            start_new_session=True,
+        )
+    except BaseException:
+        os.close(status_r)
+        raise
+    finally:
+        os.close(status_w)
+
+    result = await collect(
+        process.stdout,
+        process.stderr,
+        await open_reader(status_r),
+        submitted,
+        output or ExecutionOutput(),
+        limits,
+        pgid=process.pid,
+    )
+    await process.wait()
+
+    return result
+
+
+async def open_reader(fd: int) -> asyncio.StreamReader:
+    """
+    Open the read end of a pipe as an asyncio stream (closed at end of stream)
+
+    Args:
+        fd (int): Pipe read end
+
+    Returns:
+        asyncio.StreamReader: Stream reader
+    """
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(fd, "rb", buffering=0)
+    )
+    return reader
+
+
+async def collect(
+    stdout: asyncio.StreamReader,
+    stderr: asyncio.StreamReader,
+    status: asyncio.StreamReader,
+    submitted: float,
+    output: ExecutionOutput,
+    limits: ResourceLimits,
+    pgid: int | None = None,
+) -> ExecutionResult:
+    """
+    Collect the output and lifecycle events of a launched script
+
+    Kills the process group of the script if it runs past the timeout after it started.
+
+    Args:
+        stdout (asyncio.StreamReader): Script stdout
+        stderr (asyncio.StreamReader): Script stderr
+        status (asyncio.StreamReader): Launcher status events
+        submitted (float): perf_counter time at which the script was submitted
+        output (ExecutionOutput): Output capture
+        limits (ResourceLimits): Resource limits
+        pgid (int | None, optional): Process group of the launcher if known before it starts. Defaults to None.
+
+    Returns:
+        ExecutionResult: Execution result
+    """
+
+    events: dict[str, tuple[float, dict]] = {}
+    started_event = asyncio.Event()
+
+    async def read_events() -> None:
+        """Timestamp lifecycle events as they arrive"""
+        async for line in status:
+            event = json.loads(line)
+            events[event["event"]] = (time.perf_counter(), event)
+            if event["event"] == "started":
+                started_event.set()
+
+    tasks = [
+        asyncio.create_task(output.read("stdout", stdout)),
+        asyncio.create_task(output.read("stderr", stderr)),
+        asyncio.create_task(read_events()),
+    ]
+
+    # The timeout starts once the script is running, not while a worker warms up
+    waiter = asyncio.create_task(started_event.wait())
+    await asyncio.wait([waiter, tasks[2]], return_when=asyncio.FIRST_COMPLETED)
+    waiter.cancel()
+
+    _, pending = await asyncio.wait(tasks, timeout=limits.timeout)
+
+    timed_out = bool(pending)
+    if timed_out:
+        pgid = pgid or events.get("started", (None, {}))[1].get("pgid")
+        print(f"Sandbox: Killing process group {pgid} after {limits.timeout}s timeout")
+        if pgid is not None:
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+        _, pending = await asyncio.wait(pending, timeout=KILL_GRACE_PERIOD)
+        for task in pending:
+            task.cancel()
+
+    finished = time.perf_counter()
+    started, _ = events.get("started", (finished, {}))
+    exited, exit_event = events.get("exited", (finished, {}))
+
+    result = ExecutionResult.terminated(
+        returncode=exit_event.get("returncode"),
+        timed_out=timed_out,
+        memory_error="memory_error" in events,
+        limits=limits,
+        stdout=output.stdout.getvalue(),
+        stderr=output.stderr.getvalue(),
+        stdout_file=output.stdout.spill_path if output.stdout.spilled else None,
+        stderr_file=output.stderr.spill_path if output.stderr.spilled else None,
+        startup_time=started - submitted,
+        execution_time=exited - started,
+        **{field: exit_event.get(field) for field in USAGE_FIELDS},
+    )
+
+    return result
@@ -0,0 +1,255 @@
+"""
+agentml/sandbox/results.py
+
+Cache of the sandbox execution results to skip re-running identical code on identical files
+"""
+
+import contextlib
+import fcntl
+import functools
+import hashlib
+import importlib.metadata
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Iterator
+
+from config import SANDBOX_POOL_WARM_MODULES, SANDBOX_RESULT_CACHE_SIZE
+
+from .datasets import reflink
+from .models import ExecutionResult, FileChanges, TerminationReason
+from .pool import USAGE_FIELDS
+
+# Executions that ran to their end (with or without an error) are reproducible
+CACHED_TERMINATIONS = {TerminationReason.COMPLETED, TerminationReason.ERROR}
+
+
+@functools.cache
+def environment() -> dict:
+    """
+    Describe the Python environment the sandbox code runs in
+
+    Returns:
+        dict: Python version and versions of the packages of the warm modules
+    """
+
+    distributions = importlib.metadata.packages_distributions()
+    packages = sorted(
+        {
+            distribution
+            for module in SANDBOX_POOL_WARM_MODULES
+            for distribution in distributions.get(module.split(".")[0], [])
+        }
+    )
+
+    versions = {}
+    for package in packages:
+        try:
+            versions[package] = importlib.metadata.version(package)
+        except importlib.metadata.PackageNotFoundError:
+            versions[package] = None
+
+    return {"python": sys.version, "packages": versions}
+
+
+class ResultCache:
+    """
+    On-disk cache of execution results and the files they produced
+
+    Entries are keyed by a digest of everything the execution depends on,
+    and the least recently used entries are evicted past the size limit.
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, root: Path, max_size: int = SANDBOX_RESULT_CACHE_SIZE) -> None:
+        """
+        ResultCache constructor
+
+        Args:
+            root (Path): Cache directory
+            max_size (int, optional): Maximum size of the cached files in bytes. Defaults to SANDBOX_RESULT_CACHE_SIZE.
+        """
+
+        self.root: Path = root
+        self.max_size: int = max_size
+        self.index_path: Path = root.joinpath("index.json")
+
+    @staticmethod
+    def key(files: dict[str, str], **data) -> str:
+        """
+        Compute the cache key of an execution
+
+        Args:
+            files (dict[str, str]): Fingerprint (digest or stat) of each file visible to the code
+            **data: Other inputs of the execution (code, limits...)
+
+        Returns:
+            str: Cache key
+        """
+
+        payload = {"files": files, "environment": environment(), **data}
+        return hashlib.sha256(
+            json.dumps(payload, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    @contextlib.contextmanager
+    def locked(self) -> Iterator[dict]:
+        """Lock the cache against other threads and processes, yielding its index"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.root.joinpath(".lock"), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            try:
+                with open(self.index_path, "r") as f:
+                    index = json.load(f)
+            except (FileNotFoundError, ValueError):
+                index = {"entries": {}, "hits": 0, "misses": 0}
+
+            yield index
+
+            tmp_path = self.index_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+
+    def get(self, key: str, target: Path) -> ExecutionResult | None:
+        """
+        Get a cached result and restore the files it produced
+
+        Args:
+            key (str): Cache key
+            target (Path): Sandbox directory to restore the files into
+
+        Returns:
+            ExecutionResult | None: Cached result, or None on a cache miss
+        """
+
+        with self.locked() as index:
+            entry_dir = self.root.joinpath(key)
+            if key not in index["entries"] or not entry_dir.exists():
+                index["misses"] += 1
+                return None
+
+            with open(entry_dir.joinpath("entry.json"), "r") as f:
+                entry = json.load(f)
+
+            for file in entry["files"]:
+                path = target.joinpath(file)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                path.unlink(missing_ok=True)
+                if not reflink(entry_dir.joinpath("files", file), path):
+                    shutil.copyfile(entry_dir.joinpath("files", file), path)
+            for file in entry["deleted"]:
+                target.joinpath(file).unlink(missing_ok=True)
+
+            index["entries"][key]["used"] = time.time()
+            index["hits"] += 1
+
+        # Nothing ran, so only the output and the exit status are relevant
+        result = ExecutionResult.model_validate(entry["result"])
+        return result.model_copy(
+            update={
+                "cached": True,
+                "pooled": False,
+                "startup_time": 0.0,
+                "execution_time": 0.0,
+                **{field: None for field in USAGE_FIELDS},
+            }
+        )
+
+    def put(
+        self, key: str, result: ExecutionResult, changes: FileChanges, source: Path
+    ) -> None:
+        """
+        Cache a result and the files it produced, evicting the least recently used entries
+
+        Args:
+            key (str): Cache key
+            result (ExecutionResult): Execution result
+            changes (FileChanges): Files changed by the execution
+            source (Path): Sandbox directory holding the produced files
+        """
+
+        if result.termination not in CACHED_TERMINATIONS:
+            return
+
+        entry_dir = self.root.joinpath(key)
+        tmp_dir = self.root.joinpath(f"{key}.{os.getpid()}.{threading.get_ident()}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True)
+
+        # Copy the files outside the lock, they may be large
+        size = 0
+        files = [file.as_posix() for file in changes.created + changes.modified]
+        try:
+            for file in files:
+                path = tmp_dir.joinpath("files", file)
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if not reflink(source.joinpath(file), path):
+                    shutil.copyfile(source.joinpath(file), path)
+                size += path.stat().st_size
+        except OSError as e:
+            print(f"ResultCache: Not caching {key}, failed to copy the files: {e}")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        entry = {
+            "result": result.model_dump(
+                mode="json", exclude={"files", "changes", "stdout_file", "stderr_file"}
+            ),
+            "files": files,
+            "deleted": [file.as_posix() for file in changes.deleted],
+        }
+        with open(tmp_dir.joinpath("entry.json"), "w") as f:
+            json.dump(entry, f)
+
+        if size > self.max_size:
+            print(f"ResultCache: Not caching {key}, its files exceed the cache size")
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            return
+
+        with self.locked() as index:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            os.replace(tmp_dir, entry_dir)
+            index["entries"][key] = {"size": size, "used": time.time()}
+            self._evict(index)
+
+    def clear(self) -> None:
+        """Delete all the cached results and reset the counters"""
+        with self.locked() as index:
+            for key in index["entries"]:
+                shutil.rmtree(self.root.joinpath(key), ignore_errors=True)
+            index.update({"entries": {}, "hits": 0, "misses": 0})
+
+    def stats(self) -> dict:
+        """
+        Get the cache statistics
+
+        Returns:
+            dict: Number of entries, total size in bytes, hits and misses
+        """
+
+        with self.locked() as index:
+            return {
+                "entries": len(index["entries"]),
+                "size": sum(entry["size"] for entry in index["entries"].values()),
+                "hits": index["hits"],
+                "misses": index["misses"],
+            }
+
+    def _evict(self, index: dict) -> None:
+        """Evict the least recently used entries until the cache fits its size limit"""
+        entries = index["entries"]
+        size = sum(entry["size"] for entry in entries.values())
+
+        for key in sorted(entries, key=lambda key: entries[key]["used"]):
+            if size <= self.max_size:
+                break
+            print(f"ResultCache: Evicting {key}")
+            size -= entries.pop(key)["size"]
+            shutil.rmtree(self.root.joinpath(key), ignore_errors=True)
@@ -4,16 +4,79 @@ agentml/sandbox.py
 Code Sandbox to execute code in a safe environment
 """
 
+import asyncio
+import atexit
 import base64
-import os
+import json
 import shutil
-import subprocess
-import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Tuple
-from uuid import UUID
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+from uuid import UUID, uuid4
 
-from config import PROJECT_PATH, SANDBOX_DIR
+from config import (
+    PROJECT_PATH,
+    SANDBOX_CLEANUP_INTERVAL,
+    SANDBOX_COLUMNAR_CACHE,
+    SANDBOX_DIR,
+    SANDBOX_DISK_QUOTA,
+    SANDBOX_POOL_SIZE,
+    SANDBOX_RESULT_CACHE,
+    SANDBOX_SESSION_IDLE_TIME,
+)
+
+from .capture import ExecutionOutput
+from .datasets import LOADER_PATH, DatasetStore, copy_file, hardlink_file
+from .kernel import Kernel, KernelError, KernelTimeout
+from .manifest import Manifest
+from .models import (
+    ExecutionResult,
+    FileChanges,
+    OutputChunk,
+    ResourceLimits,
+    SessionUsage,
+    TerminationReason,
+)
+from .pool import PoolError, WorkerPool, launch
+from .results import ResultCache
+from .sessions import Janitor, directory_size, list_sessions, session_usage, touch
+
+# Session metadata directory inside the sandbox
+META_DIR = ".agentml"
+
+# Dataset store and result cache directories next to the sandboxes
+DATASETS_DIR = ".datasets"
+RESULTS_DIR = ".results"
+
+# Image types shown to the vision agent and the UI
+IMAGE_TYPES = {".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png"}
+
+T = TypeVar("T")
+
+
+def run_sync(coroutine: Awaitable[T]) -> T:
+    """
+    Run a coroutine to completion from synchronous code
+
+    Safe to call from any thread: the coroutine runs on a private event loop,
+    in a helper thread if the calling thread already runs an event loop.
+
+    Args:
+        coroutine (Awaitable[T]): Coroutine to run
+
+    Returns:
+        T: Coroutine result
+    """
+
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coroutine).result()
 
 
 class Sandbox:
@@ -21,16 +84,34 @@ class Sandbox:
 
     sandbox_base: Path = SANDBOX_DIR
 
-    def __init__(self, session_id: UUID) -> None:
+    # Pre-warmed worker pool shared by all the sandboxes
+    _pool: WorkerPool | None = None
+    _pool_lock = threading.Lock()
+
+    # Stateful kernels by session
+    _kernels: dict[UUID, Kernel] = {}
+    _kernels_lock = threading.Lock()
+
+    # Background cleanup of the idle sessions
+    _janitor: Janitor | None = None
+    _janitor_lock = threading.Lock()
+
+    def __init__(self, session_id: UUID, limits: ResourceLimits | None = None) -> None:
         """
         Sandbox constructor
 
         Args:
             session_id (UUID): Session ID
+            limits (ResourceLimits | None, optional): Resource limits of each execution. Defaults to the configured limits.
         """
 
         self.session_id: UUID = session_id
         self.sandbox_dir: Path = self.sandbox_base.joinpath(str(session_id))
+        self.meta_dir: Path = self.sandbox_dir.joinpath(META_DIR)
+        self.limits: ResourceLimits = limits or ResourceLimits()
+
+        # Result of the last execution
+        self.last_result: ExecutionResult | None = None
 
         # Ensure the sandbox directory exists
         if not self.sandbox_dir.exists():
@@ -38,88 +119,910 @@ class Sandbox:
                 f"Sandbox: Sandbox directory not found: {self.sandbox_dir}"
             )
 
+        touch(self.meta_dir)
+
     @classmethod
     def create(
-        cls, session_id: UUID, files: list[Path], reset: bool = True
+        cls,
+        session_id: UUID,
+        files: list[Path],
+        reset: bool = True,
+        limits: ResourceLimits | None = None,
     ) -> "Sandbox":
         """
         Create and set up the sandbox
 
         Args:
             session_id (UUID): Session ID
-            files (list[Path]): List of files to be copied to the sandbox
+            files (list[Path]): List of dataset files and directories to be linked into the sandbox
             reset (bool, optional): Reset the sandbox if it already exists. Defaults to True.
+            limits (ResourceLimits | None, optional): Resource limits of each execution. Defaults to the configured limits.
         """
 
         sandbox_dir = cls.sandbox_base.joinpath(str(session_id))
 
         if not sandbox_dir.exists():
             print(f"Sandbox: Creating sandbox directory for session {session_id}")
-            sandbox_dir.mkdir()
+            sandbox_dir.mkdir(parents=True)
         else:
             print(f"Sandbox: Loading sandbox directory for session {session_id}")
             if not reset:
-                return cls(session_id=session_id)
+                return cls(session_id=session_id, limits=limits)
+
+            # Start over with a fresh kernel and without the files of the previous runs
+            cls(session_id=session_id).shutdown_kernel()
+            shutil.rmtree(sandbox_dir)
+            sandbox_dir.mkdir()
 
+        # Link the datasets from the shared store instead of copying them
+        sources = {}
         for file in files:
             if file.exists():
-                shutil.copy(file, sandbox_dir)
+                sources[file] = sandbox_dir.joinpath(file.name)
             else:
                 print(f"The file {file} does not exist.")
+        mounted = cls.get_datasets().mount(str(session_id), sources)
 
-        # Copy the main.py template
+        # Copy the main.py template and the dataset loader
         shutil.copy(
             PROJECT_PATH.joinpath("agentml", "sandbox", "config", "main.py.template"),
             sandbox_dir.joinpath("main.py"),
         )
+        shutil.copy(LOADER_PATH, sandbox_dir.joinpath(LOADER_PATH.name))
 
-        # Create output directory
+        # Create output and metadata directories
         sandbox_dir.joinpath("output").mkdir(exist_ok=True)
+        sandbox_dir.joinpath(META_DIR).mkdir(exist_ok=True)
+
+        # Start warming up the workers before the first execution
+        cls.get_pool()
+        cls.start_janitor()
+
+        sandbox = cls(session_id=session_id, limits=limits)
+
+        if SANDBOX_COLUMNAR_CACHE:
+            sandbox.link_columns(mounted)
+
+        return sandbox
+
+    @classmethod
+    def get_datasets(cls) -> DatasetStore:
+        """
+        Get the dataset store shared by the sandboxes
+
+        Returns:
+            DatasetStore: Dataset store
+        """
+
+        return DatasetStore(cls.sandbox_base.joinpath(DATASETS_DIR))
+
+    def link_columns(self, datasets: dict[Path, str]) -> None:
+        """
+        Link the columnar caches of the CSV datasets into the sandbox for the dataset loader
+
+        Args:
+            datasets (dict[Path, str]): Digest of each dataset file in the sandbox
+        """
+
+        columns_dir = self.meta_dir.joinpath("columns")
+        shutil.rmtree(columns_dir, ignore_errors=True)
+
+        for file, digest in datasets.items():
+            if file.suffix.lower() != ".csv":
+                continue
+
+            cache = self.get_datasets().columns(digest, timeout=self.limits.timeout)
+            if cache is None:
+                continue
+
+            target = columns_dir.joinpath(file.relative_to(self.sandbox_dir))
+            target.mkdir(parents=True)
+            # Never reflinked, so that the sessions share the page cache of the columns
+            for cache_file in cache.iterdir():
+                hardlink_file(cache_file, target.joinpath(cache_file.name))
+
+            # Lets the loader detect a dataset replaced after the cache was linked
+            stat = file.stat()
+            with open(target.joinpath("stat.json"), "w") as f:
+                json.dump([stat.st_size, stat.st_mtime_ns], f)
+
+    @classmethod
+    def get_result_cache(cls) -> ResultCache:
+        """
+        Get the execution result cache shared by the sandboxes
+
+        Returns:
+            ResultCache: Result cache
+        """
+
+        return ResultCache(cls.sandbox_base.joinpath(RESULTS_DIR))
+
+    def get_cache_key(self, manifest: Manifest) -> str:
+        """
+        Compute the result cache key of the next execution
+
+        The key covers the code and limits, the content of the sandbox files
+        (including the output directory, which the code may read back) and the environment.
+
+        Args:
+            manifest (Manifest): Up-to-date manifest of the sandbox files
+
+        Returns:
+            str: Cache key
+        """
+
+        datasets = {
+            link.relative_to(self.sandbox_dir).as_posix(): digest
+            for link, digest in self.get_datasets()
+            .mounted(str(self.session_id))
+            .items()
+        }
+
+        files = {}
+        for name, entry in manifest.entries.items():
+            if name in datasets:
+                # Datasets are too large to hash on each run, but their digest is known
+                files[name] = f"{datasets[name]}:{entry.size}:{entry.mtime_ns}"
+            else:
+                files[name] = entry.digest or f"{entry.size}:{entry.mtime_ns}"
+
+        return ResultCache.key(
+            files=files,
+            code=self.sandbox_dir.joinpath("main.py").read_text(),
+            limits=self.limits.model_dump(),
+        )
+
+    def get_limits(self) -> ResourceLimits:
+        """
+        Get the resource limits of the next execution
+
+        Returns:
+            ResourceLimits: Sandbox limits, with the file size limited to the remaining disk quota
+        """
+
+        if self.limits.disk is None:
+            return self.limits
+
+        remaining = self.limits.disk - self.usage().size
+        return self.limits.model_copy(update={"file_size": max(remaining, 0)})
+
+    def usage(self) -> SessionUsage:
+        """
+        Get the disk usage and last access of the session
+
+        Returns:
+            SessionUsage: Session usage
+        """
+
+        return session_usage(self.sandbox_dir, META_DIR)
+
+    @classmethod
+    def disk_usage(cls) -> dict:
+        """
+        Get the disk usage of all the sandboxes
+
+        Returns:
+            dict: Usage of each session, bytes used by the dataset store and the result cache, and total bytes
+        """
+
+        sessions = [
+            session_usage(session_dir, META_DIR)
+            for session_dir in list_sessions(cls.sandbox_base)
+        ]
+        datasets = sum(directory_size(cls.sandbox_base.joinpath(DATASETS_DIR)))
+        results = sum(directory_size(cls.sandbox_base.joinpath(RESULTS_DIR)))
+
+        return {
+            "sessions": sessions,
+            "datasets": datasets,
+            "results": results,
+            "total": sum(session.size for session in sessions) + datasets + results,
+        }
+
+    @classmethod
+    def cleanup(
+        cls,
+        max_size: int | None = SANDBOX_DISK_QUOTA,
+        idle_time: float = SANDBOX_SESSION_IDLE_TIME,
+    ) -> list[UUID]:
+        """
+        Delete the least recently used idle sessions until the sandboxes fit the disk quota
+
+        Args:
+            max_size (int | None, optional): Disk quota of all the sandboxes in bytes. Defaults to SANDBOX_DISK_QUOTA.
+            idle_time (float, optional): Seconds since the last access before a session can be deleted. Defaults to SANDBOX_SESSION_IDLE_TIME.
+
+        Returns:
+            list[UUID]: Deleted sessions
+        """
+
+        if max_size is None:
+            return []
+
+        usage = cls.disk_usage()
+        total = usage["total"]
+        if total <= max_size:
+            return []
+
+        print(
+            f"Sandbox: Sandboxes use {total / 2**30:.1f} GiB "
+            f"of {max_size / 2**30:.1f} GiB, evicting idle sessions"
+        )
+
+        deleted = []
+        now = time.time()
+        for session in sorted(usage["sessions"], key=lambda session: session.accessed):
+            if total <= max_size:
+                break
+            if now - session.accessed < idle_time or session.session_id in cls._kernels:
+                continue
+
+            cls(session_id=session.session_id).delete()
+            deleted.append(session.session_id)
+
+            # Deleting the session may also release its datasets
+            datasets = usage["datasets"]
+            usage["datasets"] = sum(
+                directory_size(cls.sandbox_base.joinpath(DATASETS_DIR))
+            )
+            total -= session.size + datasets - usage["datasets"]
+
+        return deleted
+
+    @classmethod
+    def start_janitor(cls) -> None:
+        """Start cleaning up the idle sessions periodically in the background"""
+        with cls._janitor_lock:
+            if cls._janitor is None and SANDBOX_CLEANUP_INTERVAL:
+                cls._janitor = Janitor(
+                    cleanup=cls.cleanup, interval=SANDBOX_CLEANUP_INTERVAL
+                )
+                cls._janitor.start()
+
+    def delete(self) -> None:
+        """Delete the sandbox and release its datasets"""
+        print(f"Sandbox: Deleting sandbox directory for session {self.session_id}")
+        self.shutdown_kernel()
+        shutil.rmtree(self.sandbox_dir, ignore_errors=True)
+        self.get_datasets().release(str(self.session_id))
+
+    def fork(self) -> "Sandbox":
+        """
+        Copy the sandbox into a new session, to run code in isolation
+
+        Files are cloned when the filesystem supports it and the datasets are linked from
+        the store. The kernel of a forked session replays the cells of the sandbox.
+
+        Returns:
+            Sandbox: Sandbox of the new session
+        """
+
+        fork_id = uuid4()
+        fork_dir = self.sandbox_base.joinpath(str(fork_id))
+        print(f"Sandbox: Forking sandbox {self.session_id} as {fork_id}")
+
+        # Base of the changes merged back into this sandbox
+        manifest = self.get_manifest()
+        manifest.scan()
+        manifest.save()
+
+        datasets = self.get_datasets().mounted(str(self.session_id))
+        dataset_files = {link.relative_to(self.sandbox_dir) for link in datasets}
+
+        def ignore(directory: str, names: list[str]) -> set[str]:
+            """Skip the datasets and the metadata linked or recorded per session"""
+            relative = Path(directory).relative_to(self.sandbox_dir)
+            ignored = {
+                name for name in names if relative.joinpath(name) in dataset_files
+            }
+            if relative == Path(META_DIR):
+                ignored.update({"columns", "executions.jsonl"})
+            return ignored
+
+        shutil.copytree(
+            self.sandbox_dir, fork_dir, ignore=ignore, copy_function=copy_file
+        )
+
+        links = {
+            fork_dir.joinpath(link.relative_to(self.sandbox_dir)): digest
+            for link, digest in datasets.items()
+        }
+        self.get_datasets().link(str(fork_id), links)
+
+        meta_dir = fork_dir.joinpath(META_DIR)
+        shutil.copy(manifest.path, meta_dir.joinpath("fork_manifest.json"))
+        with open(meta_dir.joinpath("fork.json"), "w") as f:
+            json.dump(
+                {"parent": str(self.session_id), "cells": len(self.get_cells())}, f
+            )
+
+        sandbox = type(self)(session_id=fork_id, limits=self.limits)
+        if SANDBOX_COLUMNAR_CACHE:
+            sandbox.link_columns(links)
 
-        return cls(session_id=session_id)
+        return sandbox
 
-    def execute(self) -> Tuple[str, List[Path]]:
+    def merge(self, fork: "Sandbox") -> FileChanges:
+        """
+        Merge the files, cells and executions of a forked sandbox into the sandbox
+
+        Files changed by several forks take the content of the last merged fork.
+
+        Args:
+            fork (Sandbox): Sandbox forked from this sandbox
+
+        Returns:
+            FileChanges: Files created, modified and deleted in the fork
+        """
+
+        with open(fork.meta_dir.joinpath("fork.json"), "r") as f:
+            origin = json.load(f)
+
+        base = Manifest.load(
+            root=fork.sandbox_dir,
+            path=fork.meta_dir.joinpath("fork_manifest.json"),
+            exclude={META_DIR},
+        )
+        manifest = fork.get_manifest()
+        manifest.scan()
+        changes = base.diff(manifest)
+
+        for file in changes.created + changes.modified:
+            target = self.sandbox_dir.joinpath(file)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.unlink(missing_ok=True)
+            copy_file(fork.sandbox_dir.joinpath(file), target)
+        for file in changes.deleted:
+            self.sandbox_dir.joinpath(file).unlink(missing_ok=True)
+
+        # Run the cells of the fork after the cells already in the session
+        cells = fork.get_cells()[origin["cells"] :]
+        if cells:
+            with open(self.meta_dir.joinpath("cells.json"), "w") as f:
+                json.dump([*self.get_cells(), *cells], f)
+
+            # The kernel replays all the cells on its next use
+            self.shutdown_kernel()
+
+        executions = fork.meta_dir.joinpath("executions.jsonl")
+        if executions.exists():
+            with (
+                open(executions, "r") as src,
+                open(self.meta_dir.joinpath("executions.jsonl"), "a") as dst,
+            ):
+                shutil.copyfileobj(src, dst)
+
+        print(
+            f"Sandbox: Merged sandbox {fork.session_id} into {self.session_id}: "
+            f"{len(changes.created)} created, {len(changes.modified)} modified, "
+            f"{len(changes.deleted)} deleted, {len(cells)} cells"
+        )
+
+        return changes
+
+    @classmethod
+    def get_pool(cls) -> WorkerPool | None:
+        """
+        Get the shared worker pool, starting it on first use
+
+        Returns:
+            WorkerPool | None: Worker pool or None if disabled or unsupported
+        """
+
+        if SANDBOX_POOL_SIZE <= 0 or not WorkerPool.supported():
+            return None
+
+        with cls._pool_lock:
+            if cls._pool is None:
+                print(f"Sandbox: Starting worker pool with {SANDBOX_POOL_SIZE} workers")
+                cls._pool = WorkerPool(size=SANDBOX_POOL_SIZE)
+                atexit.register(cls._pool.close)
+            return cls._pool
+
+    def execute(
+        self,
+        on_output: Callable[[OutputChunk], None] | None = None,
+        cache: bool = SANDBOX_RESULT_CACHE,
+        label: str | None = None,
+    ) -> ExecutionResult:
         """
         Execute the code in the sandbox and capture the output
 
+        Thread-safe: sandboxes of different sessions can execute concurrently.
+
+        Args:
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the output as it is produced. Defaults to None.
+            cache (bool, optional): Reuse the result of an identical execution (disable for nondeterministic code). Defaults to SANDBOX_RESULT_CACHE.
+            label (str | None, optional): Task recorded with the execution profile. Defaults to None.
+
+        Returns:
+            ExecutionResult: Execution result with the output, output files and profile
+        """
+
+        return run_sync(
+            self.execute_async(on_output=on_output, cache=cache, label=label)
+        )
+
+    async def execute_async(
+        self,
+        on_output: Callable[[OutputChunk], None] | None = None,
+        cache: bool = SANDBOX_RESULT_CACHE,
+        label: str | None = None,
+    ) -> ExecutionResult:
+        """
+        Execute the code in the sandbox and capture the output
+
+        Args:
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the output as it is produced. Defaults to None.
+            cache (bool, optional): Reuse the result of an identical execution (disable for nondeterministic code). Defaults to SANDBOX_RESULT_CACHE.
+            label (str | None, optional): Task recorded with the execution profile. Defaults to None.
+
         Returns:
-            Tuple[str, List[Path]]: Output and list of output files
+            ExecutionResult: Execution result with the output, output files and profile
         """
-        # Get the list of files before execution
-        initial_files = set(os.listdir(self.sandbox_dir))
 
-        # Change to the sandbox directory
-        old_cwd = Path.cwd()
-        os.chdir(self.sandbox_dir)
+        print(f"Sandbox: Executing code in sandbox {self.session_id}")
+        return await self._execute(
+            lambda: self.run_script("main.py", on_output),
+            on_output=on_output,
+            cache=cache,
+            label=label,
+        )
+
+    async def execute_stream(self) -> AsyncIterator[OutputChunk]:
+        """
+        Execute the code in the sandbox, yielding the output as it is produced
+
+        The result, including the output files, is available in last_result once the stream ends.
+
+        Yields:
+            OutputChunk: Chunk of stdout or stderr
+        """
+
+        chunks: asyncio.Queue[OutputChunk | None] = asyncio.Queue()
+
+        async def execute() -> None:
+            """Execute the code, then signal the end of the stream"""
+            try:
+                await self.execute_async(on_output=chunks.put_nowait)
+            finally:
+                chunks.put_nowait(None)
 
+        task = asyncio.create_task(execute())
         try:
-            # Run the main.py script
-            print(f"Sandbox: Executing code in sandbox {self.session_id}")
-            result = subprocess.run(
-                [sys.executable, "main.py"], capture_output=True, text=True
-            )
+            while (chunk := await chunks.get()) is not None:
+                yield chunk
+        finally:
+            await task
+
+    def execute_cell(
+        self,
+        code: str,
+        on_output: Callable[[OutputChunk], None] | None = None,
+        label: str | None = None,
+    ) -> ExecutionResult:
+        """
+        Execute a code cell in the session kernel and capture the output
+
+        Variables defined by the previous cells are kept in the kernel namespace.
+
+        Args:
+            code (str): Cell code
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the output of the cell. Defaults to None.
+            label (str | None, optional): Task recorded with the execution profile. Defaults to None.
+
+        Returns:
+            ExecutionResult: Execution result with the output, output files and profile
+        """
+
+        return run_sync(self.execute_cell_async(code, on_output=on_output, label=label))
+
+    async def execute_cell_async(
+        self,
+        code: str,
+        on_output: Callable[[OutputChunk], None] | None = None,
+        label: str | None = None,
+    ) -> ExecutionResult:
+        """
+        Execute a code cell in the session kernel and capture the output
+
+        Args:
+            code (str): Cell code
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the output of the cell. Defaults to None.
+            label (str | None, optional): Task recorded with the execution profile. Defaults to None.
+
+        Returns:
+            ExecutionResult: Execution result with the output, output files and profile
+        """
+
+        print(f"Sandbox: Executing cell in sandbox {self.session_id}")
+        return await self._execute(lambda: self.run_cell(code, on_output), label=label)
+
+    async def _execute(
+        self,
+        run: Callable[[], Awaitable[ExecutionResult]],
+        on_output: Callable[[OutputChunk], None] | None = None,
+        cache: bool = False,
+        label: str | None = None,
+    ) -> ExecutionResult:
+        """
+        Run the code and capture the output, the files changed and the profile of the execution
+
+        Args:
+            run (Callable[[], Awaitable[ExecutionResult]]): Coroutine function running the code
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the output of a cached result. Defaults to None.
+            cache (bool, optional): Reuse the result of an identical execution. Defaults to False.
+            label (str | None, optional): Task recorded with the execution profile. Defaults to None.
+
+        Returns:
+            ExecutionResult: Execution result
+        """
+        # Pick up the changes made since the previous execution
+        # (off the event loop, so that many sessions can execute concurrently)
+        manifest = self.get_manifest()
+        await asyncio.to_thread(manifest.scan)
+        result = None
+
+        result_cache = self.get_result_cache() if cache else None
+        key = await asyncio.to_thread(self.get_cache_key, manifest) if cache else None
+
+        start = time.perf_counter()
+        try:
+            if result_cache is not None:
+                result = await asyncio.to_thread(
+                    result_cache.get, key, self.sandbox_dir
+                )
+                if result is not None:
+                    print(f"Sandbox: Restored cached result {key}")
+                    for stream in ("stdout", "stderr"):
+                        text = getattr(result, stream)
+                        if text and on_output is not None:
+                            on_output(OutputChunk(stream=stream, text=text))
+
+            if result is None:
+                result = await run()
 
             # Capture the output
-            output = result.stdout
+            result.output = result.stdout
 
             if result.stderr:
-                output += "\nErrors:\n" + result.stderr
+                result.output += "\nErrors:\n" + result.stderr
 
         except Exception as e:
-            output = f"An error occurred during execution: {str(e)}"
+            result = ExecutionResult(
+                returncode=None,
+                termination=TerminationReason.ERROR,
+                limits=self.limits,
+                output=f"An error occurred during execution: {str(e)}",
+            )
 
         finally:
-            # Change back to the original directory
-            os.chdir(old_cwd)
+            # Determine the files created, modified and deleted during execution
+            changes = await asyncio.to_thread(manifest.scan)
+            await asyncio.to_thread(manifest.save)
+
+            if result is not None:
+                result.wall_time = time.perf_counter() - start
+                result.files = [
+                    self.sandbox_dir.joinpath(file)
+                    for file in changes.created + changes.modified
+                ]
+                result.changes = changes
+                self.last_result = result
+
+                await asyncio.to_thread(touch, self.meta_dir)
+                if self.limits.disk is not None:
+                    result.disk_usage = (await asyncio.to_thread(self.usage)).size
+                    result.disk_quota_exceeded = result.disk_usage >= self.limits.disk
+
+                await asyncio.to_thread(self._record, result, label)
+
+        if (
+            result_cache is not None
+            and not result.cached
+            and result.returncode is not None
+        ):
+            await asyncio.to_thread(
+                result_cache.put, key, result, changes, self.sandbox_dir
+            )
+
+        return result
+
+    def _record(self, result: ExecutionResult, label: str | None) -> None:
+        """Log the profile of an execution and append it to the session executions"""
+        profile = result.profile()
+        print(
+            f"Sandbox: Executed code in sandbox {self.session_id} ({result.mode}): "
+            f"{result.termination.value}, wall {result.wall_time:.3f}s, "
+            f"startup {result.startup_time:.3f}s, exec {result.execution_time:.3f}s"
+            + (
+                f", cpu {result.user_time:.3f}s user {result.system_time:.3f}s sys, "
+                f"peak rss {result.peak_rss / 2**20:.1f} MiB"
+                if result.user_time is not None
+                else ""
+            )
+        )
+
+        with open(self.meta_dir.joinpath("executions.jsonl"), "a") as f:
+            f.write(json.dumps({"time": time.time(), "label": label, **profile}) + "\n")
+
+    def get_executions(self) -> list[dict]:
+        """
+        Get the profiles of the executions of the session
+
+        Returns:
+            list[dict]: Execution profiles, oldest first
+        """
+
+        try:
+            with open(self.meta_dir.joinpath("executions.jsonl"), "r") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def get_execution_stats(self) -> dict:
+        """
+        Aggregate the profiles of the executions of the session
+
+        Returns:
+            dict: Number of executions (and cached ones), total times, peak RSS, total I/O and slowest executions
+        """
+
+        executions = self.get_executions()
+
+        def total(field: str) -> float:
+            """Sum a profile field over the executions"""
+            return sum(execution.get(field) or 0 for execution in executions)
+
+        return {
+            "executions": len(executions),
+            "cached": sum(execution["mode"] == "cached" for execution in executions),
+            "wall_time": total("wall_time"),
+            "startup_time": total("startup_time"),
+            "execution_time": total("execution_time"),
+            "user_time": total("user_time"),
+            "system_time": total("system_time"),
+            "peak_rss": max(
+                (execution.get("peak_rss") or 0 for execution in executions), default=0
+            ),
+            "read_bytes": total("read_bytes"),
+            "write_bytes": total("write_bytes"),
+            "slowest": sorted(
+                executions, key=lambda execution: execution["wall_time"], reverse=True
+            )[:5],
+        }
+
+    def _output(
+        self, on_output: Callable[[OutputChunk], None] | None = None
+    ) -> ExecutionOutput:
+        """Create the output capture of an execution, spilling to the metadata directory"""
+        return ExecutionOutput(
+            spill_dir=self.meta_dir, label_dir=META_DIR, on_output=on_output
+        )
+
+    async def run_script(
+        self, script: str, on_output: Callable[[OutputChunk], None] | None = None
+    ) -> ExecutionResult:
+        """
+        Run a script in the sandbox directory
+
+        Uses a pre-warmed worker when the pool is available and falls back to a cold interpreter.
+
+        Args:
+            script (str): Script to run, relative to the sandbox directory
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the output as it is produced. Defaults to None.
+
+        Returns:
+            ExecutionResult: Execution result
+        """
+
+        # The disk quota left is measured by walking the sandbox directory
+        limits = await asyncio.to_thread(self.get_limits)
+
+        pool = self.get_pool()
+        if pool is not None:
+            try:
+                return await pool.run(
+                    cwd=self.sandbox_dir,
+                    script=script,
+                    output=self._output(on_output),
+                    limits=limits,
+                )
+            except PoolError as e:
+                print(f"Sandbox: Falling back to a cold interpreter: {e}")
+
+        return await launch(
+            cwd=self.sandbox_dir,
+            script=script,
+            output=self._output(on_output),
+            limits=limits,
+        )
+
+    async def run_cell(
+        self, code: str, on_output: Callable[[OutputChunk], None] | None = None
+    ) -> ExecutionResult:
+        """
+        Run a code cell in the session kernel
+
+        If the kernel crashes, all the cells are run again as a full script instead,
+        and the next cell restarts the kernel. A cell running past the timeout kills the kernel.
+
+        Args:
+            code (str): Cell code
+            on_output (Callable[[OutputChunk], None] | None, optional): Callback receiving the output of the cell. Defaults to None.
+
+        Returns:
+            ExecutionResult: Execution result
+        """
+
+        cells = self.get_cells()
+
+        start = time.perf_counter()
+        try:
+            kernel = await asyncio.to_thread(self.get_kernel)
+            startup_time = time.perf_counter() - start
+
+            result = await asyncio.to_thread(kernel.execute, code)
+            result.startup_time += startup_time
+
+            # Bound the cell output like the script output
+            output = self._output(on_output)
+            for stream, capture in output.captures.items():
+                text = getattr(result, stream)
+                capture.write(text.encode())
+                capture.close()
+                if text and on_output is not None:
+                    on_output(OutputChunk(stream=stream, text=text))
+                setattr(result, stream, capture.getvalue())
+                setattr(
+                    result,
+                    f"{stream}_file",
+                    capture.spill_path if capture.spilled else None,
+                )
+
+            result.namespace_memory = (await asyncio.to_thread(kernel.namespace))[
+                "total"
+            ]
+            print(
+                f"Sandbox: Kernel namespace of session {self.session_id} "
+                f"uses {result.namespace_memory / 2**20:.1f} MiB"
+            )
+
+        except KernelTimeout as e:
+            print(f"Sandbox: {e}")
+            self.shutdown_kernel()
+
+            result = ExecutionResult.terminated(
+                returncode=None,
+                timed_out=True,
+                memory_error=False,
+                limits=self.limits,
+                execution_time=time.perf_counter() - start,
+                cell=True,
+            )
+
+        except KernelError as e:
+            print(f"Sandbox: {e}, falling back to full script mode")
+            self.shutdown_kernel()
+
+            self.update(code="\n\n".join([self.get_kernel_prelude(), *cells, code]))
+            result = await self.run_script("main.py", on_output)
+            result.fallback = True
+
+        if result.returncode == 0:
+            self.meta_dir.mkdir(exist_ok=True)
+            with open(self.meta_dir.joinpath("cells.json"), "w") as f:
+                json.dump([*cells, code], f)
 
-            # Get the list of files after execution
-            final_files = set(os.listdir(self.sandbox_dir))
+        return result
 
-            # Determine new files created during execution
-            new_files = final_files - initial_files
-            output_files = [self.sandbox_dir.joinpath(file) for file in new_files]
+    def get_kernel(self) -> Kernel:
+        """
+        Get the session kernel, starting it and replaying the previous cells if needed
+
+        Returns:
+            Kernel: Session kernel
+        """
+
+        with self._kernels_lock:
+            kernel = self._kernels.get(self.session_id)
+            if kernel is not None and kernel.alive:
+                return kernel
+
+            print(f"Sandbox: Starting kernel for session {self.session_id}")
+            if not self._kernels:
+                atexit.register(self.shutdown_kernels)
+            kernel = Kernel(cwd=self.sandbox_dir, limits=self.get_limits())
+            self._kernels[self.session_id] = kernel
+
+        # Restore the namespace of the previous cells
+        for cell in [self.get_kernel_prelude(), *self.get_cells()]:
+            kernel.execute(cell)
+
+        return kernel
+
+    def restart_kernel(self) -> Kernel:
+        """
+        Restart the session kernel, restoring the namespace of the previous cells
 
-        return output, output_files
+        Returns:
+            Kernel: New session kernel
+        """
+
+        self.shutdown_kernel()
+        return self.get_kernel()
+
+    def shutdown_kernel(self) -> None:
+        """Stop the session kernel if it is running"""
+        with self._kernels_lock:
+            kernel = self._kernels.pop(self.session_id, None)
+
+        if kernel is not None:
+            print(f"Sandbox: Stopping kernel for session {self.session_id}")
+            kernel.close()
+
+    @classmethod
+    def shutdown_kernels(cls) -> None:
+        """Stop all the session kernels"""
+        with cls._kernels_lock:
+            kernels = list(cls._kernels.values())
+            cls._kernels.clear()
+
+        for kernel in kernels:
+            kernel.close()
+
+    def get_cells(self) -> list[str]:
+        """
+        Get the cells successfully executed in the session
+
+        Returns:
+            list[str]: Cells code
+        """
+
+        cells_file = self.meta_dir.joinpath("cells.json")
+        if not cells_file.exists():
+            return []
+
+        with open(cells_file, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def get_kernel_prelude() -> str:
+        """
+        Get the code executed when a session kernel starts
+
+        Returns:
+            str: Kernel prelude code
+        """
+
+        with open(
+            PROJECT_PATH.joinpath("agentml", "sandbox", "config", "kernel.py.template"),
+            "r",
+        ) as f:
+            return f.read()
+
+    def get_namespace_content(self) -> str:
+        """
+        Get the description of the variables in the session kernel
+
+        Returns:
+            str: Variables of the kernel namespace formatted as markdown
+        """
+
+        try:
+            namespace = self.get_kernel().namespace()
+        except KernelError as e:
+            print(f"Sandbox: {e}")
+            self.shutdown_kernel()
+            return "Variables defined in the session are not available."
+
+        lines = [
+            f"- `{name}`: {variable['type']}"
+            + (f" of shape {tuple(variable['shape'])}" if variable["shape"] else "")
+            for name, variable in namespace["variables"].items()
+        ]
+
+        return "Variables defined in the session:\n" + "\n".join(lines)
 
     def update(self, code: str) -> None:
         """
@@ -148,6 +1051,42 @@ class Sandbox:
             code = f.read()
             return f"```python\n{code}\n```"
 
+    def get_manifest(self) -> Manifest:
+        """
+        Get the manifest of the sandbox files, as of the last execution
+
+        Returns:
+            Manifest: Sandbox file manifest
+        """
+
+        return Manifest.load(
+            root=self.sandbox_dir,
+            path=self.meta_dir.joinpath("manifest.json"),
+            exclude={META_DIR},
+        )
+
+    def get_images(self, changes: FileChanges | None = None) -> list[Path]:
+        """
+        Get the images in the output directory
+
+        Args:
+            changes (FileChanges | None, optional): Only get the images created or modified by these changes. Defaults to all images.
+
+        Returns:
+            list[Path]: Image paths
+        """
+
+        if changes is not None:
+            files = changes.created + changes.modified
+        else:
+            files = self.get_manifest().files("output")
+
+        return [
+            self.sandbox_dir.joinpath(file)
+            for file in files
+            if file.parts[0] == "output" and file.suffix.lower() in IMAGE_TYPES
+        ]
+
     def get_images_encoded(self) -> list[str]:
         """
         Get the list of images encoded as base64
@@ -162,13 +1101,18 @@ class Sandbox:
                 return base64.b64encode(image_file.read()).decode("utf-8")
 
         images = [
-            f"data:image/jpeg;base64,{encode_image(file)}"
-            for file in self.sandbox_dir.glob("output/*.jpg")
+            f"data:{IMAGE_TYPES[file.suffix.lower()]};base64,{encode_image(file)}"
+            for file in self.get_images()
+            if file.exists()
         ]
 
         return images
 
     def delete_images(self) -> None:
         """Delete all images in the sandbox"""
-        for file in self.sandbox_dir.glob("output/*.jpg"):
-            file.unlink()
+        manifest = self.get_manifest()
+        for file in manifest.files("output"):
+            if file.suffix.lower() in IMAGE_TYPES:
+                self.sandbox_dir.joinpath(file).unlink(missing_ok=True)
+                manifest.entries.pop(file.as_posix())
+        manifest.save()
@@ -0,0 +1,149 @@
+"""
+agentml/sandbox/sessions.py
+
+Disk usage, last access and eviction of the sandbox sessions
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable
+from uuid import UUID
+
+from .models import SessionUsage
+
+# File touched whenever a session is used, inside the session metadata directory
+ACCESS_FILE = "accessed"
+
+
+def touch(meta_dir: Path) -> None:
+    """
+    Record an access to a session
+
+    Args:
+        meta_dir (Path): Session metadata directory
+    """
+
+    meta_dir.mkdir(parents=True, exist_ok=True)
+    meta_dir.joinpath(ACCESS_FILE).touch()
+
+
+def directory_size(path: Path) -> tuple[int, int]:
+    """
+    Measure the disk space used by a directory tree
+
+    Files with several hardlinks are counted separately, as they are shared with other
+    directories. Symlinks are not followed.
+
+    Args:
+        path (Path): Directory
+
+    Returns:
+        tuple[int, int]: Bytes used by the files only linked once, and by the shared files
+    """
+
+    size, shared_size = 0, 0
+    stack = [path]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(Path(entry.path))
+                            continue
+                        if entry.is_symlink():
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+
+                    if stat.st_nlink > 1:
+                        shared_size += stat.st_blocks * 512
+                    else:
+                        size += stat.st_blocks * 512
+        except OSError:
+            continue
+
+    return size, shared_size
+
+
+def session_usage(session_dir: Path, meta_dir: str) -> SessionUsage:
+    """
+    Measure the disk usage and last access of a session
+
+    Args:
+        session_dir (Path): Session directory
+        meta_dir (str): Name of the session metadata directory
+
+    Returns:
+        SessionUsage: Session usage
+    """
+
+    size, shared_size = directory_size(session_dir)
+    try:
+        accessed = session_dir.joinpath(meta_dir, ACCESS_FILE).stat().st_mtime
+    except OSError:
+        accessed = session_dir.stat().st_mtime
+
+    return SessionUsage(
+        session_id=UUID(session_dir.name),
+        size=size,
+        shared_size=shared_size,
+        accessed=accessed,
+    )
+
+
+def list_sessions(sandbox_base: Path) -> list[Path]:
+    """
+    List the session directories
+
+    Args:
+        sandbox_base (Path): Directory of the sandboxes
+
+    Returns:
+        list[Path]: Session directories
+    """
+
+    sessions = []
+    if not sandbox_base.exists():
+        return sessions
+
+    for path in sandbox_base.iterdir():
+        try:
+            UUID(path.name)
+        except ValueError:
+            # Dataset store, result cache...
+            continue
+        if path.is_dir():
+            sessions.append(path)
+
+    return sessions
+
+
+class Janitor(threading.Thread):
+    """Background thread running the session cleanup periodically"""
+
+    def __init__(self, cleanup: Callable[[], object], interval: float) -> None:
+        """
+        Janitor constructor
+
+        Args:
+            cleanup (Callable[[], object]): Cleanup function
+            interval (float): Seconds between cleanups
+        """
+
+        super().__init__(name="sandbox-janitor", daemon=True)
+        self.cleanup = cleanup
+        self.interval: float = interval
+
+    def run(self) -> None:
+        """Run the cleanup until the process exits"""
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.cleanup()
+            except Exception as e:
+                print(f"Janitor: Session cleanup failed: {e}")
@@ -0,0 +1,512 @@
+"""
+agentml/sandbox/worker.py
+
+Sandbox worker process
+
+This file is executed as a standalone script and must not import agentml,
+so that workers start without loading the environment or the OpenAI client.
+
+Modes:
+    serve: Pre-warmed zygote. Imports the warm modules once, then receives jobs
+        (with their stdout/stderr/status file descriptors) over a unix socket
+        and forks a fresh launcher process for each job.
+    launch: Cold launcher. Runs a single script from the current directory.
+    kernel: Stateful kernel. Executes cells in a persistent namespace and
+        replies with their output (length-prefixed JSON messages).
+
+Each launcher forks the script process and reports its lifecycle on the
+status file descriptor as JSON lines ("started" and "exited" events, the
+latter with the resource usage of the script).
+"""
+
+import argparse
+import ast
+import builtins
+import contextlib
+import importlib
+import io
+import json
+import linecache
+import os
+import random
+import resource
+import runpy
+import socket
+import struct
+import sys
+import time
+import traceback
+from typing import BinaryIO
+
+HEADER = struct.Struct("!I")
+MAX_FDS = 3
+
+
+def warm(modules: list[str]) -> None:
+    """
+    Import the modules so that forked scripts get them for free
+
+    Args:
+        modules (list[str]): Modules to import
+    """
+
+    for module in modules:
+        try:
+            importlib.import_module(module)
+        except Exception as e:
+            print(f"Worker: Failed to import {module}: {e}", file=sys.stderr)
+
+
+def report(fd: int, event: str, **data) -> None:
+    """
+    Report a lifecycle event on the status file descriptor
+
+    Args:
+        fd (int): Status file descriptor
+        event (str): Event name
+        **data: Event data
+    """
+
+    line = json.dumps({"event": event, "time": time.time(), **data}) + "\n"
+    os.write(fd, line.encode())
+
+
+def apply_limits(limits: dict) -> None:
+    """
+    Apply resource limits to the current process
+
+    Args:
+        limits (dict): cpu_time (seconds), memory (address space bytes), open_files and file_size (bytes) limits
+    """
+
+    if limits.get("cpu_time"):
+        # SIGXCPU at the soft limit, SIGKILL shortly after
+        cpu_time = int(limits["cpu_time"])
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_time, cpu_time + 1))
+
+    if limits.get("memory"):
+        memory = int(limits["memory"])
+        resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+
+    if limits.get("file_size") is not None:
+        file_size = max(int(limits["file_size"]), 0)
+        resource.setrlimit(resource.RLIMIT_FSIZE, (file_size, file_size))
+
+    if limits.get("open_files"):
+        _, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        open_files = int(limits["open_files"])
+        if hard != resource.RLIM_INFINITY:
+            open_files = min(open_files, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (open_files, open_files))
+
+
+def run_script(job: dict, status_fd: int) -> None:
+    """
+    Run the script of a job in the current process and exit
+
+    Args:
+        job (dict): Job description
+        status_fd (int): Status file descriptor
+    """
+
+    apply_limits(job.get("limits") or {})
+
+    os.chdir(job["cwd"])
+    script = os.path.abspath(job["script"])
+    sys.argv = [job["script"]]
+    sys.path.insert(0, job["cwd"])
+
+    # Stream the output line by line instead of when the script exits
+    sys.stdout.reconfigure(line_buffering=True)
+
+    # Forked processes share the zygote random state
+    random.seed()
+    if "numpy" in sys.modules:
+        sys.modules["numpy"].random.seed()
+
+    code = 0
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException as e:
+        if isinstance(e, MemoryError):
+            report(status_fd, "memory_error")
+
+        # Hide the worker frames from the traceback
+        tb = e.__traceback__
+        while tb is not None and tb.tb_frame.f_code.co_filename != script:
+            tb = tb.tb_next
+        traceback.print_exception(type(e), e, tb)
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    os._exit(code)
+
+
+def read_io(pid: int | str) -> dict | None:
+    """
+    Read the I/O counters of a process
+
+    Args:
+        pid (int | str): Process ID, or "self"
+
+    Returns:
+        dict | None: Bytes read and written (including pipes), or None if not available
+    """
+
+    try:
+        with open(f"/proc/{pid}/io", "r") as f:
+            counters = dict(line.split(": ") for line in f.read().splitlines())
+    except (OSError, ValueError):
+        return None
+
+    return {"read_bytes": int(counters["rchar"]), "write_bytes": int(counters["wchar"])}
+
+
+def usage(rusage: resource.struct_rusage, io_counters: dict | None) -> dict:
+    """
+    Summarize the resource usage of a process
+
+    Args:
+        rusage (resource.struct_rusage): Resource usage
+        io_counters (dict | None): I/O counters, or None to use the block I/O counts
+
+    Returns:
+        dict: CPU seconds, peak RSS bytes and bytes read and written
+    """
+
+    if io_counters is None:
+        io_counters = {
+            "read_bytes": rusage.ru_inblock * 512,
+            "write_bytes": rusage.ru_oublock * 512,
+        }
+
+    return {
+        "user_time": rusage.ru_utime,
+        "system_time": rusage.ru_stime,
+        # Kilobytes on Linux, bytes on macOS
+        "peak_rss": rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024),
+        **io_counters,
+    }
+
+
+def launch(job: dict, status_fd: int) -> None:
+    """
+    Fork the script process, wait for it and report its lifecycle and resource usage
+
+    Args:
+        job (dict): Job description
+        status_fd (int): Status file descriptor
+    """
+
+    pid = os.fork()
+    if pid == 0:
+        run_script(job, status_fd)
+
+    report(status_fd, "started", pid=pid, pgid=os.getpgid(0))
+
+    # Wait for the script without reaping it, so that its I/O counters can still be read
+    io_counters = None
+    if hasattr(os, "waitid"):
+        os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+        io_counters = read_io(pid)
+
+    _, status, rusage = os.wait4(pid, 0)
+    report(
+        status_fd,
+        "exited",
+        returncode=os.waitstatus_to_exitcode(status),
+        **usage(rusage, io_counters),
+    )
+    os.close(status_fd)
+
+
+def receive(sock: socket.socket) -> tuple[dict | None, list[int]]:
+    """
+    Receive a job and its file descriptors from the pool
+
+    Args:
+        sock (socket.socket): Pool socket
+
+    Returns:
+        tuple[dict | None, list[int]]: Job (None if the pool closed) and file descriptors
+    """
+
+    data, fds, _, _ = socket.recv_fds(sock, HEADER.size, MAX_FDS)
+    while data and len(data) < HEADER.size:
+        data += sock.recv(HEADER.size - len(data))
+    if len(data) < HEADER.size:
+        return None, fds
+
+    (size,) = HEADER.unpack(data)
+    payload = b""
+    while len(payload) < size:
+        chunk = sock.recv(size - len(payload))
+        if not chunk:
+            return None, fds
+        payload += chunk
+
+    return json.loads(payload), fds
+
+
+def serve(fd: int, max_runs: int) -> None:
+    """
+    Serve jobs from the pool until it closes or the run limit is reached
+
+    Args:
+        fd (int): Pool socket file descriptor
+        max_runs (int): Number of jobs to serve before exiting (0 for no limit)
+    """
+
+    sock = socket.socket(fileno=fd)
+    runs = 0
+
+    while max_runs <= 0 or runs < max_runs:
+        # Reap finished launchers
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except ChildProcessError:
+            pass
+
+        job, fds = receive(sock)
+        if job is None:
+            break
+
+        stdout_fd, stderr_fd, status_fd = fds
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            sock.close()
+            os.setsid()
+            os.dup2(stdout_fd, 1)
+            os.dup2(stderr_fd, 2)
+            os.close(stdout_fd)
+            os.close(stderr_fd)
+            launch(job, status_fd)
+            os._exit(0)
+
+        for fd in fds:
+            os.close(fd)
+        runs += 1
+
+    sock.close()
+
+
+def read_message(stream: BinaryIO) -> dict | None:
+    """
+    Read a length-prefixed JSON message
+
+    Args:
+        stream (BinaryIO): Stream to read from
+
+    Returns:
+        dict | None: Message or None at end of stream
+    """
+
+    header = stream.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return None
+
+    (size,) = HEADER.unpack(header)
+    payload = stream.read(size)
+    if len(payload) < size:
+        return None
+
+    return json.loads(payload)
+
+
+def write_message(stream: BinaryIO, message: dict) -> None:
+    """
+    Write a length-prefixed JSON message
+
+    Args:
+        stream (BinaryIO): Stream to write to
+        message (dict): Message
+    """
+
+    payload = json.dumps(message).encode()
+    stream.write(HEADER.pack(len(payload)) + payload)
+    stream.flush()
+
+
+def execute_cell(namespace: dict, code: str, name: str) -> dict:
+    """
+    Execute a cell in the namespace, displaying the value of a trailing expression
+
+    Args:
+        namespace (dict): Kernel namespace
+        code (str): Cell code
+        name (str): Cell filename used in tracebacks
+
+    Returns:
+        dict: Cell stdout, stderr, success flag and resource usage
+    """
+
+    # Make the cell source available to tracebacks
+    linecache.cache[name] = (len(code), None, code.splitlines(True), name)
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    ok = True
+    memory_error = False
+    start_usage = usage(resource.getrusage(resource.RUSAGE_SELF), read_io("self"))
+    start = time.perf_counter()
+
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            tree = ast.parse(code, filename=name)
+            expression = None
+            if tree.body and isinstance(tree.body[-1], ast.Expr):
+                expression = ast.Expression(tree.body.pop().value)
+
+            exec(compile(tree, name, "exec"), namespace)
+            if expression is not None:
+                value = eval(compile(expression, name, "eval"), namespace)
+                if value is not None:
+                    print(repr(value))
+        except SystemExit as e:
+            ok = e.code is None or e.code == 0
+        except BaseException as e:
+            # Hide the kernel frames from the traceback
+            tb = e.__traceback__
+            while tb is not None and tb.tb_frame.f_code.co_filename != name:
+                tb = tb.tb_next
+            traceback.print_exception(type(e), e, tb)
+            ok = False
+            memory_error = isinstance(e, MemoryError)
+
+    elapsed = time.perf_counter() - start
+    end_usage = usage(resource.getrusage(resource.RUSAGE_SELF), read_io("self"))
+
+    return {
+        "ok": ok,
+        "memory_error": memory_error,
+        "stdout": stdout.getvalue(),
+        "stderr": stderr.getvalue(),
+        "time": elapsed,
+        # Usage of the cell, except the peak RSS of the kernel so far
+        **{key: end_usage[key] - start_usage[key] for key in end_usage},
+        "peak_rss": end_usage["peak_rss"],
+    }
+
+
+def describe_namespace(namespace: dict) -> dict:
+    """
+    Describe the user variables of the namespace and their memory usage
+
+    Args:
+        namespace (dict): Kernel namespace
+
+    Returns:
+        dict: Variables (type, shape and size in bytes) and total size in bytes
+    """
+
+    variables = {}
+    for name, value in namespace.items():
+        if name.startswith("_") or isinstance(value, type(sys)) or callable(value):
+            continue
+
+        if hasattr(value, "memory_usage") and hasattr(value, "shape"):
+            # pandas DataFrame / Series
+            size = int(value.memory_usage(deep=True).sum())
+        elif hasattr(value, "nbytes"):
+            # numpy array
+            size = int(value.nbytes)
+        else:
+            size = sys.getsizeof(value)
+
+        variables[name] = {
+            "type": type(value).__name__,
+            "shape": list(value.shape) if hasattr(value, "shape") else None,
+            "size": size,
+        }
+
+    return {
+        "variables": variables,
+        "total": sum(variable["size"] for variable in variables.values()),
+    }
+
+
+def kernel(cmd_fd: int, reply_fd: int) -> None:
+    """
+    Serve cells in a persistent namespace until the command stream closes
+
+    Args:
+        cmd_fd (int): Command stream file descriptor
+        reply_fd (int): Reply stream file descriptor
+    """
+
+    sys.path.insert(0, os.getcwd())
+    namespace = {"__name__": "__main__", "__builtins__": builtins}
+    cells = 0
+
+    with os.fdopen(cmd_fd, "rb") as commands, os.fdopen(reply_fd, "wb") as replies:
+        while (request := read_message(commands)) is not None:
+            match request["op"]:
+                case "execute":
+                    cells += 1
+                    reply = execute_cell(namespace, request["code"], f"<cell {cells}>")
+                case "namespace":
+                    reply = describe_namespace(namespace)
+                case op:
+                    reply = {"error": f"Unknown operation: {op}"}
+
+            write_message(replies, reply)
+
+
+def main() -> None:
+    """Worker entrypoint"""
+
+    # Do not let the sandbox package shadow the script imports
+    del sys.path[0]
+
+    parser = argparse.ArgumentParser(description="AgentML sandbox worker")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    serve_parser = subparsers.add_parser("serve")
+    serve_parser.add_argument("--fd", type=int, required=True)
+    serve_parser.add_argument("--max-runs", type=int, default=0)
+    serve_parser.add_argument("--warm", default="")
+
+    launch_parser = subparsers.add_parser("launch")
+    launch_parser.add_argument("--status-fd", type=int, required=True)
+    launch_parser.add_argument("--limits", default="{}")
+    launch_parser.add_argument("script")
+
+    kernel_parser = subparsers.add_parser("kernel")
+    kernel_parser.add_argument("--cmd-fd", type=int, required=True)
+    kernel_parser.add_argument("--reply-fd", type=int, required=True)
+    kernel_parser.add_argument("--warm", default="")
+    kernel_parser.add_argument("--limits", default="{}")
+
+    args = parser.parse_args()
+
+    match args.mode:
+        case "serve":
+            warm([module for module in args.warm.split(",") if module])
+            serve(fd=args.fd, max_runs=args.max_runs)
+        case "launch":
+            job = {
+                "cwd": os.getcwd(),
+                "script": args.script,
+                "limits": json.loads(args.limits),
+            }
+            launch(job, args.status_fd)
+        case "kernel":
+            # CPU time accumulates over the cells, so it is not limited
+            apply_limits({**json.loads(args.limits), "cpu_time": None})
+            warm([module for module in args.warm.split(",") if module])
+            kernel(cmd_fd=args.cmd_fd, reply_fd=args.reply_fd)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,653 @@
+"""
+agentml/scheduler.py
+
+Rate-limit-aware scheduler of the LLM requests shared by all the sessions
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import random
+import threading
+import time
+from enum import IntEnum
+from typing import Any, Callable
+
+import openai
+from openai import AsyncOpenAI
+from pydantic import BaseModel
+
+from agentml.context import count_tokens
+from config import (
+    LLM_BACKOFF_BASE,
+    LLM_BACKOFF_MAX,
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_RATE_LIMITS,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+)
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and server errors
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+# Key of the rate limits of the models without their own limits
+DEFAULT_LIMITS = "default"
+
+# Tokens reserved for the completion of requests without max_tokens
+COMPLETION_TOKENS_ESTIMATE = 1000
+
+
+class Priority(IntEnum):
+    """Priority of a request, waiting requests of a model are sent in this order"""
+
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class RateLimits(BaseModel):
+    """Rate limits of a model (None for no limit)"""
+
+    requests_per_minute: float | None = LLM_REQUESTS_PER_MINUTE
+    tokens_per_minute: float | None = LLM_TOKENS_PER_MINUTE
+
+    # Requests in flight at once
+    max_concurrency: int | None = LLM_MAX_CONCURRENCY
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at a constant rate
+
+    Reservations may overdraw the bucket: the caller waits until the refill covers them,
+    and the next callers wait behind it.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        """
+        TokenBucket constructor
+
+        Args:
+            per_minute (float): Refill rate, and capacity of the bucket
+        """
+
+        self.rate: float = per_minute / 60
+        self.capacity: float = per_minute
+        self.level: float = per_minute
+        self.updated: float = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Take tokens from the bucket
+
+        Args:
+            amount (float): Tokens
+
+        Returns:
+            float: Seconds to wait before the tokens are available
+        """
+
+        with self._lock:
+            self._refill()
+            self.level -= amount
+            return max(-self.level / self.rate, 0.0)
+
+    def adjust(self, amount: float) -> None:
+        """Give back (or take more) tokens once the actual usage is known"""
+        with self._lock:
+            self._refill()
+            self.level = min(self.level + amount, self.capacity)
+
+    def pause(self, seconds: float) -> None:
+        """Empty the bucket so that the next reservations wait at least some seconds"""
+        with self._lock:
+            self._refill()
+            self.level = min(self.level, -seconds * self.rate)
+
+    def _refill(self) -> None:
+        """Add the tokens accumulated since the last update"""
+        now = time.monotonic()
+        self.level = min(self.level + (now - self.updated) * self.rate, self.capacity)
+        self.updated = now
+
+
+class ModelQueue:
+    """
+    Requests to a model: concurrency slots handed out by priority, and rate limit buckets
+
+    Waiters are synchronous (threads) or asynchronous (event loops), so that the sync and
+    async clients of all the sessions share the same limits.
+    """
+
+    def __init__(self, limits: RateLimits) -> None:
+        """
+        ModelQueue constructor
+
+        Args:
+            limits (RateLimits): Rate limits of the model
+        """
+
+        self.limits: RateLimits = limits
+        self.requests: TokenBucket | None = (
+            TokenBucket(limits.requests_per_minute)
+            if limits.requests_per_minute
+            else None
+        )
+        self.tokens: TokenBucket | None = (
+            TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+        )
+
+        self._lock = threading.Lock()
+        self._active: int = 0
+        self._waiters: list[tuple[int, int, Any]] = []
+        self._order = itertools.count()
+
+    def acquire(self, priority: Priority) -> None:
+        """Wait for a concurrency slot"""
+        event = threading.Event()
+        if self._enqueue(priority, event):
+            event.wait()
+
+    async def aacquire(self, priority: Priority) -> None:
+        """Wait for a concurrency slot on the event loop"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        waiter = (loop, future)
+        if not self._enqueue(priority, waiter):
+            return
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                queued = [entry for entry in self._waiters if entry[2] is waiter]
+                for entry in queued:
+                    self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            # The slot was handed over before the cancellation
+            if not queued:
+                self.release()
+            raise
+
+    def release(self) -> None:
+        """Free a concurrency slot, handing it to the first waiter by priority"""
+        with self._lock:
+            if not self._waiters:
+                self._active -= 1
+                return
+            _, _, waiter = heapq.heappop(self._waiters)
+
+        if isinstance(waiter, threading.Event):
+            waiter.set()
+        else:
+            loop, future = waiter
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    def reserve(self, tokens: int) -> float:
+        """
+        Take a request and its tokens from the rate limit buckets
+
+        Args:
+            tokens (int): Estimated tokens of the request
+
+        Returns:
+            float: Seconds to wait before sending the request
+        """
+
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+
+        return wait
+
+    def pause(self, seconds: float) -> None:
+        """Hold back the next requests after the API rate limited one"""
+        if self.requests is not None:
+            self.requests.pause(seconds)
+
+    @property
+    def waiting(self) -> int:
+        """Number of requests waiting for a slot"""
+        return len(self._waiters)
+
+    def _enqueue(self, priority: Priority, waiter: Any) -> bool:
+        """Take a free slot, or queue the waiter (returns whether it has to wait)"""
+        with self._lock:
+            max_concurrency = self.limits.max_concurrency
+            if not self._waiters and (
+                max_concurrency is None or self._active < max_concurrency
+            ):
+                self._active += 1
+                return False
+
+            heapq.heappush(self._waiters, (priority, next(self._order), waiter))
+            return True
+
+
+class LlmScheduler:
+    """
+    Scheduler of the chat completion requests
+
+    Each model has concurrency slots handed out by priority and token buckets of
+    requests and tokens per minute. Rate limited and failed requests are retried with
+    jittered exponential backoff, honoring the retry-after headers of the API.
+    """
+
+    def __init__(
+        self,
+        rate_limits: dict[str, dict] = LLM_RATE_LIMITS,
+        max_retries: int = LLM_MAX_RETRIES,
+        backoff_base: float = LLM_BACKOFF_BASE,
+        backoff_max: float = LLM_BACKOFF_MAX,
+    ) -> None:
+        """
+        LlmScheduler constructor
+
+        Args:
+            rate_limits (dict[str, dict], optional): Rate limits of each model (fields of RateLimits), and of the other models under DEFAULT_LIMITS. Defaults to LLM_RATE_LIMITS.
+            max_retries (int, optional): Retries of a failed request. Defaults to LLM_MAX_RETRIES.
+            backoff_base (float, optional): Seconds before the first retry, doubled on each retry. Defaults to LLM_BACKOFF_BASE.
+            backoff_max (float, optional): Maximum seconds between retries. Defaults to LLM_BACKOFF_MAX.
+        """
+
+        self.rate_limits: dict[str, dict] = rate_limits
+        self.max_retries: int = max_retries
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+
+        self._queues: dict[str, ModelQueue] = {}
+        self._stats: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def get_queue(self, model: str) -> ModelQueue:
+        """Get the queue of a model"""
+        with self._lock:
+            if model not in self._queues:
+                limits = self.rate_limits.get(
+                    model, self.rate_limits.get(DEFAULT_LIMITS, {})
+                )
+                self._queues[model] = ModelQueue(RateLimits(**limits))
+            return self._queues[model]
+
+    @staticmethod
+    def estimate_tokens(model: str, messages: list[dict], **kwargs) -> int:
+        """
+        Estimate the tokens of a request, prompt and completion
+
+        Args:
+            model (str): Model
+            messages (list[dict]): Messages in JSON format
+            **kwargs: Other request arguments
+
+        Returns:
+            int: Estimated tokens
+        """
+
+        prompt = sum(
+            count_tokens(
+                (
+                    message["content"]
+                    if isinstance(message.get("content"), str)
+                    else json.dumps(message.get("content"))
+                ),
+                model,
+            )
+            for message in messages
+        )
+
+        return prompt + (kwargs.get("max_tokens") or COMPLETION_TOKENS_ESTIMATE)
+
+    def get_backoff(self, attempt: int, error: Exception) -> float:
+        """
+        Get the seconds to wait before retrying a request
+
+        Args:
+            attempt (int): Number of the failed attempt (from 0)
+            error (Exception): Error of the attempt
+
+        Returns:
+            float: Retry-after delay of the API if given, else jittered exponential backoff
+        """
+
+        response = getattr(error, "response", None)
+        if response is not None:
+            headers = response.headers
+            try:
+                if "retry-after-ms" in headers:
+                    return float(headers["retry-after-ms"]) / 1000
+                if "retry-after" in headers:
+                    return float(headers["retry-after"])
+            except ValueError:
+                pass
+
+        delay = min(self.backoff_base * 2**attempt, self.backoff_max)
+        return random.uniform(delay / 2, delay)
+
+    def call(
+        self, create: Callable[..., Any], priority: Priority = Priority.NORMAL, **kwargs
+    ) -> Any:
+        """
+        Send a request once the limits of its model allow it, retrying on failures
+
+        Args:
+            create (Callable[..., Any]): Chat completions create method of the OpenAI client
+            priority (Priority, optional): Priority of the request. Defaults to Priority.NORMAL.
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            Any: Chat completion, or stream holding its slot until closed
+        """
+
+        model = kwargs["model"]
+        queue = self.get_queue(model)
+        tokens = self.estimate_tokens(**kwargs)
+
+        start = time.perf_counter()
+        queue.acquire(priority)
+        holding = True
+        try:
+            wait = queue.reserve(tokens)
+            if wait:
+                time.sleep(wait)
+            queue_time = time.perf_counter() - start
+
+            for attempt in itertools.count():
+                try:
+                    response = create(**kwargs)
+                    break
+                except RETRYABLE_ERRORS as error:
+                    delay = self.on_error(queue, model, attempt, error)
+                    # Each attempt is a request against the rate limits
+                    time.sleep(max(delay, queue.reserve(tokens)))
+
+            self.on_response(queue, model, priority, tokens, queue_time, response)
+
+            if kwargs.get("stream"):
+                holding = False
+                return ScheduledStream(response, queue.release)
+
+            return response
+        finally:
+            if holding:
+                queue.release()
+
+    async def acall(
+        self, create: Callable[..., Any], priority: Priority = Priority.NORMAL, **kwargs
+    ) -> Any:
+        """
+        Send a request on the event loop once the limits of its model allow it, retrying on failures
+
+        Args:
+            create (Callable[..., Any]): Chat completions create method of the AsyncOpenAI client
+            priority (Priority, optional): Priority of the request. Defaults to Priority.NORMAL.
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            Any: Chat completion, or stream holding its slot until closed
+        """
+
+        model = kwargs["model"]
+        queue = self.get_queue(model)
+        tokens = self.estimate_tokens(**kwargs)
+
+        start = time.perf_counter()
+        await queue.aacquire(priority)
+        holding = True
+        try:
+            wait = queue.reserve(tokens)
+            if wait:
+                await asyncio.sleep(wait)
+            queue_time = time.perf_counter() - start
+
+            for attempt in itertools.count():
+                try:
+                    response = await create(**kwargs)
+                    break
+                except RETRYABLE_ERRORS as error:
+                    delay = self.on_error(queue, model, attempt, error)
+                    # Each attempt is a request against the rate limits
+                    await asyncio.sleep(max(delay, queue.reserve(tokens)))
+
+            self.on_response(queue, model, priority, tokens, queue_time, response)
+
+            if kwargs.get("stream"):
+                holding = False
+                return AsyncScheduledStream(response, queue.release)
+
+            return response
+        finally:
+            if holding:
+                queue.release()
+
+    def on_error(
+        self, queue: ModelQueue, model: str, attempt: int, error: Exception
+    ) -> float:
+        """
+        Handle a failed attempt
+
+        Args:
+            queue (ModelQueue): Queue of the model
+            model (str): Model
+            attempt (int): Number of the failed attempt (from 0)
+            error (Exception): Error of the attempt
+
+        Returns:
+            float: Seconds to wait before the next attempt
+
+        Raises:
+            Exception: The error once the retries are exhausted
+        """
+
+        rate_limited = isinstance(error, openai.RateLimitError)
+        self._count(model, rate_limited=int(rate_limited))
+        if attempt >= self.max_retries:
+            raise error
+
+        self._count(model, retries=1)
+
+        delay = self.get_backoff(attempt, error)
+
+        # The other requests to the model would be rate limited too
+        if rate_limited:
+            queue.pause(delay)
+
+        print(
+            f"LlmScheduler: {type(error).__name__} from {model}, "
+            f"retrying in {delay:.2f}s ({attempt + 1}/{self.max_retries})"
+        )
+        return delay
+
+    def on_response(
+        self,
+        queue: ModelQueue,
+        model: str,
+        priority: Priority,
+        tokens: int,
+        queue_time: float,
+        response: Any,
+    ) -> None:
+        """Correct the token estimate with the usage of the response, and report the queue wait"""
+        usage = getattr(response, "usage", None)
+        if queue.tokens is not None and usage is not None:
+            queue.tokens.adjust(tokens - usage.total_tokens)
+
+        # Streams do not report their usage, their estimate is counted instead
+        self._count(
+            model,
+            requests=1,
+            tokens=usage.total_tokens if usage is not None else tokens,
+            queue_time=queue_time,
+        )
+        with self._lock:
+            stats = self._stats[model]
+            stats["max_queue_time"] = max(stats.get("max_queue_time", 0.0), queue_time)
+
+        print(
+            f"LlmScheduler: {model} request ({priority.name.lower()} priority) "
+            f"waited {queue_time:.3f}s in queue, {queue.waiting} waiting"
+        )
+
+    def stats(self) -> dict[str, dict]:
+        """
+        Get the scheduling statistics of each model
+
+        Returns:
+            dict[str, dict]: Requests, retries, rate limited attempts, tokens used, and total and maximum queue wait
+        """
+
+        with self._lock:
+            return {model: dict(stats) for model, stats in self._stats.items()}
+
+    def _count(self, model: str, **counters: float) -> None:
+        """Increment statistics counters of a model"""
+        with self._lock:
+            stats = self._stats.setdefault(
+                model,
+                {
+                    "requests": 0,
+                    "retries": 0,
+                    "rate_limited": 0,
+                    "tokens": 0,
+                    "queue_time": 0.0,
+                    "max_queue_time": 0.0,
+                },
+            )
+            for name, value in counters.items():
+                stats[name] += value
+
+
+class ScheduledStream:
+    """Stream of a scheduled request, holding its concurrency slot until consumed or closed"""
+
+    def __init__(self, stream: Any, release: Callable[[], None]) -> None:
+        self.stream = stream
+        self._release: Callable[[], None] | None = release
+
+    def __iter__(self):
+        try:
+            yield from self.stream
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Close the stream and free its slot"""
+        self.stream.close()
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.stream, name)
+
+
+class AsyncScheduledStream(ScheduledStream):
+    """Async stream of a scheduled request, holding its concurrency slot until consumed or closed"""
+
+    async def __aiter__(self):
+        try:
+            async for chunk in self.stream:
+                yield chunk
+        finally:
+            await self.close()
+
+    async def close(self) -> None:
+        """Close the stream and free its slot"""
+        await self.stream.close()
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+
+class ScheduledCompletions:
+    """Chat completions API sending the requests through the scheduler"""
+
+    def __init__(self, completions: Any, scheduler: LlmScheduler) -> None:
+        """
+        ScheduledCompletions constructor
+
+        Args:
+            completions (Any): Chat completions API of the OpenAI client
+            scheduler (LlmScheduler): Request scheduler
+        """
+
+        self.completions = completions
+        self.scheduler: LlmScheduler = scheduler
+
+    def create(self, *, priority: Priority = Priority.NORMAL, **kwargs) -> Any:
+        """
+        Create a chat completion
+
+        Args:
+            priority (Priority, optional): Priority of the request. Defaults to Priority.NORMAL.
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            Any: Chat completion (or stream)
+        """
+
+        return self.scheduler.call(self.completions.create, priority, **kwargs)
+
+
+class AsyncScheduledCompletions(ScheduledCompletions):
+    """Async chat completions API sending the requests through the scheduler"""
+
+    async def create(self, *, priority: Priority = Priority.NORMAL, **kwargs) -> Any:
+        """
+        Create a chat completion
+
+        Args:
+            priority (Priority, optional): Priority of the request. Defaults to Priority.NORMAL.
+            **kwargs: OpenAI chat completion arguments
+
+        Returns:
+            Any: Chat completion (or stream)
+        """
+
+        return await self.scheduler.acall(self.completions.create, priority, **kwargs)
+
+
+class ScheduledChat:
+    """Chat API of a scheduled client"""
+
+    def __init__(self, completions: ScheduledCompletions) -> None:
+        self.completions: ScheduledCompletions = completions
+
+
+class ScheduledClient:
+    """
+    OpenAI client whose chat completions go through the request scheduler
+
+    Other APIs are forwarded to the wrapped client.
+    """
+
+    def __init__(self, client: Any, scheduler: LlmScheduler) -> None:
+        """
+        ScheduledClient constructor
+
+        Args:
+            client (Any): OpenAI or AsyncOpenAI client (built with max_retries=0, the scheduler retries)
+            scheduler (LlmScheduler): Request scheduler
+        """
+
+        completions = (
+            AsyncScheduledCompletions
+            if isinstance(client, AsyncOpenAI)
+            else ScheduledCompletions
+        )
+
+        self.client = client
+        self.scheduler: LlmScheduler = scheduler
+        self.chat = ScheduledChat(completions(client.chat.completions, scheduler))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
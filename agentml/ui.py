@@ -0,0 +1,34 @@
+"""
+agentml/ui.py
+
+Rendering helpers shared by the Streamlit pages
+"""
+
+from typing import Callable
+
+from .sandbox import OutputChunk
+
+# Characters of live sandbox output shown while an agent is running
+LIVE_OUTPUT_SIZE = 5000
+
+
+def render_output(placeholder) -> Callable[[OutputChunk], None]:
+    """Render the tail of the sandbox output in the placeholder as it is produced"""
+    output = [""]
+
+    def on_output(chunk: OutputChunk) -> None:
+        output[0] = (output[0] + chunk.text)[-LIVE_OUTPUT_SIZE:]
+        placeholder.code(output[0], language="text")
+
+    return on_output
+
+
+def render_tokens(placeholder) -> Callable[[str], None]:
+    """Render the model response in the placeholder as its tokens are generated"""
+    response = [""]
+
+    def on_token(token: str) -> None:
+        response[0] += token
+        placeholder.markdown(response[0])
+
+    return on_token
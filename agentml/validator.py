@@ -0,0 +1,153 @@
+"""
+agentml/validator.py
+
+Rule-based validation of the agent runs, deciding the unambiguous cases without an LLM
+"""
+
+import re
+import threading
+
+from agentml.agents import Agent, Planner
+from agentml.context import is_failed
+from agentml.models import LlmMessage
+
+TRACEBACK = "Traceback (most recent call last):"
+
+# Agents a plan can assign steps to
+PLAN_TOOLS = {"Coder", "Planner", "Vision"}
+
+# Objectives asking for files, which are expected in the sandbox output files
+ARTIFACT_OBJECTIVE = re.compile(
+    r"\b(save|export|write|plot|chart|graph|figure|visuali[sz]e|\w+\.(png|jpe?g|csv|json|pkl|joblib))\b",
+    re.IGNORECASE,
+)
+
+# Warnings printed on stderr, with the source line echoed under them
+WARNING_LINE = re.compile(r"^\S.*\b\w*Warning\b|^\s")
+
+
+class Validator:
+    """
+    Pre-classifier of the decisions of the manual manager
+
+    Runs that failed in the sandbox are retried, and runs that completed cleanly are
+    validated, without asking an LLM, as are the plans of known tools. The gray zone
+    (errors printed by code that exited normally, missing output files, empty plans,
+    image analysis) is left to the LLM. Decisions made locally are counted to measure
+    the LLM calls avoided.
+    """
+
+    def __init__(self) -> None:
+        """Validator constructor"""
+        self._lock = threading.Lock()
+        self.counters: dict[str, int] = {
+            "next_local": 0,
+            "next_llm": 0,
+            "done_local": 0,
+            "done_llm": 0,
+        }
+
+    def next(self, message: LlmMessage, agent: Agent | None = None) -> str | None:
+        """
+        Decide whether to retry or validate a run
+
+        Args:
+            message (LlmMessage): Last message of the run
+            agent (Agent | None, optional): Agent of the run. Defaults to None.
+
+        Returns:
+            str | None: "retry" or "validate", or None if the LLM has to decide
+        """
+
+        decision = self.classify_run(message, agent)
+        self._count("next", decision is not None)
+
+        return decision
+
+    def done(self, message: LlmMessage) -> bool | None:
+        """
+        Decide whether the goal is complete after the last run
+
+        Args:
+            message (LlmMessage): Last message of the run
+
+        Returns:
+            bool | None: False if the last run failed, or None if the LLM has to decide
+        """
+
+        decision = False if self.classify_run(message) == "retry" else None
+        self._count("done", decision is not None)
+
+        return decision
+
+    @staticmethod
+    def classify_run(message: LlmMessage, agent: Agent | None = None) -> str | None:
+        """
+        Classify a run from the execution profile and output of its last message
+
+        Args:
+            message (LlmMessage): Last message of the run
+            agent (Agent | None, optional): Agent of the run. Defaults to None.
+
+        Returns:
+            str | None: "retry" or "validate", or None if the case is ambiguous
+        """
+
+        metadata = message.metadata or {}
+
+        # Plans of known tools are valid, an empty plan may mean there is nothing left to do
+        if isinstance(agent, Planner):
+            if not agent.plan:
+                return None
+            valid = all(
+                task.get("tool") in PLAN_TOOLS and task.get("objective")
+                for task in agent.plan
+            )
+            return "validate" if valid else "retry"
+
+        # Runs without an execution (image analysis): only a traceback is unambiguous
+        if metadata.get("execution") is None:
+            return "retry" if TRACEBACK in message.content else None
+
+        # Killed by the sandbox (timeout, memory...) or exited with an error
+        if is_failed(message):
+            return "retry"
+
+        # Errors printed by code that exited normally (caught exceptions, logging)
+        stderr = metadata.get("stderr", "")
+        if not all(WARNING_LINE.match(line) for line in stderr.splitlines() if line):
+            return None
+
+        # Files asked for by the objective but not written
+        if (
+            agent is not None
+            and ARTIFACT_OBJECTIVE.search(agent.objective)
+            and not metadata.get("files")
+        ):
+            return None
+
+        return "validate"
+
+    def stats(self) -> dict:
+        """
+        Get the validation statistics
+
+        Returns:
+            dict: Decisions made locally and by the LLM, and the LLM calls avoided
+        """
+
+        with self._lock:
+            counters = dict(self.counters)
+
+        local = counters["next_local"] + counters["done_local"]
+        total = local + counters["next_llm"] + counters["done_llm"]
+        return {
+            **counters,
+            "avoided_calls": local,
+            "avoided_rate": local / total if total else 0.0,
+        }
+
+    def _count(self, decision: str, local: bool) -> None:
+        """Count a decision made locally or by the LLM"""
+        with self._lock:
+            self.counters[f"{decision}_{'local' if local else 'llm'}"] += 1
@@ -11,6 +11,8 @@ import streamlit as st
 
 from agentml.agents import Agent, Coder, Vision
 from agentml.manual import Manager
+from agentml.models import LlmMessage
+from agentml.ui import render_output, render_tokens
 
 
 def can_retry(mngr: Manager) -> bool:
@@ -113,21 +115,39 @@ with left_column:
 
         if run_agent_btn:
             with st.spinner("Running Agent..."):
-                st.session_state["messages"] = manager.run()
+                live_response = st.empty()
+                live_output = st.empty()
+                st.session_state["messages"] = manager.run(
+                    on_output=render_output(live_output),
+                    on_token=render_tokens(live_response),
+                )
+                live_response.empty()
+                live_output.empty()
 
         st.subheader("Messages")
         for index, msg in enumerate(st.session_state.get("messages", [])):
             st.chat_message(msg.role.value).write(msg.content)
 
+        # Images created or modified by the last run
+        last_agent = manager.last_run_agent
+        if isinstance(last_agent, Coder) and last_agent.sandbox.last_result:
+            for image in last_agent.sandbox.get_images(
+                changes=last_agent.sandbox.last_result.changes
+            ):
+                if image.exists():
+                    st.image(str(image), caption=image.name)
+
         with st.expander("Update Messages", expanded=False):
             for index, msg in enumerate(st.session_state.get("messages", [])):
                 key = f"msg_{index}"
                 updated_message = st.text_input(
                     f"Update {msg.role.value} message:", value=msg.content, key=key
                 )
-                st.session_state["messages"][
-                    index
-                ].content = updated_message  # Update the message content
+                # Messages are immutable, replace the edited ones
+                if updated_message != msg.content:
+                    st.session_state["messages"][index] = LlmMessage(
+                        role=msg.role, content=updated_message, metadata=msg.metadata
+                    )
 
         retry_btn_col, validate_btn_col = st.columns(2)
 
@@ -154,7 +174,10 @@ with left_column:
             )
             if retry_btn:
                 with st.spinner("Retrying..."):
-                    st.session_state["messages"] = manager.retry_last_agent()
+                    st.session_state["messages"] = manager.retry_last_agent(
+                        on_output=render_output(st.empty()),
+                        on_token=render_tokens(st.empty()),
+                    )
                     st.success("Retry completed.")
                     st.rerun()
 
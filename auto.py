@@ -11,6 +11,7 @@ import streamlit as st
 
 from agentml.manual import Manager
 from agentml.models import LlmRole
+from agentml.ui import render_output, render_tokens
 
 # Streamlit layout for the automated page
 st.set_page_config(layout="wide", page_icon="🤖")
@@ -48,28 +49,38 @@ if "manager" in st.session_state:
         task_info = f"{', '.join(f'`{agent.__name__}`: {objective}' for agent, objective in current_task.items())}"
 
         with st.spinner(task_info):
-            # Automatically run the next agent
-            output = manager.run()
+            # Automatically run the next agent, showing the response and the sandbox output live
+            live_response = st.empty()
+            live_output = st.empty()
+            output = manager.run(
+                on_output=render_output(live_output),
+                on_token=render_tokens(live_response),
+            )
 
             # Automatically decide to retry or validate based on the output
             last_output = output[-1]
-            last_content = (
-                last_output.content if last_output.role == LlmRole.ASSISTANT else ""
-            )
-            decision = manager.next(last_content)
+            if last_output.role != LlmRole.ASSISTANT:
+                last_output = ""
+            decision = manager.next(last_output)
             if decision == "retry":
                 with st.spinner("Retrying the last agent..."):
-                    manager.retry_last_agent()
+                    manager.retry_last_agent(
+                        on_output=render_output(live_output),
+                        on_token=render_tokens(live_response),
+                    )
             elif decision == "validate":
                 manager.validate_run(output)
 
+            live_response.empty()
+            live_output.empty()
+
         # Display the output for the current task in chat format
         for msg in output:
             st.chat_message(msg.role.value).write(msg.content)
 
         # Check and break the loop if no more tasks are available
         if not manager.tasks:
-            done = manager.done(last_content)
+            done = manager.done(last_output)
             if done:
                 st.success("All tasks completed.")
                 break
@@ -79,6 +90,12 @@ if "manager" in st.session_state:
                 {"Planner": "Continue to generate the next steps to achieve the goal"}
             ]
 
+    stats = manager.validator.stats()
+    st.caption(
+        f"LLM validation calls avoided: {stats['avoided_calls']}"
+        f" ({stats['avoided_rate']:.0%} of the decisions)"
+    )
+
     st.subheader("Tasks")
     for task in manager.tasks:
         for agent, objective in task.items():
@@ -0,0 +1,45 @@
+"""
+batch.py
+
+Run the (goal, dataset) jobs of a JSONL manifest, resuming the previous run
+
+Usage:
+    python batch.py jobs.jsonl [--workers 4] [--output-dir logs/batch/jobs] [--retry-failed]
+
+Manifest lines:
+    {"id": "iris", "goal": "Build a classifier", "csv": "data/data.csv", "timeout": 1800}
+"""
+
+import argparse
+from pathlib import Path
+
+from agentml.batch import BatchRunner
+from config import BATCH_WORKERS
+
+
+def main() -> None:
+    """Main function"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("manifest", type=Path)
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--output-dir", type=Path, default=None)
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help="run the jobs that did not complete in the previous runs again",
+    )
+    args = parser.parse_args()
+
+    runner = BatchRunner(
+        manifest=args.manifest,
+        output_dir=args.output_dir,
+        workers=args.workers,
+        retry_failed=args.retry_failed,
+    )
+    runner.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,506 @@
+"""
+benchmarks/e2e.py
+
+Offline end-to-end benchmark of the managers against the fake OpenAI API
+
+The fake API answers with a scripted plan (Coder steps describing, modeling and plotting
+the dataset, then a Vision analysis of the plot), so whole sessions run without an API
+key. Each case (manager and dataset size) runs in its own interpreter, to measure its
+peak memory, and reports the time of each phase of the sessions and their throughput.
+
+Usage:
+    python -m benchmarks.e2e [--sizes 150,10000,100000] [--sessions 2] [--latency 0.2]
+    python -m benchmarks.e2e --save-baseline baseline.json   # before a change
+    python -m benchmarks.e2e --baseline baseline.json        # after it, on the same machine
+
+Timings depend on the machine, so baselines are not committed: save one before a change
+and compare against it on the same machine. With --baseline, exits with a non-zero status
+when a case is slower than the baseline (past the tolerance).
+"""
+
+import argparse
+import functools
+import inspect
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from uuid import uuid4
+
+from benchmarks.fake_openai import FakeOpenAI
+
+MODES = ["auto", "manual"]
+
+# Phases timed in the sessions, by the methods spending them (timed once when nested)
+PHASES = {
+    "llm_wait": [
+        ("agentml.agents.base:Agent", "get_completion"),
+        ("agentml.agents.coder:Coder", "get_streamed_code"),
+        ("openai.resources.chat.completions:Completions", "create"),
+    ],
+    "sandbox_startup": [
+        ("agentml.sandbox.sandbox:Sandbox", "create"),
+        ("agentml.sandbox.sandbox:Sandbox", "fork"),
+    ],
+    "code_exec": [
+        ("agentml.sandbox.sandbox:Sandbox", "execute"),
+        ("agentml.sandbox.sandbox:Sandbox", "execute_cell"),
+    ],
+    "image_encoding": [
+        ("agentml.sandbox.sandbox:Sandbox", "get_images_encoded"),
+    ],
+    "formatting": [
+        ("agentml.agents.coder:Coder", "get_pretty_output"),
+    ],
+}
+
+# Scripted plan, with the code of the Coder steps
+PLAN = [
+    {
+        "id": 1,
+        "depends_on": [],
+        "tool": "Coder",
+        "objective": "Load the dataset and describe its features",
+    },
+    {
+        "id": 2,
+        "depends_on": [],
+        "tool": "Coder",
+        "objective": "Train a classifier of the species and report its metrics",
+    },
+    {
+        "id": 3,
+        "depends_on": [1],
+        "tool": "Coder",
+        "objective": "Plot the distributions of the features to output/features.png",
+    },
+    {
+        "id": 4,
+        "depends_on": [3],
+        "tool": "Vision",
+        "objective": "Analyze the distributions of the features",
+    },
+]
+
+# Code of the Coder steps, after the imports and loading of the dataset
+HEADER = """
+import matplotlib.pyplot as plt
+import pandas as pd
+from agentml_data import read_csv
+
+df = read_csv("./data.csv")
+"""
+
+CODE = {
+    PLAN[0]["objective"]: """
+print(df.describe())
+""",
+    PLAN[1]["objective"]: """
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import classification_report
+from sklearn.model_selection import train_test_split
+
+X_train, X_test, y_train, y_test = train_test_split(
+    df[["SL", "SW", "PL", "PW"]], df["SP"], test_size=0.2, random_state=0
+)
+model = LogisticRegression(max_iter=200).fit(X_train, y_train)
+print(classification_report(y_test, model.predict(X_test)))
+""",
+    PLAN[2]["objective"]: """
+df[["SL", "SW", "PL", "PW"]].hist(bins=30, figsize=(8, 6))
+plt.tight_layout()
+plt.savefig("output/features.png")
+print("Saved output/features.png")
+""",
+}
+
+ANALYSIS = "The petal features separate the species, the sepal features overlap."
+
+# Mean and standard deviation of the features of each species (iris-like)
+SPECIES = {
+    "A": [(5.0, 0.35), (3.4, 0.38), (1.5, 0.17), (0.2, 0.1)],
+    "B": [(5.9, 0.52), (2.8, 0.31), (4.3, 0.47), (1.3, 0.2)],
+    "C": [(6.6, 0.64), (3.0, 0.32), (5.6, 0.55), (2.0, 0.27)],
+}
+
+
+def respond(request: dict) -> str:
+    """
+    Scripted response to a chat completion request of the agents
+
+    Args:
+        request (dict): Chat completion request
+
+    Returns:
+        str: Content of the response
+    """
+
+    messages = request["messages"]
+    system = messages[0]["content"] if messages else ""
+
+    if "vision" in request["model"]:
+        return ANALYSIS
+
+    # Planner: the plan, then nothing left to do
+    if request.get("response_format", {}).get("type") == "json_object":
+        planned = any(
+            "Here is the plan" in str(message["content"]) for message in messages
+        )
+        return json.dumps({"tool_calls": [] if planned else PLAN})
+
+    # Formatter: the output as is
+    if system.startswith("You are a raw text to pretty markdown converter"):
+        return f"```markdown\n{messages[-1]['content']}\n```"
+
+    # Validator of the manual manager
+    if "decide if the agent has completed the task" in system:
+        return "true"
+    if "decide if the output is valid or invalid" in system:
+        return "validate"
+
+    # Coder: the code of the latest objective of the request
+    for message in reversed(messages):
+        code = CODE.get(message["content"])
+        if code is not None:
+            return f"```python\n{HEADER.strip()}\n{code}```\n\nThis code runs the step."
+
+    return f"```python\n{HEADER.strip()}\nprint(df.shape)\n```"
+
+
+def write_dataset(path: Path, rows: int, seed: int) -> None:
+    """Write an iris-like dataset with the columns of data/data.csv"""
+    rng = random.Random(seed)
+    species = list(SPECIES)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as f:
+        f.write("id,SL,SW,PL,PW,SP\n")
+        for index in range(1, rows + 1):
+            label = species[index % len(species)]
+            values = ",".join(
+                f"{max(rng.gauss(mean, std), 0.1):.1f}" for mean, std in SPECIES[label]
+            )
+            f.write(f"{index},{values},{label}\n")
+
+
+class PhaseTimer:
+    """Time spent in the phases of the sessions, by patching the methods spending it"""
+
+    def __init__(self) -> None:
+        self.times: dict[str, float] = {phase: 0.0 for phase in PHASES}
+        self.calls: dict[str, int] = {phase: 0 for phase in PHASES}
+        self.intervals: list[tuple[float, float]] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, phase: str, method):
+        """Time a method, unless it is called by a method already timed"""
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            if getattr(self._local, "active", False):
+                return method(*args, **kwargs)
+
+            self._local.active = True
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._local.active = False
+                with self._lock:
+                    self.times[phase] += elapsed
+                    self.calls[phase] += 1
+                    self.intervals.append((start, start + elapsed))
+
+        return timed
+
+    def covered(self) -> float:
+        """Seconds during which at least one phase was running"""
+        total, end = 0.0, float("-inf")
+        for interval_start, interval_end in sorted(self.intervals):
+            if interval_end > end:
+                total += interval_end - max(interval_start, end)
+                end = interval_end
+        return total
+
+    @contextmanager
+    def patch(self):
+        """Patch the methods of the phases for the duration of the context"""
+        import importlib
+
+        patched = []
+        for phase, methods in PHASES.items():
+            for target, name in methods:
+                module, cls_name = target.split(":")
+                cls = getattr(importlib.import_module(module), cls_name)
+                original = inspect.getattr_static(cls, name)
+                if isinstance(original, (classmethod, staticmethod)):
+                    replacement = type(original)(self.wrap(phase, original.__func__))
+                else:
+                    replacement = self.wrap(phase, original)
+                setattr(cls, name, replacement)
+                patched.append((cls, name, original))
+        try:
+            yield self
+        finally:
+            for cls, name, original in reversed(patched):
+                setattr(cls, name, original)
+
+
+def run_auto(csv: Path) -> None:
+    """Run a session of the autonomous manager"""
+    from agentml import Manager
+
+    manager = Manager(goal="Build a classifier of the species", csv=csv)
+    try:
+        manager.run()
+    finally:
+        manager.sandbox.delete()
+        cleanup_history(manager.session_id)
+
+
+def run_manual(csv: Path, max_runs: int = 20) -> None:
+    """Run a session of the manual manager, deciding like the autonomous page"""
+    from agentml.manual import Manager
+    from agentml.models import LlmRole
+
+    manager = Manager(
+        goal="Build a classifier of the species", csv=csv, session_id=uuid4()
+    )
+    try:
+        for _ in range(max_runs):
+            output = manager.run()
+            last_output = output[-1] if output else ""
+            if last_output and last_output.role != LlmRole.ASSISTANT:
+                last_output = ""
+
+            decision = manager.next(last_output)
+            if decision == "retry":
+                manager.retry_last_agent()
+            elif decision == "validate":
+                manager.validate_run(output)
+
+            if not manager.tasks and manager.done(last_output):
+                break
+    finally:
+        manager.sandbox.delete()
+        cleanup_history(manager.session_id)
+
+
+def cleanup_history(session_id) -> None:
+    """Delete the history log of a session"""
+    from agentml.context import get_history_path
+
+    get_history_path(session_id).unlink(missing_ok=True)
+
+
+def run_case(mode: str, rows: int, sessions: int) -> dict:
+    """
+    Run the sessions of a case, in the interpreter of the case
+
+    Args:
+        mode (str): Manager ("auto" or "manual")
+        rows (int): Rows of the datasets
+        sessions (int): Number of sessions
+
+    Returns:
+        dict: Phase times per session, throughput and peak memory of the case
+    """
+
+    from agentml.sandbox import Sandbox
+
+    run = {"auto": run_auto, "manual": run_manual}[mode]
+    timer = PhaseTimer()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Sandboxes outside of the project, the datasets differ so executions are not cached
+        Sandbox.sandbox_base = Path(tmp).joinpath("sandbox")
+        datasets = [Path(tmp, str(index), "data.csv") for index in range(sessions)]
+        for index, path in enumerate(datasets):
+            write_dataset(path, rows, seed=index)
+
+        durations = []
+        start = time.perf_counter()
+        with timer.patch():
+            for csv in datasets:
+                session_start = time.perf_counter()
+                run(csv)
+                durations.append(time.perf_counter() - session_start)
+        elapsed = time.perf_counter() - start
+
+        pool = Sandbox.get_pool()
+        if pool is not None:
+            pool.close()
+
+    phases = {phase: timer.times[phase] / sessions for phase in PHASES}
+    session = statistics.fmean(durations)
+    return {
+        "mode": mode,
+        "rows": rows,
+        "sessions": sessions,
+        "session": session,
+        "session_min": min(durations),
+        "phases": phases,
+        "calls": {phase: timer.calls[phase] / sessions for phase in PHASES},
+        "orchestration": session - timer.covered() / sessions,
+        "sessions_per_minute": sessions / elapsed * 60,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "sandbox_peak_rss": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        * 1024,
+    }
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """
+    Compare the results to the baseline
+
+    Args:
+        results (list[dict]): Results of the cases
+        baseline (dict): Baseline results by case
+        tolerance (float): Slowdown allowed (0.25 for 25%)
+
+    Returns:
+        list[str]: Regressions
+    """
+
+    regressions = []
+    for result in results:
+        case = f"{result['mode']}:{result['rows']}"
+        base = baseline["cases"].get(case)
+        if base is None:
+            continue
+
+        checks = {"session": (result["session"], base["session"])}
+        for phase, value in result["phases"].items():
+            checks[phase] = (value, base["phases"].get(phase, 0.0))
+        checks["orchestration"] = (result["orchestration"], base["orchestration"])
+
+        for name, (value, reference) in checks.items():
+            # Phases of a few milliseconds are noise
+            if value > reference * (1 + tolerance) and value - reference > 0.05:
+                regressions.append(
+                    f"{case} {name}: {value:.3f}s vs {reference:.3f}s baseline"
+                )
+
+    return regressions
+
+
+def print_results(results: list[dict]) -> None:
+    """Print the phase times of the cases"""
+    header = (
+        f"{'case':<14} {'session':>8} "
+        + " ".join(f"{phase:>15}" for phase in PHASES)
+        + f" {'orchestration':>13} {'sess/min':>8} {'rss':>7} {'sandbox':>7}"
+    )
+    print(f"\n{header}\n{'-' * len(header)}")
+    for result in results:
+        print(
+            f"{result['mode'] + ':' + str(result['rows']):<14} "
+            f"{result['session']:>7.2f}s "
+            + " ".join(f"{result['phases'][phase] * 1000:>13.1f}ms" for phase in PHASES)
+            + f" {result['orchestration'] * 1000:>11.1f}ms"
+            f" {result['sessions_per_minute']:>8.1f}"
+            f" {result['peak_rss'] / 1024**2:>5.0f}MB"
+            f" {result['sandbox_peak_rss'] / 1024**2:>5.0f}MB"
+        )
+    print(
+        "\nTimes are per session. Phases of concurrent plan steps overlap, "
+        "orchestration is the session time outside of all the phases."
+    )
+
+
+def main() -> None:
+    """Run the cases against the fake API, and compare them to a baseline if given"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="150,10000,100000", help="dataset rows")
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--sessions", type=int, default=2, help="sessions per case")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per call")
+    parser.add_argument("--baseline", type=Path, help="JSON results to compare to")
+    parser.add_argument("--save-baseline", type=Path, help="JSON results file")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    parser.add_argument("--case", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Case run in its own interpreter by the parent benchmark
+    if args.case:
+        mode, rows = args.case.split(":")
+        print(json.dumps(run_case(mode, int(rows), args.sessions)))
+        return
+
+    results = []
+    with FakeOpenAI(latency=args.latency, responder=respond) as fake:
+        env = {**os.environ, "OPENAI_BASE_URL": fake.base_url, "OPENAI_API_KEY": "fake"}
+        for mode in args.modes.split(","):
+            for rows in args.sizes.split(","):
+                print(f"Running {mode}:{rows} ({args.sessions} sessions)")
+                process = subprocess.run(
+                    [
+                        sys.executable,
+                        "-m",
+                        "benchmarks.e2e",
+                        "--case",
+                        f"{mode}:{rows}",
+                        "--sessions",
+                        str(args.sessions),
+                    ],
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                )
+                if process.returncode != 0:
+                    print(process.stdout[-2000:], process.stderr[-2000:])
+                    sys.exit(f"Case {mode}:{rows} failed")
+                results.append(
+                    json.loads(
+                        [line for line in process.stdout.splitlines() if line][-1]
+                    )
+                )
+
+    print_results(results)
+
+    if args.save_baseline is not None:
+        with open(args.save_baseline, "w") as f:
+            json.dump(
+                {
+                    "latency": args.latency,
+                    "cases": {
+                        f"{result['mode']}:{result['rows']}": result
+                        for result in results
+                    },
+                },
+                f,
+                indent=2,
+            )
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    if args.baseline is None:
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["latency"] != args.latency:
+        print(f"\nBaseline measured with {baseline['latency']}s latency, not compared")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}")
+    if regressions:
+        sys.exit(1)
+    print(f"\nNo regression against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
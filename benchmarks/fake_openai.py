@@ -0,0 +1,260 @@
+"""
+benchmarks/fake_openai.py
+
+Local fake of the OpenAI chat completions API, with simulated latency and rate limits
+
+Usage:
+    python -m benchmarks.fake_openai [--port 8000] [--requests-per-second 5] [--latency 0.2]
+
+Point the clients at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+
+class FakeOpenAI:
+    """
+    Fake chat completions server
+
+    Requests over the rate limit get a 429 with a retry-after header, like the API.
+    Responses are generated by a responder from the request (echo of the last message
+    by default), and streamed as server-sent events when the request asks for a stream.
+    """
+
+    def __init__(
+        self,
+        port: int = 0,
+        latency: float = 0.0,
+        requests_per_second: float | None = None,
+        retry_after: float = 1.0,
+        responder: Callable[[dict], str] | None = None,
+    ) -> None:
+        """
+        FakeOpenAI constructor
+
+        Args:
+            port (int, optional): Port to listen on (0 for a free port). Defaults to 0.
+            latency (float, optional): Seconds taken to answer each request. Defaults to 0.0.
+            requests_per_second (float | None, optional): Requests accepted per second (None for no limit). Defaults to None.
+            retry_after (float, optional): Seconds of the retry-after header of the 429 responses. Defaults to 1.0.
+            responder (Callable[[dict], str] | None, optional): Content of the response to a request. Defaults to an echo.
+        """
+
+        self.latency: float = latency
+        self.requests_per_second: float | None = requests_per_second
+        self.retry_after: float = retry_after
+        self.responder: Callable[[dict], str] = responder or self.echo
+
+        self.requests: int = 0
+        self.rate_limited: int = 0
+        self._accepted: deque[float] = deque()
+        self._lock = threading.Lock()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.get_handler())
+        self.server.daemon_threads = True
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        """Base URL of the API for the OpenAI clients"""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @staticmethod
+    def echo(request: dict) -> str:
+        """Answer with the content of the last message"""
+        content = request["messages"][-1]["content"]
+        return content if isinstance(content, str) else json.dumps(content)
+
+    def start(self) -> "FakeOpenAI":
+        """Serve in a background thread"""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving"""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FakeOpenAI":
+        return self.start()
+
+    def __exit__(self, *args) -> None:
+        self.stop()
+
+    def admit(self) -> bool:
+        """Count a request, and check if it is within the rate limit of the last second"""
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            if self.requests_per_second is None:
+                return True
+
+            while self._accepted and self._accepted[0] <= now - 1:
+                self._accepted.popleft()
+            if len(self._accepted) >= self.requests_per_second:
+                self.rate_limited += 1
+                return False
+
+            self._accepted.append(now)
+            return True
+
+    def get_handler(self) -> type[BaseHTTPRequestHandler]:
+        """Get the request handler class of the server"""
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Chat completions request handler"""
+
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                if not self.path.endswith("/chat/completions"):
+                    self.send_json(404, {"error": {"message": "Not found"}})
+                    return
+
+                request = json.loads(
+                    self.rfile.read(int(self.headers["Content-Length"]))
+                )
+
+                if not fake.admit():
+                    self.send_json(
+                        429,
+                        {
+                            "error": {
+                                "message": "Rate limit reached",
+                                "type": "requests",
+                                "code": "rate_limit_exceeded",
+                            }
+                        },
+                        {"retry-after": f"{fake.retry_after:g}"},
+                    )
+                    return
+
+                time.sleep(fake.latency)
+                content = fake.responder(request)
+
+                if request.get("stream"):
+                    self.send_stream(request["model"], content)
+                else:
+                    self.send_json(200, completion(request["model"], content))
+
+            def send_json(
+                self, status: int, body: dict, headers: dict | None = None
+            ) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def send_stream(self, model: str, content: str) -> None:
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+
+                chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+                tokens = [content[i : i + 8] for i in range(0, len(content), 8)]
+                try:
+                    for token in [*tokens, None]:
+                        chunk = {
+                            "id": chunk_id,
+                            "object": "chat.completion.chunk",
+                            "created": int(time.time()),
+                            "model": model,
+                            "choices": [
+                                {
+                                    "index": 0,
+                                    "delta": (
+                                        {"content": token} if token is not None else {}
+                                    ),
+                                    "finish_reason": (
+                                        None if token is not None else "stop"
+                                    ),
+                                }
+                            ],
+                        }
+                        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                        self.wfile.flush()
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client closed the stream early
+                    pass
+                self.close_connection = True
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        return Handler
+
+
+def completion(model: str, content: str) -> dict:
+    """
+    Build a chat completion response
+
+    Args:
+        model (str): Model
+        content (str): Content of the message
+
+    Returns:
+        dict: Chat completion in JSON format
+    """
+
+    tokens = len(content) // 4 + 1
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 0,
+            "completion_tokens": tokens,
+            "total_tokens": tokens,
+        },
+    }
+
+
+def main() -> None:
+    """Serve the fake API until interrupted"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--requests-per-second", type=float, default=None)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(
+        port=args.port,
+        latency=args.latency,
+        requests_per_second=args.requests_per_second,
+        retry_after=args.retry_after,
+    )
+    print(f"FakeOpenAI: Serving on {fake.base_url}")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
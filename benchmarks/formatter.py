@@ -0,0 +1,49 @@
+"""
+benchmarks/formatter.py
+
+Coverage and speed of the local output formatter on a corpus of sandbox outputs
+
+Usage:
+    python -m benchmarks.formatter [--corpus benchmarks/formatter] [--repeat 100] [--show]
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from agentml.formatter import format_output
+
+CORPUS_DIR = Path(__file__).parent.joinpath("formatter")
+
+
+def main() -> None:
+    """Format every output of the corpus and report the ones left to the LLM"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--show", action="store_true", help="print the markdown")
+    args = parser.parse_args()
+
+    files = sorted(args.corpus.glob("*.txt"))
+    local = 0
+    for file in files:
+        output = file.read_text()
+
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            markdown = format_output(output)
+        elapsed = (time.perf_counter() - start) / args.repeat
+
+        local += markdown is not None
+        print(
+            f"{file.stem:<24} {'local' if markdown is not None else 'llm':<6} "
+            f"{elapsed * 1e6:>8.1f} us  {len(output):>6} chars"
+        )
+        if args.show and markdown is not None:
+            print(markdown, end="\n\n")
+
+    print(f"\nFormatted {local}/{len(files)} outputs locally")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+benchmarks/import_time.py
+
+Import time of the agentml package, checked against a budget
+
+Importing the package must not load the heavy dependencies (OpenAI client, pydantic,
+pandas...), read the environment or write to the filesystem: these happen on first use.
+
+Usage:
+    python -m benchmarks.import_time [--runs 7] [--budget 0.3]
+
+Exits with a non-zero status on a regression.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+from config import PROJECT_PATH
+
+# Median seconds of `python -c "import agentml"`, interpreter startup included
+BUDGET = 0.3
+
+# Modules that must not be imported by `import agentml`
+DEFERRED_MODULES = ["dotenv", "openai", "pandas", "pydantic", "agentml.manager"]
+
+# Records the directories created by the import, whether or not they already exist
+PROBE = f"""
+import json, os, sys, time
+created = []
+mkdir = os.mkdir
+def record_mkdir(path, *args, **kwargs):
+    created.append(os.fspath(path))
+    return mkdir(path, *args, **kwargs)
+os.mkdir = record_mkdir
+start = time.perf_counter()
+import agentml
+elapsed = time.perf_counter() - start
+print(json.dumps({{
+    "elapsed": elapsed,
+    "loaded": [name for name in {DEFERRED_MODULES!r} if name in sys.modules],
+    "created": created,
+}}))
+"""
+
+
+def measure(runs: int) -> tuple[list[float], list[float], set[str], set[str]]:
+    """
+    Import the package in fresh interpreters
+
+    Args:
+        runs (int): Number of interpreters
+
+    Returns:
+        tuple[list[float], list[float], set[str], set[str]]: Import times, interpreter times
+            (startup included), deferred modules loaded and directories created by the import
+    """
+
+    import_times, process_times, loaded, created = [], [], set(), set()
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", PROBE],
+            cwd=PROJECT_PATH,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        process_times.append(time.perf_counter() - start)
+
+        probe = json.loads(result.stdout.splitlines()[-1])
+        import_times.append(probe["elapsed"])
+        loaded.update(probe["loaded"])
+        created.update(probe["created"])
+
+    return import_times, process_times, loaded, created
+
+
+def main() -> None:
+    """Measure the import time and fail if it is over budget or has side effects"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=7)
+    parser.add_argument("--budget", type=float, default=BUDGET, help="seconds")
+    args = parser.parse_args()
+
+    import_times, process_times, loaded, created = measure(args.runs)
+    median = statistics.median(process_times)
+    print(
+        f'python -c "import agentml": median {median * 1000:.1f}ms, '
+        f"min {min(process_times) * 1000:.1f}ms, max {max(process_times) * 1000:.1f}ms "
+        f"(import: median {statistics.median(import_times) * 1000:.1f}ms)"
+    )
+
+    errors = []
+    if median > args.budget:
+        errors.append(f"median time over the {args.budget * 1000:.0f}ms budget")
+    if loaded:
+        errors.append(f"deferred modules imported eagerly: {', '.join(sorted(loaded))}")
+    for path in sorted(created):
+        errors.append(f"import created {path}")
+
+    for error in errors:
+        print(f"FAIL: {error}")
+    if errors:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
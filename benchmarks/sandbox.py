@@ -0,0 +1,356 @@
+"""
+benchmarks/sandbox.py
+
+Microbenchmarks of the sandbox, checked against regression thresholds
+
+Benchmarks:
+    create/<size>         Sandbox.create with a new dataset of the size (stored, linked, columnar cache)
+    create_warm/<size>    Sandbox.create with a dataset already in the store
+    execute/empty         Sandbox.execute of an empty script
+    execute/imports       Sandbox.execute of a script importing the data science stack (warm in the pool)
+    execute/stdout        Sandbox.execute of a script printing 50MB
+    files/unchanged       Sandbox.execute with thousands of unchanged files in the sandbox
+    files/created         Sandbox.execute of a script creating thousands of output files
+    images/encode         Sandbox.get_images_encoded with many large JPEGs
+
+Usage:
+    python -m benchmarks.sandbox [--sizes 1MB,100MB,1GB] [--repeat 3] [--output results.json]
+    python -m benchmarks.sandbox --sizes 1MB,5GB --only create
+    python -m benchmarks.sandbox --thresholds thresholds.json   # {"execute/empty": 0.5, ...}
+
+The results are printed as JSON (the sandbox logs go to stderr). Exits with a non-zero
+status when the median time of a benchmark is over its threshold.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+from uuid import uuid4
+
+from agentml.sandbox import Sandbox
+
+# Median seconds allowed for each benchmark (create/<size> gets create plus create_per_gb
+# for each GB, create_warm/<size> gets create_warm, unless the size has its own threshold)
+THRESHOLDS = {
+    "create": 5.0,
+    "create_per_gb": 60.0,
+    "create_warm": 1.0,
+    "execute/empty": 1.0,
+    "execute/imports": 3.0,
+    "execute/stdout": 5.0,
+    "files/unchanged": 1.0,
+    "files/created": 5.0,
+    "images/encode": 2.0,
+}
+
+FILES = 5_000
+IMAGES = 50
+IMAGE_SIZE = 2 * 1024**2
+
+SCRIPTS = {
+    "execute/empty": "",
+    "execute/imports": """
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.model_selection import train_test_split
+""",
+    "execute/stdout": """
+import sys
+line = "x" * 99 + "\\n"
+for _ in range(500):
+    sys.stdout.write(line * 1000)
+""",
+    "files/created": f"""
+import os
+os.makedirs("output/files", exist_ok=True)
+for index in range({FILES}):
+    with open(f"output/files/{{index}}.txt", "w") as f:
+        f.write(str(index))
+""",
+}
+
+UNITS = {"B": 1, "KB": 1024, "MB": 1024**2, "GB": 1024**3}
+
+
+def parse_size(size: str) -> int:
+    """Parse a size such as 100MB into bytes"""
+    match = re.fullmatch(r"(\d+(?:\.\d+)?)\s*([KMG]?B)", size.strip().upper())
+    if match is None:
+        raise ValueError(f"Invalid size: {size}")
+    return int(float(match[1]) * UNITS[match[2]])
+
+
+def write_dataset(path: Path, size: int, seed: int) -> None:
+    """
+    Write a CSV dataset of about the size, with a content unique to the seed
+
+    Args:
+        path (Path): Path of the CSV file
+        size (int): Bytes
+        seed (int): Seed making the content of the file unique
+    """
+
+    rows = "".join(
+        f"{index},{index % 7 * 0.7:.1f},{index % 5 * 0.5:.1f},{index % 3 * 1.3:.1f},"
+        f"{index % 11 * 0.2:.1f},{'ABC'[index % 3]}\n"
+        for index in range(10_000)
+    ).encode()
+
+    with open(path, "wb") as f:
+        f.write(f"id,SL,SW,PL,PW,SP_{seed}\n".encode())
+        for _ in range(max(size // len(rows), 1)):
+            f.write(rows)
+
+
+def measure(
+    run: Callable[[], None],
+    repeat: int,
+    setup: Callable[[int], None] | None = None,
+) -> list[float]:
+    """
+    Time the runs of a benchmark
+
+    Args:
+        run (Callable[[], None]): Benchmark
+        repeat (int): Number of timed runs
+        setup (Callable[[int], None] | None, optional): Untimed setup of each run, given its index. Defaults to None.
+
+    Returns:
+        list[float]: Seconds of each run
+    """
+
+    times = []
+    for index in range(repeat):
+        if setup is not None:
+            setup(index)
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class SandboxBenchmarks:
+    """Benchmarks of the sandbox, in sandboxes of a temporary directory"""
+
+    def __init__(self, root: Path, repeat: int) -> None:
+        self.root: Path = root
+        self.repeat: int = repeat
+        self.csv: Path = root.joinpath("datasets", "small", "data.csv")
+
+        Sandbox.sandbox_base = root.joinpath("sandbox")
+        self.csv.parent.mkdir(parents=True)
+        write_dataset(self.csv, 1024**2, seed=0)
+
+        # Start the worker pool before the timed runs
+        Sandbox.get_pool()
+
+    def new_sandbox(self) -> Sandbox:
+        """Create a sandbox with the small dataset"""
+        return Sandbox.create(session_id=uuid4(), files=[self.csv])
+
+    def create(self, size: int) -> dict[str, list[float]]:
+        """Time the creation of sandboxes with new and stored datasets of a size"""
+        sandboxes = []
+        datasets = []
+
+        def setup(index: int) -> None:
+            path = self.root.joinpath("datasets", f"{size}-{index}", "data.csv")
+            path.parent.mkdir(parents=True)
+            write_dataset(path, size, seed=index + 1)
+            datasets.append(path)
+
+        def create() -> None:
+            sandboxes.append(Sandbox.create(session_id=uuid4(), files=[datasets[-1]]))
+
+        try:
+            cold = measure(create, self.repeat, setup)
+            # The datasets of the previous runs are still mounted, so they are stored
+            warm = measure(create, self.repeat)
+        finally:
+            for sandbox in sandboxes:
+                sandbox.delete()
+            for path in datasets:
+                shutil.rmtree(path.parent)
+
+        return {"create": cold, "create_warm": warm}
+
+    def execute(self, name: str) -> list[float]:
+        """Time the execution of a script, without the result cache"""
+        sandbox = self.new_sandbox()
+        try:
+            sandbox.update(SCRIPTS[name])
+            # Warm up the worker pool
+            sandbox.execute(cache=False)
+            return measure(lambda: sandbox.execute(cache=False), self.repeat)
+        finally:
+            sandbox.delete()
+
+    def files_unchanged(self) -> list[float]:
+        """Time the executions of a sandbox holding thousands of files"""
+        sandbox = self.new_sandbox()
+        try:
+            files = sandbox.sandbox_dir.joinpath("output", "files")
+            files.mkdir()
+            for index in range(FILES):
+                files.joinpath(f"{index}.txt").write_text(str(index))
+
+            sandbox.update(SCRIPTS["execute/empty"])
+            # Hash the new files once, like the first execution after they appear
+            sandbox.execute(cache=False)
+            return measure(lambda: sandbox.execute(cache=False), self.repeat)
+        finally:
+            sandbox.delete()
+
+    def files_created(self) -> list[float]:
+        """Time the executions of a script creating thousands of files"""
+        sandbox = self.new_sandbox()
+        try:
+            sandbox.update(SCRIPTS["files/created"])
+            sandbox.execute(cache=False)
+
+            def setup(index: int) -> None:
+                shutil.rmtree(sandbox.sandbox_dir.joinpath("output", "files"))
+
+            def run() -> None:
+                result = sandbox.execute(cache=False)
+                assert len(result.changes.created) == FILES, "Files not detected"
+
+            return measure(run, self.repeat, setup)
+        finally:
+            sandbox.delete()
+
+    def images_encode(self) -> list[float]:
+        """Time the encoding of many large images"""
+        sandbox = self.new_sandbox()
+        try:
+            for index in range(IMAGES):
+                sandbox.sandbox_dir.joinpath("output", f"{index}.jpg").write_bytes(
+                    os.urandom(IMAGE_SIZE)
+                )
+            manifest = sandbox.get_manifest()
+            manifest.scan()
+            manifest.save()
+
+            def run() -> None:
+                assert len(sandbox.get_images_encoded()) == IMAGES, "Images not found"
+
+            return measure(run, self.repeat)
+        finally:
+            sandbox.delete()
+
+
+def summarize(times: list[float], threshold: float) -> dict:
+    """Statistics of the runs of a benchmark, and whether it passed its threshold"""
+    median = statistics.median(times)
+    return {
+        "median": median,
+        "min": min(times),
+        "max": max(times),
+        "runs": len(times),
+        "threshold": threshold,
+        "passed": median <= threshold,
+    }
+
+
+def main() -> None:
+    """Run the benchmarks and check them against their thresholds"""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--sizes", default="1MB,100MB,1GB", help="dataset sizes")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--only", default="", help="comma-separated name prefixes")
+    parser.add_argument("--thresholds", type=Path, help="JSON of seconds by name")
+    parser.add_argument("--output", type=Path, help="JSON results file")
+    args = parser.parse_args()
+
+    thresholds = dict(THRESHOLDS)
+    if args.thresholds is not None:
+        with open(args.thresholds) as f:
+            thresholds.update(json.load(f))
+
+    prefixes = [prefix for prefix in args.only.split(",") if prefix]
+
+    def selected(name: str) -> bool:
+        return not prefixes or any(name.startswith(prefix) for prefix in prefixes)
+
+    def threshold(name: str) -> float:
+        if name in thresholds:
+            return thresholds[name]
+        kind, size = name.split("/")
+        if kind == "create":
+            return (
+                thresholds["create"]
+                + thresholds["create_per_gb"] * parse_size(size) / 1024**3
+            )
+        return thresholds[kind]
+
+    results = {}
+    with (
+        tempfile.TemporaryDirectory(prefix="agentml-bench-") as tmp,
+        contextlib.redirect_stdout(sys.stderr),
+    ):
+        benchmarks = SandboxBenchmarks(Path(tmp), args.repeat)
+
+        for size in args.sizes.split(","):
+            if not selected(f"create/{size}") and not selected(f"create_warm/{size}"):
+                continue
+            free = shutil.disk_usage(tmp).free
+            if parse_size(size) * (args.repeat + 1) > free:
+                print(f"Benchmark: Skipping create/{size}, not enough disk space")
+                continue
+            for kind, times in benchmarks.create(parse_size(size)).items():
+                results[f"{kind}/{size}"] = times
+
+        for name in ["execute/empty", "execute/imports", "execute/stdout"]:
+            if selected(name):
+                results[name] = benchmarks.execute(name)
+        if selected("files/unchanged"):
+            results["files/unchanged"] = benchmarks.files_unchanged()
+        if selected("files/created"):
+            results["files/created"] = benchmarks.files_created()
+        if selected("images/encode"):
+            results["images/encode"] = benchmarks.images_encode()
+
+        pool = Sandbox.get_pool()
+        if pool is not None:
+            pool.close()
+
+    report = {
+        "benchmarks": {
+            name: summarize(times, threshold(name)) for name, times in results.items()
+        }
+    }
+    report["passed"] = all(result["passed"] for result in report["benchmarks"].values())
+
+    print(json.dumps(report, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    for name, result in report["benchmarks"].items():
+        status = "ok" if result["passed"] else "FAIL"
+        print(
+            f"{name:<20} median {result['median']:>8.3f}s "
+            f"(threshold {result['threshold']:.3f}s) {status}",
+            file=sys.stderr,
+        )
+
+    if not report["passed"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
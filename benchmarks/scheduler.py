@@ -0,0 +1,104 @@
+"""
+benchmarks/scheduler.py
+
+Burst of concurrent LLM requests through the scheduler against a rate limited fake API
+
+Usage:
+    python -m benchmarks.scheduler [--requests 60] [--server-rps 10] [--rpm 600] [--concurrency 4]
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import AsyncOpenAI, OpenAI
+
+from agentml.scheduler import LlmScheduler, Priority, ScheduledClient
+from benchmarks.fake_openai import FakeOpenAI
+
+MODEL = "gpt-4-1106-preview"
+
+
+def main() -> None:
+    """Send a burst of requests of mixed priorities and report the retries and waits"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--server-rps", type=float, default=10)
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--rpm", type=float, default=None, help="scheduler limit")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    with FakeOpenAI(
+        latency=args.latency, requests_per_second=args.server_rps, retry_after=0.5
+    ) as fake:
+        scheduler = LlmScheduler(
+            rate_limits={
+                MODEL: {
+                    "requests_per_minute": args.rpm,
+                    "tokens_per_minute": None,
+                    "max_concurrency": args.concurrency,
+                }
+            },
+            backoff_base=0.2,
+        )
+        client = ScheduledClient(
+            OpenAI(api_key="fake", base_url=fake.base_url, max_retries=0), scheduler
+        )
+        async_client = ScheduledClient(
+            AsyncOpenAI(api_key="fake", base_url=fake.base_url, max_retries=0),
+            scheduler,
+        )
+
+        latencies: dict[Priority, list[float]] = {priority: [] for priority in Priority}
+        failures = []
+
+        def request(index: int) -> None:
+            priority = list(Priority)[index % len(Priority)]
+            start = time.perf_counter()
+            try:
+                client.chat.completions.create(
+                    model=MODEL,
+                    messages=[{"role": "user", "content": f"Request {index}"}],
+                    priority=priority,
+                )
+                latencies[priority].append(time.perf_counter() - start)
+            except Exception as e:
+                failures.append(e)
+
+        async def arequests(count: int) -> None:
+            async def arequest(index: int) -> None:
+                try:
+                    await async_client.chat.completions.create(
+                        model=MODEL,
+                        messages=[{"role": "user", "content": f"Async {index}"}],
+                    )
+                except Exception as e:
+                    failures.append(e)
+
+            await asyncio.gather(*(arequest(index) for index in range(count)))
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.requests) as executor:
+            future = executor.submit(asyncio.run, arequests(args.requests // 4))
+            list(executor.map(request, range(args.requests)))
+            future.result()
+        elapsed = time.perf_counter() - start
+
+        print(f"\n{args.requests + args.requests // 4} requests in {elapsed:.2f}s")
+        print(f"Server: {fake.requests} received, {fake.rate_limited} rate limited")
+        print(f"Failed: {len(failures)} {failures[:1]}")
+        for model, stats in scheduler.stats().items():
+            print(f"Scheduler {model}: {stats}")
+        for priority, values in latencies.items():
+            if values:
+                print(
+                    f"{priority.name:<6} median {statistics.median(values):.2f}s "
+                    f"max {max(values):.2f}s ({len(values)} requests)"
+                )
+
+
+if __name__ == "__main__":
+    main()
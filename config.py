@@ -5,10 +5,104 @@ from pathlib import Path
 PROJECT_PATH = Path(__file__).parent
 
 DATA_DIR = PROJECT_PATH.joinpath("data")
+# Created on first use, importing the package does not write to the filesystem
 LOGS_DIR = PROJECT_PATH.joinpath("logs")
-if not LOGS_DIR.exists():
-    LOGS_DIR.mkdir()
-
 SANDBOX_DIR = PROJECT_PATH.joinpath(".sandbox")
-if not SANDBOX_DIR.exists():
-    SANDBOX_DIR.mkdir()
+
+# Sandbox worker pool (0 workers to always run scripts in a cold interpreter)
+SANDBOX_POOL_SIZE = 2
+SANDBOX_POOL_MAX_RUNS = 50
+SANDBOX_POOL_WARM_MODULES = [
+    "numpy",
+    "pandas",
+    "matplotlib",
+    "matplotlib.pyplot",
+    "seaborn",
+    "sklearn",
+    "sklearn.ensemble",
+    "sklearn.linear_model",
+    "sklearn.metrics",
+    "sklearn.model_selection",
+    "sklearn.preprocessing",
+]
+
+# Run Coder steps as incremental cells in a stateful session kernel
+CODER_CELL_MODE = False
+
+# Stream the Coder responses and run the code as soon as its code block is closed
+# (streamed requests are not answered from the LLM cache)
+CODER_EARLY_EXECUTION = True
+
+# Format the recognized sandbox outputs (tables, reports, tracebacks) locally instead of with an LLM
+CODER_LOCAL_FORMATTER = True
+
+# Cache the LLM responses of identical requests (seconds before expiry, bytes of cached responses)
+LLM_CACHE = False
+LLM_CACHE_PATH = PROJECT_PATH.joinpath(".cache", "llm.sqlite3")
+LLM_CACHE_TTL = 7 * 24 * 3600
+LLM_CACHE_SIZE = 256 * 1024**2
+
+# Requests and tokens per minute, and requests in flight, allowed per model (None for no limit)
+LLM_RATE_LIMITS = {
+    "gpt-4-1106-preview": {"requests_per_minute": 500, "tokens_per_minute": 150_000},
+    "gpt-4-vision-preview": {"requests_per_minute": 100, "tokens_per_minute": 40_000},
+}
+LLM_REQUESTS_PER_MINUTE = 3_500
+LLM_TOKENS_PER_MINUTE = 160_000
+LLM_MAX_CONCURRENCY = 16
+
+# Retries of the rate limited and failed LLM requests, with exponential backoff (seconds)
+LLM_MAX_RETRIES = 6
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 60.0
+
+# Tokens of history sent to each model (compacted past the budget), and to the others
+CONTEXT_BUDGETS = {
+    "gpt-4-1106-preview": 32_000,
+    "gpt-4-vision-preview": 32_000,
+    "gpt-3.5-turbo-1106": 12_000,
+    "gpt-3.5-turbo": 3_000,
+}
+CONTEXT_BUDGET = 8_000
+
+# Characters of each message kept in the summary of the compacted history
+CONTEXT_SUMMARY_LINE_SIZE = 200
+
+# Decide to retry or validate the runs that plainly failed or succeeded without an LLM
+MANAGER_LOCAL_VALIDATOR = True
+
+# Independent plan steps run concurrently in copies of the sandbox (1 to run them sequentially)
+MANAGER_MAX_PARALLEL_STEPS = 4
+
+# Batch jobs run concurrently in their own processes (seconds before a job is stopped,
+# and seconds a stopped job gets to clean up before it is killed)
+BATCH_WORKERS = 4
+BATCH_JOB_TIMEOUT = 3600
+BATCH_STOP_GRACE = 10
+BATCH_DIR = LOGS_DIR.joinpath("batch")
+
+# Sandbox output kept in memory (head and tail bytes of each stream)
+SANDBOX_OUTPUT_HEAD_SIZE = 16 * 1024
+SANDBOX_OUTPUT_TAIL_SIZE = 16 * 1024
+
+# Sandbox resource limits per execution (None for no limit)
+SANDBOX_TIMEOUT = 600
+SANDBOX_CPU_TIME_LIMIT = None
+SANDBOX_MEMORY_LIMIT = 8 * 1024**3
+SANDBOX_OPEN_FILES_LIMIT = 1024
+
+# Sandbox files up to this size (bytes) are content-hashed to detect changes (0 to disable)
+SANDBOX_MANIFEST_HASH_LIMIT = 1024**2
+
+# Convert the CSV datasets to a memory-mapped columnar cache shared by the sandboxes
+SANDBOX_COLUMNAR_CACHE = True
+
+# Cache the results of identical executions on identical files (bytes of cached files)
+SANDBOX_RESULT_CACHE = True
+SANDBOX_RESULT_CACHE_SIZE = 1024**3
+
+# Sandbox disk quotas (bytes, None for no quota) and eviction of idle sessions (seconds)
+SANDBOX_SESSION_QUOTA = 10 * 1024**3
+SANDBOX_DISK_QUOTA = 100 * 1024**3
+SANDBOX_SESSION_IDLE_TIME = 3600
+SANDBOX_CLEANUP_INTERVAL = 600
@@ -0,0 +1,15 @@
+"""tests/conftest.py"""
+
+from pathlib import Path
+
+import pytest
+
+from agentml.sandbox import Sandbox
+
+
+@pytest.fixture
+def sandbox_base(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Create the sandboxes (and their dataset store and result cache) in a temporary directory"""
+    base = tmp_path.joinpath("sandbox")
+    monkeypatch.setattr(Sandbox, "sandbox_base", base)
+    return base
@@ -0,0 +1,35 @@
+"""tests/test_batch.py"""
+
+from agentml.batch import get_rate_limits
+from agentml.scheduler import LlmScheduler, RateLimits
+from config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_RATE_LIMITS,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+)
+
+
+def test_rate_limits_shared_by_workers():
+    """Each job process gets its share of the limits of every model"""
+    scheduler = LlmScheduler(get_rate_limits(workers=4))
+
+    for model, limits in LLM_RATE_LIMITS.items():
+        shared = scheduler.get_queue(model).limits
+        assert shared.requests_per_minute == limits["requests_per_minute"] / 4
+        assert shared.tokens_per_minute == limits["tokens_per_minute"] / 4
+
+    # Models without their own limits, like the formatter and the manual manager models
+    for model in ["gpt-3.5-turbo-1106", "gpt-3.5-turbo"]:
+        assert scheduler.get_queue(model).limits == RateLimits(
+            requests_per_minute=LLM_REQUESTS_PER_MINUTE / 4,
+            tokens_per_minute=LLM_TOKENS_PER_MINUTE / 4,
+            max_concurrency=LLM_MAX_CONCURRENCY // 4,
+        )
+
+
+def test_rate_limits_single_worker():
+    """A single job process gets the full limits"""
+    scheduler = LlmScheduler(get_rate_limits(workers=1))
+
+    assert scheduler.get_queue("gpt-3.5-turbo").limits == RateLimits()
@@ -0,0 +1,101 @@
+"""tests/test_context.py"""
+
+import pytest
+
+from agentml.context import CODE_PREFIX, OUTPUT_PREFIX, ContextWindow
+from agentml.models import LlmMessage, LlmRole
+
+MODEL = "gpt-4"
+
+
+def output(text: str, returncode: int = 0) -> LlmMessage:
+    """Output message of an execution"""
+    return LlmMessage(
+        role=LlmRole.ASSISTANT,
+        content=f"{OUTPUT_PREFIX}\n{text}",
+        metadata={
+            "execution": {
+                "termination": "completed" if returncode == 0 else "error",
+                "returncode": returncode,
+            }
+        },
+    )
+
+
+def turn(objective: str, code: str, text: str, returncode: int = 0) -> list:
+    """Messages of a coding turn"""
+    return [
+        LlmMessage(role=LlmRole.USER, content=objective),
+        LlmMessage(
+            role=LlmRole.ASSISTANT, content=f"{CODE_PREFIX}\n```python\n{code}\n```"
+        ),
+        output(text, returncode),
+    ]
+
+
+def history(turns: int) -> list[LlmMessage]:
+    """History of many coding turns"""
+    messages = [LlmMessage.system("You are a data scientist.")]
+    for index in range(turns):
+        messages.extend(
+            turn(f"Objective {index}", f"print({index})\n" * 20, f"{index}\n" * 50)
+        )
+    return messages
+
+
+def test_fit_under_budget():
+    """Messages within the budget are sent unchanged"""
+    messages = history(2)
+    assert ContextWindow(MODEL, budget=10_000).fit(messages) is messages
+
+
+def test_fit_drops_failed_outputs():
+    """The outputs of failed attempts are dropped before anything else"""
+    failed = turn("Train a model", "fit()", "Traceback\n" * 200, returncode=1)
+    retried = turn("Train a model", "fit(x)", "accuracy 0.9")
+    messages = [LlmMessage.system("You are a data scientist."), *failed, *retried]
+
+    window = ContextWindow(MODEL)
+    window.budget = window.count(messages) - 10
+    fitted = window.fit(messages)
+
+    assert failed[2] not in fitted
+    assert retried[2] in fitted
+
+
+def test_fit_summarizes_oldest_turns():
+    """The oldest turns are summarized and the most recent turns kept intact"""
+    messages = history(30)
+    fitted = ContextWindow(MODEL, budget=2_000).fit(messages)
+
+    assert fitted[0] is messages[0]
+    assert fitted[1].content.startswith("Summary of the earlier steps:")
+    assert fitted[-3:] == messages[-3:]
+
+
+@pytest.mark.parametrize("budget", [50, 200, 1_000, 2_000])
+def test_fit_never_over_budget(budget: int):
+    """The messages fit the budget, even when the most recent turn alone exceeds it"""
+    messages = [
+        *history(5),
+        LlmMessage(role=LlmRole.USER, content="Start " + "x " * 5_000 + " end"),
+    ]
+    window = ContextWindow(MODEL, budget=budget)
+    fitted = window.fit(messages)
+
+    assert window.count(fitted) <= budget
+    assert fitted[-1].content.startswith("Start")
+    assert fitted[-1].content.endswith("end")
+
+
+def test_fit_large_system_message():
+    """A system prompt larger than the budget is cut"""
+    messages = [
+        LlmMessage.system("Rules " + "rule " * 5_000),
+        LlmMessage(role=LlmRole.USER, content="Explore the data"),
+    ]
+    window = ContextWindow(MODEL, budget=500)
+    fitted = window.fit(messages)
+
+    assert window.count(fitted) <= 500
+    assert fitted[-1] is messages[-1]
@@ -0,0 +1,88 @@
+"""tests/test_conversation.py"""
+
+from agentml.conversation import Conversation
+from agentml.models import LlmMessage, LlmRole
+
+
+def message(content: str) -> LlmMessage:
+    """User message"""
+    return LlmMessage(role=LlmRole.USER, content=content)
+
+
+def contents(conversation: Conversation) -> list[str]:
+    """Contents of the messages of a conversation"""
+    return [message.content for message in conversation]
+
+
+def test_branch_shares_prefix():
+    """A branch continues the messages of its parent without copying them"""
+    parent = Conversation([message("a"), message("b")])
+    branch = parent.branch()
+    branch.append(message("c"))
+
+    assert contents(branch) == ["a", "b", "c"]
+    assert all(left is right for left, right in zip(branch, parent))
+    assert len(parent) == 2
+
+
+def test_branches_isolated():
+    """Messages appended after the branch point stay in their own conversation"""
+    parent = Conversation([message("a")])
+    first = parent.branch()
+    second = parent.branch()
+
+    first.append(message("first"))
+    second.extend([message("second"), message("more")])
+    parent.append(message("parent"))
+
+    assert contents(parent) == ["a", "parent"]
+    assert contents(first) == ["a", "first"]
+    assert contents(second) == ["a", "second", "more"]
+    assert len(parent) == 2 and len(first) == 2 and len(second) == 3
+
+
+def test_nested_branches():
+    """Branches of branches see the messages of all their ancestors at their branch point"""
+    root = Conversation([message("a")])
+    child = root.branch()
+    child.append(message("b"))
+    grandchild = child.branch()
+    child.append(message("c"))
+    grandchild.append(message("d"))
+    root.append(message("e"))
+
+    assert contents(grandchild) == ["a", "b", "d"]
+    assert contents(child) == ["a", "b", "c"]
+    assert grandchild[1].content == "b"
+    assert [m.content for m in grandchild[-2:]] == ["b", "d"]
+
+
+def test_of():
+    """Conversations are branched and other messages copied"""
+    messages = [message("a")]
+    copied = Conversation.of(messages)
+    copied.append(message("b"))
+
+    assert len(messages) == 1
+    assert contents(copied) == ["a", "b"]
+
+    branch = Conversation.of(copied)
+    branch.append(message("c"))
+    assert contents(copied) == ["a", "b"]
+    assert contents(branch) == ["a", "b", "c"]
+
+    assert len(Conversation.of(None)) == 0
+
+
+def test_to_dicts():
+    """The API format of the shared messages is built once"""
+    parent = Conversation([message("a")])
+    branch = parent.branch()
+    branch.append(LlmMessage(role=LlmRole.ASSISTANT, content="b"))
+
+    dicts = branch.to_dicts()
+    assert dicts == [
+        {"role": "user", "content": "a"},
+        {"role": "assistant", "content": "b"},
+    ]
+    assert parent.to_dicts()[0] is dicts[0]
@@ -0,0 +1,186 @@
+"""tests/test_datasets.py"""
+
+import os
+import subprocess
+import threading
+from pathlib import Path
+from uuid import UUID, uuid4
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from agentml.sandbox import Sandbox, agentml_data, datasets
+from agentml.sandbox.datasets import DatasetStore, hash_file
+
+
+@pytest.fixture
+def csv(tmp_path: Path) -> Path:
+    """CSV dataset with integer, float, string and missing values"""
+    rows = 1000
+    df = pd.DataFrame(
+        {
+            "id": np.arange(rows),
+            "value": np.linspace(0, 1, rows),
+            "species": np.array(["setosa", "versicolor", "virginica"])[
+                np.arange(rows) % 3
+            ],
+            "label": [
+                None if index % 7 == 0 else f"l{index % 4}" for index in range(rows)
+            ],
+            "score": [np.nan if index % 5 == 0 else index / 3 for index in range(rows)],
+        }
+    )
+    path = tmp_path.joinpath("data.csv")
+    df.to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def sandbox_dir(sandbox_base: Path, csv: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    """Sandbox with the dataset and its columnar cache, as the working directory"""
+    sandbox = Sandbox.create(session_id=uuid4(), files=[csv])
+    monkeypatch.chdir(sandbox.sandbox_dir)
+    return sandbox.sandbox_dir
+
+
+def read_csv(**kwargs) -> pd.DataFrame:
+    """Load the dataset with the loader, copying the memory-mapped columns"""
+    return agentml_data.read_csv("data.csv", **kwargs).copy()
+
+
+def test_read_csv_matches_pandas(sandbox_dir: Path):
+    """The columnar cache loads the same DataFrame as pandas"""
+    assert agentml_data.find_cache("data.csv") is not None
+
+    expected = pd.read_csv("data.csv")
+    pd.testing.assert_frame_equal(read_csv(), expected)
+    pd.testing.assert_frame_equal(
+        read_csv(usecols=["value", "species"]), expected[["value", "species"]]
+    )
+    pd.testing.assert_frame_equal(
+        read_csv(categories=True),
+        expected.astype({"species": "category", "label": "category"}),
+        check_categorical=False,
+    )
+
+
+def test_read_csv_stale_cache(sandbox_dir: Path):
+    """A dataset replaced after the cache was linked is parsed by pandas"""
+    df = pd.DataFrame({"a": [1, 2], "b": ["x", "y"]})
+    os.unlink("data.csv")
+    df.to_csv("data.csv", index=False)
+
+    assert agentml_data.find_cache("data.csv") is None
+    pd.testing.assert_frame_equal(agentml_data.read_csv("data.csv"), df)
+
+
+def test_columns_share_page_cache(
+    sandbox_dir: Path, csv: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """The linked columns are the cache files themselves, never reflinked copies"""
+
+    def fail(*args, **kwargs):
+        raise AssertionError("The columns were reflinked")
+
+    monkeypatch.setattr(datasets, "reflink", fail)
+    sandbox = Sandbox(session_id=UUID(sandbox_dir.name))
+    sandbox.link_columns({sandbox_dir.joinpath("data.csv"): hash_file(csv)})
+
+    cache = Sandbox.get_datasets().columns(hash_file(csv))
+    target = agentml_data.find_cache("data.csv")
+    assert cache is not None and target is not None
+    for cache_file in cache.iterdir():
+        assert (
+            target.joinpath(cache_file.name).stat().st_ino == cache_file.stat().st_ino
+        )
+
+
+def test_columns_outside_store_lock(
+    tmp_path: Path, csv: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """The store stays usable while a dataset is converted"""
+    store = DatasetStore(tmp_path.joinpath("store"))
+    session_dir = tmp_path.joinpath("session")
+    digest = store.mount(session_dir.name, {csv: session_dir.joinpath("data.csv")})[
+        session_dir.joinpath("data.csv")
+    ]
+    assert digest == hash_file(csv)
+
+    run = subprocess.run
+    unlocked = []
+
+    def convert(*args, **kwargs):
+        unlocked.append(is_unlocked(store))
+        return run(*args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "run", convert)
+    path = store.columns(digest)
+
+    assert unlocked == [True], "The store lock was held during the conversion"
+    assert path is not None and path.joinpath(agentml_data.META_FILE).exists()
+
+
+def test_mount_outside_store_lock(
+    tmp_path: Path, csv: Path, monkeypatch: pytest.MonkeyPatch
+):
+    """The store stays usable while a dataset is hashed and copied"""
+    store = DatasetStore(tmp_path.joinpath("store"))
+    unlocked = []
+
+    def wrap(function):
+        def wrapper(*args, **kwargs):
+            unlocked.append(is_unlocked(store))
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    monkeypatch.setattr(datasets, "hash_file", wrap(datasets.hash_file))
+    monkeypatch.setattr(DatasetStore, "_copy", wrap(DatasetStore._copy))
+
+    session_dir = tmp_path.joinpath("session")
+    store.mount(session_dir.name, {csv: session_dir.joinpath("data.csv")})
+
+    assert unlocked == [True, True], "The store lock was held during the copy"
+    assert session_dir.joinpath("data.csv").read_bytes() == csv.read_bytes()
+
+
+def test_concurrent_mounts(tmp_path: Path, csv: Path):
+    """Sessions mounting the same dataset at once share a single stored file"""
+    store = DatasetStore(tmp_path.joinpath("store"))
+    sessions = [tmp_path.joinpath(f"session-{index}") for index in range(8)]
+    for session_dir in sessions:
+        session_dir.mkdir()
+
+    threads = [
+        threading.Thread(
+            target=store.mount,
+            args=(session_dir.name, {csv: session_dir.joinpath("data.csv")}),
+        )
+        for session_dir in sessions
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    digest = hash_file(csv)
+    assert [path.name for path in store.objects_dir.glob("*/*")] == [digest]
+    assert store.usage() == {digest: len(sessions)}
+    assert not any(store.root.joinpath("tmp").iterdir())
+    for session_dir in sessions:
+        assert session_dir.joinpath("data.csv").read_bytes() == csv.read_bytes()
+
+
+def is_unlocked(store: DatasetStore) -> bool:
+    """Check if another thread can take the store lock"""
+    unlocked = []
+
+    def lock() -> None:
+        with store.locked():
+            unlocked.append(True)
+
+    locker = threading.Thread(target=lock, daemon=True)
+    locker.start()
+    locker.join(timeout=5)
+    return bool(unlocked)
@@ -0,0 +1,87 @@
+"""tests/test_formatter.py"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from agentml.formatter import format_output
+
+DF = pd.DataFrame(
+    {
+        "id": [1, 2, 3],
+        "SL": [5.1, 4.9, -4.7],
+        "species": ["setosa", "versicolor", "virginica"],
+    }
+)
+
+
+def test_dataframe():
+    """DataFrames are rendered as tables, with the numeric columns right-aligned"""
+    markdown = format_output(str(DF))
+
+    assert markdown.splitlines() == [
+        "|  | id | SL | species |",
+        "| ---: | ---: | ---: | --- |",
+        "| 0 | 1 | 5.1 | setosa |",
+        "| 1 | 2 | 4.9 | versicolor |",
+        "| 2 | 3 | -4.7 | virginica |",
+    ]
+
+
+def test_dataframe_of_strings():
+    """DataFrames without numeric columns are recognized by their header"""
+    df = pd.DataFrame({"name": ["a b", "c"], "city": ["New York", "Paris"]})
+
+    assert format_output(str(df)).splitlines()[0] == "|  | name | city |"
+
+
+def test_dataframe_index_levels():
+    """Grouped DataFrames keep the names and the blank repeated values of their index"""
+    df = DF.assign(group=["x", "x", "y"]).groupby(["group", "species"])[["SL"]].sum()
+    markdown = format_output(str(df))
+
+    assert markdown.splitlines()[0] == "| group | species | SL |"
+    assert "|  | versicolor | 4.9 |" in markdown
+
+
+def test_describe():
+    """describe() tables are rendered as tables"""
+    markdown = format_output(str(DF.describe()))
+
+    assert markdown.splitlines()[0] == "|  | id | SL |"
+    assert "| count | 3.0 | 3.000000 |" in markdown
+
+
+@pytest.mark.parametrize(
+    "series, header",
+    [
+        (pd.Series([0.5, 1.5], index=["a", "b"], name="score"), "|  | score |"),
+        (DF["species"].value_counts(), "| species | count |"),
+        (pd.Series(np.arange(3)), "|  |  |"),
+    ],
+)
+def test_series(series: pd.Series, header: str):
+    """Series are rendered as tables of their index and values, with their dtype"""
+    markdown = format_output(str(series))
+
+    assert markdown.splitlines()[0] == header
+    assert markdown.endswith(f"dtype: {series.dtype}*")
+
+
+@pytest.mark.parametrize(
+    "output",
+    [
+        "The model  is good\nand it works  well here",
+        "Accuracy  is high\nLoss  is low",
+        "Training done.  Saving the model\nto output/model.pkl  for later",
+        "Columns:  id, SL, species\nTarget:  species",
+    ],
+)
+def test_prose_not_table(output: str):
+    """Prose with double spaces is not a table, and is left to the model"""
+    assert format_output(output) is None
+
+
+def test_plain_text():
+    """Plain text is kept as paragraphs, escaping the markdown syntax"""
+    assert format_output("Shape: (150, 6)\n# Done") == "Shape: (150, 6)  \n\\# Done"
@@ -0,0 +1,31 @@
+"""tests/test_import_time.py"""
+
+import statistics
+
+import pytest
+
+from benchmarks.import_time import BUDGET, measure
+
+
+@pytest.fixture(scope="module")
+def imports() -> tuple[list[float], list[float], set[str], set[str]]:
+    """Import the package in fresh interpreters"""
+    return measure(runs=5)
+
+
+def test_import_time_budget(imports):
+    """Importing the package stays within its time budget"""
+    _, process_times, _, _ = imports
+    assert statistics.median(process_times) <= BUDGET
+
+
+def test_import_defers_modules(imports):
+    """Importing the package does not load the heavy dependencies"""
+    _, _, loaded, _ = imports
+    assert not loaded
+
+
+def test_import_creates_no_directories(imports):
+    """Importing the package does not create the log and sandbox directories"""
+    _, _, _, created = imports
+    assert not created
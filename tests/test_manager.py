@@ -0,0 +1,74 @@
+"""tests/test_manager.py"""
+
+import pytest
+
+from agentml.agents import Coder
+from agentml.manager import Manager
+
+
+def step(id_, depends_on=None, tool="Coder") -> dict:
+    """Plan step"""
+    return {
+        "id": id_,
+        "tool": tool,
+        "objective": f"Step {id_}",
+        "depends_on": [] if depends_on is None else depends_on,
+    }
+
+
+def ids(stages: list[list[dict]]) -> list[list[int]]:
+    """Ids of the steps of each stage"""
+    return [[task["id"] for task in stage] for stage in stages]
+
+
+def test_independent_steps():
+    """Independent steps run in a single stage, up to the maximum size"""
+    plan = [step(1), step(2), step(3, [1, 2]), step(4, [1])]
+
+    assert ids(Manager.get_stages(plan, max_size=4)) == [[1, 2], [3, 4]]
+    assert ids(Manager.get_stages(plan, max_size=1)) == [[1], [2], [3], [4]]
+    assert ids(Manager.get_stages([step(1), step(2), step(3)], max_size=2)) == [
+        [1, 2],
+        [3],
+    ]
+
+
+def test_planner_runs_alone():
+    """Planner steps run in their own stage, after the other ready steps"""
+    plan = [step(1), step(2, tool="Planner"), step(3), step(4, [2])]
+
+    assert ids(Manager.get_stages(plan, max_size=4)) == [[1, 3], [2], [4]]
+
+
+def test_cyclic_plan():
+    """Cyclic plans run sequentially"""
+    plan = [step(1), step(2, [3]), step(3, [2])]
+
+    assert ids(Manager.get_stages(plan, max_size=4)) == [[1], [2], [3]]
+
+
+def test_unknown_dependencies():
+    """Dependencies on steps outside of the plan are already done"""
+    plan = [step(1, [99]), step(2, [1, 42])]
+
+    assert ids(Manager.get_stages(plan, max_size=4)) == [[1], [2]]
+
+
+@pytest.mark.parametrize(
+    "plan",
+    [
+        [step(1), step(1)],
+        [step(1), step("2")],
+        [step(1), {"id": 2, "tool": "Coder", "objective": "Step 2"}],
+    ],
+)
+def test_invalid_plan(plan: list[dict]):
+    """Plans with duplicated or invalid ids or dependencies run sequentially"""
+    assert Manager.get_stages(plan, max_size=4) == [[task] for task in plan]
+
+
+def test_get_agent():
+    """Steps name their agent, and unknown agents are rejected"""
+    assert Manager.get_agent("Coder") is Coder
+    with pytest.raises(ValueError):
+        Manager.get_agent("Unknown")
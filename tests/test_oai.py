@@ -0,0 +1,33 @@
+"""tests/test_oai.py"""
+
+import asyncio
+
+import pytest
+
+from agentml import oai
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Create the clients without a real API key"""
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+
+
+def test_async_client_per_loop():
+    """Each event loop gets its own client, shared by the coroutines running on it"""
+
+    async def get_clients():
+        return oai.get_async_client(), oai.get_async_client()
+
+    first = asyncio.run(get_clients())
+    second = asyncio.run(get_clients())
+
+    assert first[0] is first[1]
+    assert second[0] is second[1]
+    assert first[0] is not second[0]
+
+
+def test_async_client_outside_loop():
+    """The client of the asyncio runtime is only available on a running loop"""
+    with pytest.raises(RuntimeError):
+        oai.get_async_client()
@@ -0,0 +1,110 @@
+"""tests/test_result_cache.py"""
+
+from pathlib import Path
+from uuid import uuid4
+
+from agentml.sandbox import ExecutionResult, Sandbox
+from agentml.sandbox.models import FileChanges
+from agentml.sandbox.results import ResultCache
+
+WRITER = """
+with open("output/value.txt", "w") as f:
+    f.write("{value}")
+"""
+
+READER = """
+with open("output/value.txt") as f:
+    print(f.read())
+"""
+
+
+def run(sandbox: Sandbox, code: str) -> ExecutionResult:
+    """Execute the code in the sandbox with the result cache"""
+    sandbox.update(code)
+    result = sandbox.execute(cache=True)
+    assert result.returncode == 0, result.stderr
+    return result
+
+
+def test_identical_execution_cached(sandbox_base: Path):
+    """An identical execution on identical files is restored from the cache"""
+    sandbox = Sandbox.create(session_id=uuid4(), files=[])
+
+    first = run(sandbox, "print('hello')")
+    second = run(sandbox, "print('hello')")
+
+    assert not first.cached
+    assert second.cached
+    assert second.stdout == first.stdout == "hello\n"
+
+
+def test_cached_files_restored(sandbox_base: Path):
+    """A cached execution restores the files it produced"""
+    first = Sandbox.create(session_id=uuid4(), files=[])
+    second = Sandbox.create(session_id=uuid4(), files=[])
+
+    run(first, WRITER.format(value="A"))
+    result = run(second, WRITER.format(value="A"))
+
+    assert result.cached
+    assert second.sandbox_dir.joinpath("output", "value.txt").read_text() == "A"
+
+
+def test_code_change_invalidates(sandbox_base: Path):
+    """Changing the code runs it again"""
+    sandbox = Sandbox.create(session_id=uuid4(), files=[])
+
+    run(sandbox, "print('a')")
+    result = run(sandbox, "print('b')")
+
+    assert not result.cached
+    assert result.stdout == "b\n"
+
+
+def test_input_change_invalidates(sandbox_base: Path):
+    """Changing a file the code reads runs it again"""
+    sandbox = Sandbox.create(session_id=uuid4(), files=[])
+    code = "print(open('input.txt').read())"
+
+    sandbox.sandbox_dir.joinpath("input.txt").write_text("first")
+    run(sandbox, code)
+    sandbox.sandbox_dir.joinpath("input.txt").write_text("second")
+    result = run(sandbox, code)
+
+    assert not result.cached
+    assert result.stdout == "second\n"
+
+
+def test_output_change_invalidates(sandbox_base: Path):
+    """Rewriting an output file runs the code reading it again"""
+    sandbox = Sandbox.create(session_id=uuid4(), files=[])
+
+    run(sandbox, WRITER.format(value="A"))
+    assert run(sandbox, READER).stdout == "A\n"
+
+    run(sandbox, WRITER.format(value="B-different"))
+    result = run(sandbox, READER)
+
+    assert not result.cached
+    assert result.stdout == "B-different\n"
+
+
+def test_eviction(tmp_path: Path):
+    """The least recently used entries are evicted past the size limit"""
+    source = tmp_path.joinpath("source")
+    source.mkdir()
+    cache = ResultCache(tmp_path.joinpath("cache"), max_size=150)
+    changes = FileChanges(created=[Path("file.bin")])
+
+    for key in ["a", "b", "c"]:
+        source.joinpath("file.bin").write_bytes(b"x" * 60)
+        cache.put(key, ExecutionResult(returncode=0), changes, source)
+        if key == "b":
+            # Use the first entry, so that the second one is the least recently used
+            assert cache.get("a", tmp_path.joinpath("target")) is not None
+
+    target = tmp_path.joinpath("target")
+    assert cache.get("a", target) is not None
+    assert cache.get("b", target) is None
+    assert cache.get("c", target) is not None
+    assert cache.stats()["entries"] == 2
@@ -0,0 +1,100 @@
+"""tests/test_sandbox_concurrency.py"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from uuid import uuid4
+
+import pytest
+
+from agentml.sandbox import ExecutionResult, Sandbox
+
+SESSIONS = 16
+
+SCRIPT = """
+import os
+import time
+
+print("session {index}")
+print(os.getcwd())
+time.sleep(0.1)
+with open("output/session_{index}.txt", "w") as f:
+    f.write("{index}")
+"""
+
+
+def create_sandboxes(count: int) -> list[Sandbox]:
+    """Create sandboxes, each running a script identifying its session"""
+    sandboxes = []
+    for index in range(count):
+        sandbox = Sandbox.create(session_id=uuid4(), files=[])
+        sandbox.update(SCRIPT.format(index=index))
+        sandboxes.append(sandbox)
+    return sandboxes
+
+
+def check_isolation(sandboxes: list[Sandbox], results: list[ExecutionResult]) -> None:
+    """Check that each execution only saw its own output, files and directory"""
+    for index, (sandbox, result) in enumerate(zip(sandboxes, results)):
+        assert result.returncode == 0, result.stderr
+        stdout = result.stdout.splitlines()
+        assert stdout[0] == f"session {index}"
+        assert Path(stdout[1]).resolve() == sandbox.sandbox_dir.resolve()
+        assert [file.name for file in result.files] == [f"session_{index}.txt"]
+        assert sandbox.sandbox_dir.joinpath(result.files[0]).read_text() == str(index)
+
+        # No other session wrote into this sandbox
+        assert sorted(os.listdir(sandbox.sandbox_dir.joinpath("output"))) == [
+            f"session_{index}.txt"
+        ]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_sessions_asyncio(sandbox_base: Path) -> None:
+    """Sessions executing concurrently on one event loop are isolated"""
+    sandboxes = await asyncio.to_thread(create_sandboxes, SESSIONS)
+
+    results = await asyncio.gather(
+        *(sandbox.execute_async(cache=False) for sandbox in sandboxes)
+    )
+
+    check_isolation(sandboxes, results)
+
+
+def test_concurrent_sessions_threads(sandbox_base: Path) -> None:
+    """Sessions executing concurrently from threads are isolated"""
+    sandboxes = create_sandboxes(SESSIONS)
+
+    with ThreadPoolExecutor(max_workers=SESSIONS) as executor:
+        results = list(
+            executor.map(lambda sandbox: sandbox.execute(cache=False), sandboxes)
+        )
+
+    check_isolation(sandboxes, results)
+
+
+def test_concurrent_sessions_mixed(sandbox_base: Path) -> None:
+    """Event loops in several threads and plain threads share the sandbox safely"""
+    sandboxes = create_sandboxes(SESSIONS)
+    half = SESSIONS // 2
+
+    async def gather(group: list[Sandbox]) -> list[ExecutionResult]:
+        return await asyncio.gather(
+            *(sandbox.execute_async(cache=False) for sandbox in group)
+        )
+
+    with ThreadPoolExecutor(max_workers=SESSIONS) as executor:
+        loops = [
+            executor.submit(asyncio.run, gather(sandboxes[:half:2])),
+            executor.submit(asyncio.run, gather(sandboxes[1:half:2])),
+        ]
+        threads = executor.map(
+            lambda sandbox: sandbox.execute(cache=False), sandboxes[half:]
+        )
+        rest = list(threads)
+        first, second = loops[0].result(), loops[1].result()
+
+    results = [None] * half
+    results[::2], results[1::2] = first, second
+    check_isolation(sandboxes, results + rest)
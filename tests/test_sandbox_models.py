@@ -0,0 +1,53 @@
+"""
+tests/test_sandbox_models.py
+
+Classification of the terminated sandbox executions
+"""
+
+import signal
+
+import pytest
+
+from agentml.sandbox.models import ExecutionResult, ResourceLimits, TerminationReason
+
+
+@pytest.mark.parametrize(
+    "user_time, system_time, termination",
+    [
+        (9.5, 1.0, TerminationReason.CPU_TIME),
+        (0.5, 0.1, TerminationReason.MEMORY),
+        (None, None, TerminationReason.MEMORY),
+    ],
+)
+def test_sigkill_with_cpu_limit(user_time, system_time, termination):
+    """SIGKILL is a CPU time kill only when the script used up its CPU time"""
+    result = ExecutionResult.terminated(
+        returncode=-signal.SIGKILL,
+        timed_out=False,
+        memory_error=False,
+        limits=ResourceLimits(cpu_time=10),
+        user_time=user_time,
+        system_time=system_time,
+    )
+    assert result.termination == termination
+
+
+def test_sigkill_without_cpu_limit():
+    """SIGKILL without a CPU limit is an out of memory kill"""
+    result = ExecutionResult.terminated(
+        returncode=-signal.SIGKILL,
+        timed_out=False,
+        memory_error=False,
+        limits=ResourceLimits(cpu_time=None),
+        user_time=100.0,
+        system_time=1.0,
+    )
+    assert result.termination == TerminationReason.MEMORY
+
+
+def test_sigxcpu():
+    """SIGXCPU is always a CPU time kill"""
+    result = ExecutionResult.terminated(
+        returncode=-signal.SIGXCPU, timed_out=False, memory_error=False
+    )
+    assert result.termination == TerminationReason.CPU_TIME
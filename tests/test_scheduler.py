@@ -0,0 +1,192 @@
+"""tests/test_scheduler.py"""
+
+import asyncio
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from agentml.scheduler import LlmScheduler, Priority
+
+MODEL = "gpt-test"
+MESSAGES = [{"role": "user", "content": "Hello"}]
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def scheduler(**limits) -> LlmScheduler:
+    """Scheduler of the test model, without limits unless given"""
+    rate_limits = {
+        "requests_per_minute": None,
+        "tokens_per_minute": None,
+        "max_concurrency": None,
+        **limits,
+    }
+    return LlmScheduler({MODEL: rate_limits}, backoff_base=0.01, backoff_max=0.05)
+
+
+def rate_limit_error(headers: dict[str, str]) -> openai.RateLimitError:
+    """429 response of the API"""
+    response = httpx.Response(429, headers=headers, request=REQUEST)
+    return openai.RateLimitError("Rate limited", response=response, body=None)
+
+
+def completion() -> SimpleNamespace:
+    """Chat completion without usage"""
+    return SimpleNamespace(usage=None)
+
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    """Waiting requests get the free slot by priority, then in arrival order"""
+    llm_scheduler = scheduler(max_concurrency=1)
+    blocked = asyncio.Event()
+    order = []
+
+    async def create(**kwargs):
+        if kwargs["user"] == "first":
+            await blocked.wait()
+        order.append(kwargs["user"])
+        return completion()
+
+    def call(user: str, priority: Priority) -> asyncio.Task:
+        return asyncio.create_task(
+            llm_scheduler.acall(
+                create, priority, model=MODEL, messages=MESSAGES, user=user
+            )
+        )
+
+    tasks = [call("first", Priority.LOW)]
+    for user, priority in [
+        ("low", Priority.LOW),
+        ("normal", Priority.NORMAL),
+        ("high", Priority.HIGH),
+        ("high2", Priority.HIGH),
+    ]:
+        await asyncio.sleep(0.01)
+        tasks.append(call(user, priority))
+    await asyncio.sleep(0.01)
+
+    blocked.set()
+    await asyncio.gather(*tasks)
+
+    assert order == ["first", "high", "high2", "normal", "low"]
+
+
+@pytest.mark.parametrize(
+    "headers, delay",
+    [({"retry-after-ms": "300"}, 0.3), ({"retry-after": "1"}, 1.0)],
+)
+def test_retry_after(headers: dict[str, str], delay: float):
+    """Rate limited requests are retried after the delay asked by the API"""
+    llm_scheduler = scheduler()
+    attempts = []
+
+    def create(**kwargs):
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise rate_limit_error(headers)
+        return completion()
+
+    llm_scheduler.call(create, model=MODEL, messages=MESSAGES)
+
+    assert len(attempts) == 2
+    assert attempts[1] - attempts[0] >= delay
+    assert llm_scheduler.stats()[MODEL]["rate_limited"] == 1
+    assert llm_scheduler.stats()[MODEL]["retries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_backoff():
+    """Failed requests are retried with backoff, until the retries are exhausted"""
+    llm_scheduler = scheduler()
+    llm_scheduler.max_retries = 3
+    attempts = []
+
+    async def create(**kwargs):
+        attempts.append(time.monotonic())
+        raise openai.APIConnectionError(request=REQUEST)
+
+    with pytest.raises(openai.APIConnectionError):
+        await llm_scheduler.acall(create, model=MODEL, messages=MESSAGES)
+
+    assert len(attempts) == 4
+    # Jittered delays of at least half the backoff, doubled on each retry
+    for attempt, (before, after) in enumerate(zip(attempts, attempts[1:])):
+        assert after - before >= min(0.01 * 2**attempt, 0.05) / 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_pauses_model():
+    """A rate limited request holds back the other requests to the model"""
+    llm_scheduler = scheduler(requests_per_minute=6000)
+    sent = []
+
+    async def create(**kwargs):
+        sent.append((kwargs["user"], time.monotonic()))
+        if len(sent) == 1:
+            raise rate_limit_error({"retry-after-ms": "300"})
+        return completion()
+
+    start = time.monotonic()
+    first = asyncio.create_task(
+        llm_scheduler.acall(create, model=MODEL, messages=MESSAGES, user="first")
+    )
+    await asyncio.sleep(0.05)
+    await llm_scheduler.acall(create, model=MODEL, messages=MESSAGES, user="second")
+    await first
+
+    assert sorted(user for user, _ in sent) == ["first", "first", "second"]
+    assert all(at - start >= 0.3 for _, at in sent[1:])
+
+
+@pytest.mark.asyncio
+async def test_bucket_never_exceeded():
+    """Attempts, retries included, never exceed the requests per minute"""
+    requests_per_minute = 120
+    llm_scheduler = scheduler(requests_per_minute=requests_per_minute)
+    attempts: dict[str, int] = {}
+    sent = []
+
+    async def create(**kwargs):
+        sent.append(time.monotonic())
+        attempts[kwargs["user"]] = attempts.get(kwargs["user"], 0) + 1
+        # Every request fails once
+        if attempts[kwargs["user"]] == 1:
+            raise openai.APIConnectionError(request=REQUEST)
+        return completion()
+
+    start = time.monotonic()
+    await asyncio.gather(
+        *[
+            llm_scheduler.acall(create, model=MODEL, messages=MESSAGES, user=str(i))
+            for i in range(62)
+        ]
+    )
+
+    # The bucket holds a minute of requests, then refills at the rate
+    rate = requests_per_minute / 60
+    assert len(sent) == 124
+    for count, at in enumerate(sorted(sent), start=1):
+        assert at - start >= (count - requests_per_minute) / rate - 0.05
+
+
+def test_tokens_reserved_per_attempt():
+    """Each attempt takes its estimated tokens from the bucket"""
+    llm_scheduler = scheduler(tokens_per_minute=100_000)
+    attempts = []
+
+    def create(**kwargs):
+        attempts.append(kwargs)
+        if len(attempts) == 1:
+            raise openai.APIConnectionError(request=REQUEST)
+        return completion()
+
+    llm_scheduler.call(create, model=MODEL, messages=MESSAGES, max_tokens=10_000)
+
+    tokens = llm_scheduler.estimate_tokens(
+        model=MODEL, messages=MESSAGES, max_tokens=10_000
+    )
+    bucket = llm_scheduler.get_queue(MODEL).tokens
+    assert bucket.level <= bucket.capacity - 2 * tokens + 100
@@ -0,0 +1,114 @@
+"""tests/test_validator.py"""
+
+from uuid import uuid4
+
+import pytest
+
+from agentml.agents import Agent, Planner
+from agentml.models import LlmMessage, LlmRole
+from agentml.sandbox import ExecutionResult
+from agentml.sandbox.models import TerminationReason
+from agentml.validator import Validator
+
+DEPRECATION = "/tmp/main.py:3: DeprecationWarning: old API\n  model.fit(X)\n"
+
+
+class StubAgent(Agent):
+    """Agent of the validated runs"""
+
+    def run(self) -> list[LlmMessage]:
+        """Run the agent"""
+        return []
+
+
+def run_output(
+    returncode: int | None = 0,
+    termination: TerminationReason = TerminationReason.COMPLETED,
+    stderr: str = "",
+    files: list[str] | None = None,
+) -> LlmMessage:
+    """Output message of a sandbox execution"""
+    result = ExecutionResult(returncode=returncode, termination=termination)
+    return LlmMessage(
+        role=LlmRole.ASSISTANT,
+        content="Here is the output:\nAccuracy: 0.95",
+        metadata={
+            "execution": result.profile(),
+            "stderr": stderr,
+            "files": files or [],
+        },
+    )
+
+
+def planner(plan: list[dict]) -> Planner:
+    """Planner that generated a plan"""
+    agent = Planner(session_id=uuid4(), objective="Plan the analysis")
+    agent.plan = plan
+    return agent
+
+
+@pytest.mark.parametrize(
+    "message, decision",
+    [
+        (run_output(), "validate"),
+        (run_output(stderr=DEPRECATION), "validate"),
+        (run_output(returncode=1, termination=TerminationReason.ERROR), "retry"),
+        (run_output(returncode=None, termination=TerminationReason.TIMEOUT), "retry"),
+        (run_output(stderr="ERROR: could not converge\n"), None),
+    ],
+)
+def test_classify_execution(message: LlmMessage, decision: str | None):
+    """Failed executions are retried, clean ones validated, and printed errors left to the LLM"""
+    assert Validator.classify_run(message) == decision
+
+
+def test_classify_missing_files():
+    """Runs asked to write files that wrote none are left to the LLM"""
+    agent = StubAgent(session_id=uuid4(), objective="Plot the distributions")
+
+    assert Validator.classify_run(run_output(), agent) is None
+    assert Validator.classify_run(run_output(files=["plot.png"]), agent) == "validate"
+
+
+@pytest.mark.parametrize(
+    "content, decision",
+    [
+        ("The chart shows two clusters.", None),
+        ("Traceback (most recent call last):\n  ...\nValueError: bad image", "retry"),
+    ],
+)
+def test_classify_without_execution(content: str, decision: str | None):
+    """Runs without an execution are only retried on a traceback"""
+    message = LlmMessage(role=LlmRole.ASSISTANT, content=content)
+    assert Validator.classify_run(message) == decision
+
+
+@pytest.mark.parametrize(
+    "plan, decision",
+    [
+        ([{"tool": "Coder", "objective": "Train a model"}], "validate"),
+        ([{"tool": "Coder", "objective": ""}], "retry"),
+        ([{"tool": "Browser", "objective": "Search the web"}], "retry"),
+        ([], None),
+    ],
+)
+def test_classify_plan(plan: list[dict], decision: str | None):
+    """Plans of known tools are validated, and empty plans left to the LLM"""
+    message = LlmMessage(role=LlmRole.ASSISTANT, content="Plan")
+    assert Validator.classify_run(message, planner(plan)) == decision
+
+
+def test_decisions_counted():
+    """Local and LLM decisions are counted to measure the LLM calls avoided"""
+    validator = Validator()
+
+    assert validator.next(run_output()) == "validate"
+    assert validator.next(run_output(stderr="ERROR: failed\n")) is None
+    assert validator.done(run_output(returncode=1)) is False
+    assert validator.done(run_output()) is None
+
+    stats = validator.stats()
+    assert stats["next_local"] == stats["next_llm"] == 1
+    assert stats["done_local"] == stats["done_llm"] == 1
+    assert stats["avoided_calls"] == 2
+    assert stats["avoided_rate"] == 0.5